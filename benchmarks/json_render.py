@@ -0,0 +1,89 @@
+"""Compare the stock DRF JSON renderer with people.renderers.FastJSONRenderer
+
+Renders the /api/location/ and /api/gender/ payload shapes, serialized by
+the real serializers, for a number of locations and reports the time per
+render of both renderers. It runs without a database:
+
+    python benchmarks/json_render.py --locations 1000 10000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "test_people_segmentation.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from rest_framework.renderers import JSONRenderer  # noqa: E402
+
+from people.models import Location  # noqa: E402
+from people.renderers import FastJSONRenderer, orjson  # noqa: E402
+from people.serializers import (  # noqa: E402
+    GenderLocationSerializer, LocationGenderSerializer
+)
+
+
+def location_rows(count: int) -> list:
+    return [{
+        "id": pk,
+        "city": "Місто {}".format(pk) if pk % 3 else None,
+        "region": None if pk % 3 else "Region {}".format(pk),
+        "female": pk % 17,
+        "male": pk % 13,
+        "total": pk % 17 + pk % 13,
+    } for pk in range(1, count + 1)]
+
+
+def location_payload(count: int):
+    return LocationGenderSerializer(location_rows(count), many=True).data
+
+
+def gender_payload(count: int):
+    rows = []
+    for row in location_rows(count):
+        for gender in ("M", "F"):
+            rows.append({"city": row["city"], "region": row["region"],
+                         "person__gender": gender,
+                         "gender_count": row["male" if gender == "M"
+                                             else "female"]})
+    return GenderLocationSerializer(Location.form_data(rows), many=True).data
+
+
+def measure(renderer, data, number: int) -> float:
+    """Best time per render in milliseconds"""
+    times = timeit.repeat(lambda: renderer.render(data), number=number,
+                          repeat=5)
+    return min(times) / number * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--locations", type=int, nargs="+",
+                        default=[100, 1000, 10000])
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+    if orjson is None:
+        print("orjson is not installed, FastJSONRenderer falls back to "
+              "the stock renderer")
+
+    stock, fast = JSONRenderer(), FastJSONRenderer()
+    print("{:<10} {:>9} {:>10} {:>10} {:>8}".format(
+        "payload", "locations", "stock ms", "fast ms", "speedup"))
+    for count in args.locations:
+        for name, build in (("location", location_payload),
+                            ("gender", gender_payload)):
+            data = build(count)
+            assert stock.render(data) == fast.render(data)
+            stock_ms = measure(stock, data, args.number)
+            fast_ms = measure(fast, data, args.number)
+            print("{:<10} {:>9} {:>10.3f} {:>10.3f} {:>7.1f}x".format(
+                name, count, stock_ms, fast_ms, stock_ms / fast_ms))
+
+
+if __name__ == "__main__":
+    main()
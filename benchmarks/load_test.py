@@ -0,0 +1,127 @@
+"""Compare the WSGI and ASGI deployments under concurrent load
+
+Start the deployment to measure, then point the load test at it:
+
+    python manage.py runserver --noreload 8000        # WSGI
+    uvicorn test_people_segmentation.asgi:application  # ASGI
+
+    python benchmarks/load_test.py http://127.0.0.1:8000/api/location/ \
+        --concurrency 50 --duration 30 --pid <server pid>
+
+It reports requests per second, latency percentiles and, with --pid, the
+server's resident memory at rest and under load divided by the number of
+concurrent requests. Run both deployments with the same arguments and
+compare the two reports.
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def rss_bytes(pids) -> int:
+    """Resident memory of the processes and their children (Linux)"""
+    total = 0
+    seen = set()
+    pending = list(pids)
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open("/proc/{}/status".format(pid)) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            with open("/proc/{0}/task/{0}/children".format(pid)) as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Client(threading.Thread):
+    """Sends requests back to back over one keep-alive connection"""
+
+    def __init__(self, url, deadline):
+        super(Client, self).__init__(daemon=True)
+        self.url = urlsplit(url)
+        self.deadline = deadline
+        self.latencies = []
+        self.errors = 0
+
+    def connect(self):
+        cls = http.client.HTTPSConnection if self.url.scheme == "https" \
+            else http.client.HTTPConnection
+        return cls(self.url.hostname, self.url.port, timeout=60)
+
+    def run(self):
+        path = self.url.path or "/"
+        if self.url.query:
+            path = "{}?{}".format(path, self.url.query)
+        connection = self.connect()
+        while time.monotonic() < self.deadline:
+            started = time.monotonic()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    self.errors += 1
+                else:
+                    self.latencies.append(time.monotonic() - started)
+            except (OSError, http.client.HTTPException):
+                self.errors += 1
+                connection.close()
+                connection = self.connect()
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("url")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--pid", type=int, action="append", default=[],
+                        help="Server process id, repeat for several")
+    args = parser.parse_args()
+
+    idle_rss = rss_bytes(args.pid)
+    peak_rss = idle_rss
+    deadline = time.monotonic() + args.duration
+    clients = [Client(args.url, deadline) for _ in range(args.concurrency)]
+    started = time.monotonic()
+    for client in clients:
+        client.start()
+    while any(client.is_alive() for client in clients):
+        peak_rss = max(peak_rss, rss_bytes(args.pid))
+        time.sleep(0.2)
+    elapsed = time.monotonic() - started
+
+    latencies = [l for client in clients for l in client.latencies]
+    errors = sum(client.errors for client in clients)
+    print("url             {}".format(args.url))
+    print("concurrency     {}".format(args.concurrency))
+    print("requests        {} ({} errors)".format(len(latencies), errors))
+    print("requests/s      {:.1f}".format(len(latencies) / elapsed))
+    for name, fraction in (("p50", .5), ("p95", .95), ("p99", .99)):
+        print("latency {}     {:.1f} ms".format(
+            name, percentile(latencies, fraction) * 1000))
+    if args.pid:
+        print("rss idle        {:.1f} MiB".format(idle_rss / 2 ** 20))
+        print("rss peak        {:.1f} MiB".format(peak_rss / 2 ** 20))
+        print("rss/concurrent  {:.1f} KiB".format(
+            (peak_rss - idle_rss) / args.concurrency / 1024))
+
+
+if __name__ == "__main__":
+    main()
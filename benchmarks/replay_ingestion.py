@@ -0,0 +1,102 @@
+"""Replay recorded upstream responses through the ingestion pipeline
+
+Record a store first, by running the workers with UPSTREAM_TRANSPORT set
+to "record" (every run adds one response per upstream request):
+
+    python benchmarks/replay_ingestion.py --record 50
+
+then replay it without network access and report the throughput:
+
+    python benchmarks/replay_ingestion.py --runs 200
+    python benchmarks/replay_ingestion.py --runs 200 --async
+
+--reads-only measures the store alone (no database): --runs passes over
+every recorded response, reporting decompressed responses/s and MB/s.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE",
+                      "test_people_segmentation.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import asyncio  # noqa: E402
+
+from django.conf import settings  # noqa: E402
+
+from people import transport  # noqa: E402
+from people.models import Person  # noqa: E402
+from people.service import (  # noqa: E402
+    get_users_data_from_api, get_users_data_from_api_async
+)
+
+
+def use_transport(mode: str, store_dir: str) -> None:
+    settings.UPSTREAM_TRANSPORT = mode
+    settings.UPSTREAM_STORE_DIR = store_dir
+    transport.reset_upstream_transport()
+
+
+def ingest(runs: int, use_async: bool) -> None:
+    for _ in range(runs):
+        if use_async:
+            asyncio.run(get_users_data_from_api_async())
+        else:
+            get_users_data_from_api()
+
+
+def read_store(store_dir: str, runs: int) -> None:
+    store = transport.ResponseStore(store_dir)
+    keys = store.keys()
+    reads = size = 0
+    started = time.monotonic()
+    for _ in range(runs):
+        for key in keys:
+            for _ in range(store.count(key)):
+                size += len(store.lookup(key)[1])
+                reads += 1
+    elapsed = time.monotonic() - started
+    print("{} responses, {:.1f} MB in {:.3f}s: {:.0f} responses/s, "
+          "{:.1f} MB/s".format(reads, size / 1e6, elapsed, reads / elapsed,
+                               size / 1e6 / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--store", default=settings.UPSTREAM_STORE_DIR)
+    parser.add_argument("--record", type=int, metavar="RUNS",
+                        help="record this many live runs instead")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--reads-only", action="store_true")
+    args = parser.parse_args()
+
+    if args.reads_only:
+        read_store(args.store, args.runs)
+        return
+    if args.record:
+        use_transport(transport.RECORD, args.store)
+        ingest(args.record, args.use_async)
+        print("{} responses recorded in {}".format(
+            len(transport.get_upstream_transport().store), args.store))
+        return
+
+    use_transport(transport.REPLAY, args.store)
+    before = Person.objects.count()
+    started = time.monotonic()
+    ingest(args.runs, args.use_async)
+    elapsed = time.monotonic() - started
+    inserted = Person.objects.count() - before
+    print("{} runs in {:.3f}s: {:.1f} runs/s, {} people inserted, "
+          "{:.0f} people/s".format(args.runs, elapsed, args.runs / elapsed,
+                                   inserted, inserted / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,141 @@
-from django.contrib import admin
+import json
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from people.models import *
 
-admin.site.register(Location)
-admin.site.register(Person)
\ No newline at end of file
+
+def estimate_count(queryset) -> int or None:
+    """Row count of a queryset from the PostgreSQL planner statistics
+
+    An unfiltered table is estimated from pg_class.reltuples summed over
+    its partitions, a filtered queryset from the EXPLAIN row estimate.
+    None on other databases.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            table = queryset.model._meta.db_table
+            cursor.execute(
+                "SELECT coalesce(sum(greatest(c.reltuples, 0)), 0)::bigint "
+                "FROM pg_class c WHERE c.oid = %s::regclass "
+                "OR c.oid IN (SELECT inhrelid FROM pg_inherits "
+                "WHERE inhparent = %s::regclass)", [table, table])
+            return cursor.fetchone()[0]
+        sql, params = queryset.query.sql_with_params()
+        cursor.execute("EXPLAIN (FORMAT JSON) {}".format(sql), params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting big result sets from planner estimates instead
+    of COUNT(*), small ones are still counted exactly"""
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < settings.ADMIN_EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
+
+
+class LocationAdmin(admin.ModelAdmin):
+    list_display = ("id", "city", "region", "generation")
+    search_fields = ("^city", "^region")
+    ordering = ("id",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_delete_permission(self, request, obj=None):
+        # Deleting a location cascades to all of its people, the
+        # confirmation page alone would load every one of them
+        return False
+
+
+class PersonAdmin(admin.ModelAdmin):
+    list_display = ("id", "first_name", "last_name", "gender", "location",
+                    "source", "created_at")
+    list_select_related = ("location",)
+    list_filter = ("gender", ("created_at", admin.DateFieldListFilter))
+    search_fields = ("^last_name",)
+    autocomplete_fields = ("location",)
+    readonly_fields = ("created_at", "source")
+    ordering = ("-id",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ("set_male", "set_female", "delete_people")
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # Replaced by delete_people, which does not load the objects
+        actions.pop("delete_selected", None)
+        return actions
+
+    def set_gender(self, request, queryset, gender):
+        updated = Person.update_many(queryset, gender=gender)
+        self.message_user(request, "{} people updated.".format(updated),
+                          messages.SUCCESS)
+
+    def set_male(self, request, queryset):
+        self.set_gender(request, queryset, Person.GENDER_MALE)
+    set_male.short_description = "Mark selected people as male"
+
+    def set_female(self, request, queryset):
+        self.set_gender(request, queryset, Person.GENDER_FEMALE)
+    set_female.short_description = "Mark selected people as female"
+
+    def delete_people(self, request, queryset):
+        deleted = Person.delete_many(queryset)
+        self.message_user(request, "{} people deleted.".format(deleted),
+                          messages.SUCCESS)
+    delete_people.short_description = "Delete selected people"
+    delete_people.allowed_permissions = ("delete",)
+
+    def save_model(self, request, obj, form, change):
+        """Keep the daily rollups and location generations in sync"""
+        if not change:
+            Person.create_many([obj], source="admin")
+            return
+        if {"gender", "location"} & set(form.changed_data):
+            Person.update_many(Person.objects.filter(pk=obj.pk),
+                               gender=obj.gender, location_id=obj.location_id)
+        super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        Person.delete_many(Person.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        Person.delete_many(queryset)
+
+
+admin.site.register(Location, LocationAdmin)
+admin.site.register(Person, PersonAdmin)
+
+
+class IngestionRunAdmin(admin.ModelAdmin):
+    list_display = ("started_at", "source", "status", "rows_fetched",
+                    "rows_inserted", "rows_skipped", "duration_ms",
+                    "fetch_ms", "validate_ms", "persist_ms",
+                    "upstream_status", "upstream_latency_ms")
+    list_filter = ("status", "source",
+                   ("started_at", admin.DateFieldListFilter))
+    search_fields = ("error",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(IngestionRun, IngestionRunAdmin)
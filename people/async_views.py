@@ -0,0 +1,139 @@
+"""Async entry points of the API for the ASGI deployment
+
+Django 2.2 can only run synchronous views, so requests are handed to the
+regular Django handler on a thread pool, the same work a WSGI worker does.
+The only network wait moved out of the handler is the ingestion of
+GET /api/location/ with INGEST_ON_REQUEST: the upstream APIs are queried
+concurrently, each blocking request on a thread of the upstream pool (see
+GetDataFromApi.get_response_async), then the handler thread only runs the
+database queries and the rendering.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from people.upstreams import UPSTREAM_ERRORS
+from people.views import INGESTION_ENVIRON_KEY
+from people.workers import get_users_data_from_api_async
+
+
+_handler = None
+_executor = None
+
+
+def get_handler() -> WSGIHandler:
+    global _handler
+    if _handler is None:
+        _handler = WSGIHandler()
+    return _handler
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.ASGI_THREADS)
+    return _executor
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    return body
+
+
+def build_environ(scope, body: bytes) -> dict:
+    """WSGI environ of an ASGI http scope"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope.get("http_version", "1.1")),
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+            continue
+        key = "HTTP_{}".format(name)
+        if key in environ:
+            value = "{},{}".format(environ[key], value)
+        environ[key] = value
+    return environ
+
+
+def call_handler(environ: dict) -> tuple:
+    """Run the Django handler, return (status, headers, body)"""
+    result = dict()
+
+    def start_response(status, headers, exc_info=None):
+        result["status"] = int(status.split(" ", 1)[0])
+        result["headers"] = headers
+
+    response = get_handler()(environ, start_response)
+    try:
+        body = b"".join(response)
+    finally:
+        if hasattr(response, "close"):
+            response.close()
+    return result["status"], result["headers"], body
+
+
+async def dispatch(scope, receive, send, **extra) -> None:
+    """Serve a request with the synchronous Django stack on a thread"""
+    environ = build_environ(scope, await read_body(receive))
+    environ.update(extra)
+    loop = asyncio.get_running_loop()
+    status, headers, body = await loop.run_in_executor(
+        get_executor(), call_handler, environ)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin1"),
+                     value.strip().encode("latin1"))
+                    for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def location_list(scope, receive, send) -> None:
+    """LocationPersonCountByGenderViewSet.list, ingesting concurrently on
+    the upstream pool first with INGEST_ON_REQUEST"""
+    if scope["method"] != "GET" or not settings.INGEST_ON_REQUEST:
+        return await dispatch(scope, receive, send)
+    try:
+        await get_users_data_from_api_async()
+        ingested = True
+    except UPSTREAM_ERRORS as e:
+        # Re-raised in the view, so the error response and its handling
+        # stay the same as with WSGI
+        ingested = e
+    await dispatch(scope, receive, send, **{INGESTION_ENVIRON_KEY: ingested})
+
+
+async def gender_list(scope, receive, send) -> None:
+    """GenderPersonCountByLocationViewSet.list on the handler pool, it does
+    not wait on anything but the database"""
+    await dispatch(scope, receive, send)
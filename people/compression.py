@@ -0,0 +1,119 @@
+"""Cache of rendered aggregate responses, precompressed once per generation
+
+A body is rendered, compressed with every available encoding and stored
+under a key made of the path, the query string, the location change
+generation (see Location.touch) and the encoding. Later requests of the
+same generation get the variant matching their Accept-Encoding straight
+from the cache, without querying, rendering or compressing again. Brotli
+is used when the brotli package is installed.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+IDENTITY = "identity"
+# Bodies shorter than this are not worth compressing (as GZipMiddleware)
+MIN_LENGTH = 200
+BROTLI_QUALITY = 5
+
+
+def available_encodings() -> tuple:
+    """Supported encodings, most preferred first"""
+    if brotli is not None:
+        return "br", "gzip"
+    return "gzip",
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Best available encoding accepted by the client, identity if none"""
+    weights = dict()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        params = params.strip().lower()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name] = weight
+    best, best_weight = IDENTITY, 0.0
+    for encoding in available_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes) -> dict:
+    """Return {encoding: body} of every variant worth storing"""
+    variants = {IDENTITY: body}
+    if len(body) < MIN_LENGTH:
+        return variants
+    variants["gzip"] = compress_string(body)
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return {encoding: data for encoding, data in variants.items()
+            if encoding == IDENTITY or len(data) < len(body)}
+
+
+def cache_key(request, generation: int, encoding: str) -> str:
+    query = "&".join(sorted(request.META.get("QUERY_STRING", "").split("&")))
+    digest = hashlib.md5("{}?{}".format(request.path, query).encode())\
+        .hexdigest()
+    return "people.response.{}.{}.{}".format(generation, encoding, digest)
+
+
+def set_body(response, encoding: str, body: bytes) -> None:
+    response.content = body
+    if encoding != IDENTITY:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+
+
+def get_cached_response(request, generation: int) -> HttpResponse or None:
+    """Cached response in the encoding the client prefers"""
+    cache = caches[settings.RESPONSE_CACHE_ALIAS]
+    encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    keys = [cache_key(request, generation, encoding)]
+    if encoding != IDENTITY:
+        # Small bodies are only stored uncompressed
+        keys.append(cache_key(request, generation, IDENTITY))
+    cached = cache.get_many(keys)
+    for key in keys:
+        if key in cached:
+            response = HttpResponse(content_type="application/json")
+            set_body(response, IDENTITY if key != keys[0] else encoding,
+                     cached[key])
+            return response
+    return None
+
+
+def cache_response(request, generation: int, response) -> None:
+    """Compress a rendered response, store every variant and answer with
+    the one the client prefers"""
+    if response.status_code != 200 or response.has_header("Content-Encoding"):
+        return
+    variants = compress(response.content)
+    cache = caches[settings.RESPONSE_CACHE_ALIAS]
+    cache.set_many({
+        cache_key(request, generation, encoding): body
+        for encoding, body in variants.items()
+    }, settings.RESPONSE_CACHE_TIMEOUT)
+    encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    if encoding not in variants:
+        encoding = IDENTITY
+    set_body(response, encoding, variants[encoding])
@@ -0,0 +1,299 @@
+"""Server-Sent Events stream of location count changes
+
+A single LocationChangeBroadcaster per process polls the location change
+generation (see Location.touch) and fans the changed counts out to every
+connected client, so the database load does not depend on the number of
+listeners. Each client keeps at most one pending, coalesced update.
+Changes are keyed by location id, each carrying its city and region, since
+a city and a region may share a name.
+
+The state a client starts from is served from one in-memory snapshot of
+every location, loaded once from the daily rollups while anybody listens
+and kept current by the polls, so (re)connecting clients do not query the
+database.
+
+Like "/api/location/changes/" the poller reads from the read replica (see
+people.routers), the token and the counts of a poll from the same one.
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from people.models import Location
+from people.routers import replica_reads
+from people.serializers import LocationLookupResultSerializer
+
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_token() -> int:
+    close_old_connections()
+    with replica_reads():
+        return Location.current_generation()
+
+
+def fetch_changes(since: int or None) -> tuple:
+    """Return (token, {location id: counts}) of changes after since, of
+    every location when since is None"""
+    close_old_connections()
+    with replica_reads():
+        token = Location.current_generation()
+        if since is not None and token <= since:
+            return token, dict()
+        queryset = Location.get_person_counts()
+        if since is not None:
+            queryset = queryset.filter(generation__gt=since)
+        return token, {
+            str(row["id"]): LocationLookupResultSerializer(row).data
+            for row in queryset
+        }
+
+
+def fetch_snapshot() -> tuple:
+    """Return (token, {location id: (generation, counts)}) of every
+    location, counted from the daily rollups"""
+    close_old_connections()
+    with replica_reads():
+        token = Location.current_generation()
+        generations = dict(Location.objects.values_list("id", "generation"))
+        return token, {
+            str(row["id"]): (generations.get(row["id"], 0),
+                             LocationLookupResultSerializer(row).data)
+            for row in Location.get_counts()
+        }
+
+
+class Subscriber:
+    """One client connection waiting for updates"""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = dict()
+        self.token = None
+        self.closed = False
+        self.overflowed = False
+        self.event = asyncio.Event()
+
+    def publish(self, token: int, changes: dict) -> None:
+        """Merge changes into the pending update, newer counts win"""
+        self.pending.update(changes)
+        self.token = max(token, self.token or 0)
+        if len(self.pending) > self.max_pending:
+            self.overflowed = True
+        self.event.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.event.set()
+
+    async def get(self, timeout: float) -> tuple or None:
+        """Wait for the next (token, changes), None on timeout"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.event.clear()
+        changes, self.pending = self.pending, dict()
+        return self.token, changes
+
+
+class LocationChangeBroadcaster:
+    """Polls for committed changes while anybody listens and fans them out"""
+
+    def __init__(self, poll_interval: float, max_pending: int,
+                 fetch=fetch_changes, fetch_token=fetch_token,
+                 fetch_snapshot=fetch_snapshot):
+        self.poll_interval = poll_interval
+        self.max_pending = max_pending
+        self.fetch = fetch
+        self.fetch_token = fetch_token
+        self.fetch_snapshot = fetch_snapshot
+        self.subscribers = set()
+        self.token = None
+        self._task = None
+        # (token, {location id: (generation, counts)}), valid while polling
+        self._snapshot = None
+        self._snapshot_loading = None
+        # One thread, so the poller holds a single database connection
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def run_in_executor(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def start(self) -> None:
+        """Take the current token as baseline before the first client reads
+        its initial state, so no change can fall between the two"""
+        if self.token is None:
+            self.token = await self.run_in_executor(self.fetch_token)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(self.max_pending)
+        self.subscribers.add(subscriber)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+        subscriber.close()
+
+    def merge_snapshot(self, token: int, changes: dict) -> None:
+        if self._snapshot is None or token <= self._snapshot[0]:
+            # Changes the snapshot was read after are already in it
+            return
+        entries = self._snapshot[1]
+        entries.update({key: (token, counts)
+                        for key, counts in changes.items()})
+        self._snapshot = token, entries
+
+    async def load_snapshot(self) -> tuple:
+        token, entries = await self.run_in_executor(self.fetch_snapshot)
+        while self.token is not None and self.token > token:
+            # Polls published changes that are not in the snapshot yet
+            token, changes = await self.run_in_executor(self.fetch, token)
+            entries.update({key: (token, counts)
+                            for key, counts in changes.items()})
+        self._snapshot = token, entries
+        return self._snapshot
+
+    async def snapshot(self) -> tuple:
+        """Shared (token, {location id: (generation, counts)}) of every
+        location, loaded once while clients are connected"""
+        if self._snapshot is not None:
+            return self._snapshot
+        if self._snapshot_loading is None or self._snapshot_loading.done():
+            self._snapshot_loading = asyncio.ensure_future(
+                self.load_snapshot())
+        # Shielded: a client going away does not cancel the others
+        return await asyncio.shield(self._snapshot_loading)
+
+    async def initial_state(self, since: int or None) -> tuple:
+        """(token, changes) a client starts from: the locations changed
+        after since, every location when since is None"""
+        token, entries = await self.snapshot()
+        return token, {
+            key: counts for key, (generation, counts) in entries.items()
+            if since is None or generation > since
+        }
+
+    async def poll(self) -> None:
+        token, changes = await self.run_in_executor(self.fetch, self.token)
+        if changes:
+            self.merge_snapshot(token, changes)
+            for subscriber in list(self.subscribers):
+                subscriber.publish(token, changes)
+        self.token = token
+
+    async def run(self) -> None:
+        await self.start()
+        self._snapshot = None
+        try:
+            while self.subscribers:
+                try:
+                    await self.poll()
+                except Exception:
+                    # Keep serving idle clients through a database hiccup
+                    logger.exception("Polling location changes failed")
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            # Nobody keeps it current any more
+            self._snapshot = None
+
+    async def stop(self) -> None:
+        for subscriber in list(self.subscribers):
+            self.unsubscribe(subscriber)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_broadcaster = None
+
+
+def get_broadcaster() -> LocationChangeBroadcaster:
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = LocationChangeBroadcaster(
+            settings.SSE_POLL_INTERVAL, settings.SSE_MAX_PENDING)
+    return _broadcaster
+
+
+def format_event(token: int, changes: dict) -> bytes:
+    data = json.dumps({"token": token, "changes": changes},
+                      separators=(",", ":"), ensure_ascii=False)
+    return "id: {}\nevent: locations\ndata: {}\n\n".format(token, data)\
+        .encode()
+
+
+def get_since(scope) -> int or None:
+    """Resume token from ?since= or the Last-Event-ID reconnect header"""
+    query = parse_qs(scope.get("query_string", b"").decode())
+    values = query.get("since", [])
+    for name, value in scope.get("headers", []):
+        if name.lower() == b"last-event-id":
+            values = [value.decode()]
+    try:
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
+
+
+async def location_stream(scope, receive, send) -> None:
+    """ASGI handler streaming location count changes as SSE"""
+    broadcaster = get_broadcaster()
+    await broadcaster.start()
+    subscriber = broadcaster.subscribe()
+
+    async def wait_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        subscriber.close()
+
+    disconnect = asyncio.ensure_future(wait_disconnect())
+
+    async def emit(body: bytes) -> None:
+        await asyncio.wait_for(send({
+            "type": "http.response.body", "body": body, "more_body": True
+        }), settings.SSE_SEND_TIMEOUT)
+
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+        token, changes = await broadcaster.initial_state(get_since(scope))
+        await emit(format_event(token, changes))
+        while not subscriber.closed:
+            update = await subscriber.get(settings.SSE_HEARTBEAT)
+            if subscriber.closed or subscriber.overflowed:
+                # Too far behind: the client reconnects with its last
+                # event id and catches up from the database.
+                break
+            if update is None:
+                await emit(b": keep-alive\n\n")
+            elif update[0] > token:
+                token = update[0]
+                await emit(format_event(*update))
+        if not disconnect.done():
+            await send({"type": "http.response.body", "body": b""})
+    except (asyncio.TimeoutError, OSError):
+        pass
+    finally:
+        broadcaster.unsubscribe(subscriber)
+        disconnect.cancel()
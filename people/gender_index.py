@@ -0,0 +1,220 @@
+import fcntl
+import itertools
+import logging
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class NameGenderIndex:
+    """Offline name -> (gender, probability) dictionary
+
+    The bundled index is a sorted text file with one "name<TAB>gender<TAB>
+    probability" record per line. It is memory-mapped and searched with a
+    binary search over byte offsets, so opening it does not depend on the
+    dictionary size. Names learned from Genderize are appended to a small
+    companion file and kept in memory until the index is rebuilt. Every
+    append is a single write under an exclusive lock of that file, so
+    processes sharing it never interleave records.
+    """
+
+    def __init__(self, path: str, learned_path: str = None):
+        self.path = path
+        self.learned_path = learned_path or "{}.learned".format(path)
+        self._mm = None
+        self._cache = dict()
+        self._learned = dict()
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            self._mm = None
+        try:
+            with open(self.learned_path, "rb") as f:
+                self._learned = self._read_learned(f)
+        except FileNotFoundError:
+            pass
+
+    @classmethod
+    def _read_learned(cls, f) -> dict:
+        learned = dict()
+        for line in f:
+            record = cls._parse_line(line.rstrip(b"\n"))
+            if record:
+                learned[record[0]] = record[1:]
+        return learned
+
+    @contextmanager
+    def locked_learned(self):
+        """Open the learned names file exclusively locked against other
+        processes, creating it and its directory when missing"""
+        os.makedirs(os.path.dirname(os.path.abspath(self.learned_path)),
+                    exist_ok=True)
+        fd = os.open(self.learned_path, os.O_RDWR | os.O_APPEND | os.O_CREAT,
+                     0o644)
+        with open(fd, "r+b", buffering=0) as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return name.strip().lower()
+
+    @staticmethod
+    def _parse_line(line: bytes) -> Optional[Tuple[str, str, float]]:
+        parts = line.split(b"\t")
+        if len(parts) != 3:
+            return None
+        return parts[0].decode(), parts[1].decode(), float(parts[2])
+
+    @staticmethod
+    def _format_line(name: str, gender: str, probability: float) -> bytes:
+        return "{}\t{}\t{:.2f}\n".format(name, gender, probability).encode()
+
+    def _search(self, key: bytes) -> Optional[bytes]:
+        """Binary search the mapped file for the line starting with key"""
+        mm = self._mm
+        if mm is None:
+            return None
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            newline = mm.rfind(b"\n", lo, mid)
+            start = lo if newline < 0 else newline + 1
+            end = mm.find(b"\n", start, hi)
+            if end < 0:
+                end = hi
+            line = mm[start:end]
+            name = line.split(b"\t", 1)[0]
+            if name == key:
+                return line
+            if name < key:
+                lo = end + 1
+            else:
+                hi = start
+        return None
+
+    def lookup(self, name: str) -> Optional[Tuple[str, float]]:
+        """Return (gender, probability) for name or None if it is unknown"""
+        name = self.normalize(name)
+        if name in self._learned:
+            return self._learned[name]
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        line = self._search(name.encode())
+        record = self._parse_line(line)[1:] if line else None
+        self._cache[name] = record
+        return record
+
+    def add(self, name: str, gender: str, probability: float) -> None:
+        """Remember a name resolved by the API, persisting it on disk when
+        the learned names file is writable"""
+        name = self.normalize(name)
+        if not name or "\t" in name or "\n" in name:
+            return
+        with self._lock:
+            if self._learned.get(name) == (gender, probability):
+                return
+            self._learned[name] = (gender, probability)
+            try:
+                with self.locked_learned() as f:
+                    f.write(self._format_line(name, gender, probability))
+            except OSError as e:
+                # Still known to this process, asked again after a restart
+                logger.warning("Cannot persist learned name to %s: %s",
+                               self.learned_path, e)
+
+    def rebuild(self, records: Iterable[Tuple[str, str, float]],
+                replace: bool = False) -> None:
+        """Write the index from records, merged over the current index and
+        the names learned by every process unless replace, and empty the
+        learned names file"""
+        with self.locked_learned() as f:
+            if not replace:
+                f.seek(0)
+                records = itertools.chain(
+                    self.items(self._read_learned(f)), records)
+            self.build(self.path, records)
+            f.truncate(0)
+        with self._lock:
+            self._learned = dict()
+
+    def items(self, learned: dict = None) -> Iterable[Tuple[str, str, float]]:
+        """Iterate over all records, learned names (of this process unless
+        given) override bundled ones"""
+        records = dict()
+        if self._mm is not None:
+            for line in iter(self._mm.readline, b""):
+                record = self._parse_line(line.rstrip(b"\n"))
+                if record:
+                    records[record[0]] = record[1:]
+            self._mm.seek(0)
+        records.update(self._learned if learned is None else learned)
+        for name in sorted(records):
+            yield (name,) + records[name]
+
+    @classmethod
+    def build(cls, path: str,
+              records: Iterable[Tuple[str, str, float]]) -> None:
+        """Write a sorted index file, replacing the old one atomically"""
+        merged = dict()
+        for name, gender, probability in records:
+            name = cls.normalize(name)
+            if name and "\t" not in name and "\n" not in name:
+                merged[name] = (gender, float(probability))
+        tmp_path = "{}.tmp".format(path)
+        with open(tmp_path, "wb") as f:
+            for name in sorted(merged, key=lambda n: n.encode()):
+                f.write(cls._format_line(name, *merged[name]))
+        os.replace(tmp_path, path)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_learned_path() -> str:
+    return os.path.join(settings.GENDER_INDEX_LEARNED_DIR,
+                        "{}.learned".format(
+                            os.path.basename(settings.GENDER_INDEX_PATH)))
+
+
+def get_gender_index() -> NameGenderIndex:
+    """Process-wide index, opened on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = NameGenderIndex(settings.GENDER_INDEX_PATH,
+                                         get_learned_path())
+    return _index
+
+
+def reset_gender_index() -> None:
+    global _index
+    with _index_lock:
+        if _index is not None:
+            _index.close()
+        _index = None
@@ -0,0 +1,79 @@
+"""Ledger of ingestion runs
+
+GetDataFromApi wraps every worker run in an IngestionRecorder, which times
+the fetch, validate and persist phases, counts the rows and notes the
+upstream status and latency, then stores one IngestionRun whether the run
+succeeded or failed.
+"""
+import time
+from contextlib import contextmanager
+
+from rest_framework.exceptions import APIException
+
+from people.models import IngestionRun
+from people.profiling import collect_http_calls
+
+
+def error_message(error: Exception) -> str:
+    if isinstance(error, APIException) and isinstance(error.detail, list):
+        return "; ".join(str(detail) for detail in error.detail)
+    return "{}: {}".format(type(error).__name__, error)
+
+
+class IngestionRecorder:
+    """Collect the metrics of one worker run"""
+
+    PHASES = ("fetch", "validate", "persist")
+
+    def __init__(self, source: str):
+        self.run = IngestionRun(source=source)
+        self._started = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a phase, the fetch phase also notes the upstream calls"""
+        if name not in self.PHASES:
+            raise ValueError("Unknown ingestion phase: {}".format(name))
+        started = time.monotonic()
+        try:
+            if name == "fetch":
+                with collect_http_calls() as calls:
+                    yield
+            else:
+                yield
+        finally:
+            field = "{}_ms".format(name)
+            spent = (time.monotonic() - started) * 1000
+            setattr(self.run, field, (getattr(self.run, field) or 0) + spent)
+            if name == "fetch":
+                self.add_upstream_calls(calls)
+
+    def add_upstream_calls(self, calls: list) -> None:
+        if not calls:
+            return
+        self.run.upstream_status = calls[-1]["status"]
+        self.run.upstream_latency_ms = (self.run.upstream_latency_ms or 0) \
+            + sum(call["duration_ms"] for call in calls)
+
+    def add_rows(self, fetched: int, inserted: int) -> None:
+        self.run.rows_fetched += fetched
+        self.run.rows_inserted += inserted
+
+    def fail(self, error: Exception) -> None:
+        self.run.status = IngestionRun.STATUS_FAILED
+        self.run.error = error_message(error)
+
+    def finish(self) -> IngestionRun:
+        self.run.duration_ms = (time.monotonic() - self._started) * 1000
+        self.run.rows_skipped = max(
+            self.run.rows_fetched - self.run.rows_inserted, 0)
+        for field in ("duration_ms", "fetch_ms", "validate_ms",
+                      "persist_ms", "upstream_latency_ms"):
+            value = getattr(self.run, field)
+            if value is not None:
+                setattr(self.run, field, round(value, 3))
+        self.save()
+        return self.run
+
+    def save(self) -> None:
+        self.run.save()
@@ -0,0 +1,124 @@
+import threading
+from typing import Dict, Iterable, List
+
+from django.db import connections, router, transaction
+
+from people.models import Location
+
+
+class LocationResolver:
+    """Map city/region names to Location ids without get_or_create races
+
+    Known names are served from a process-local cache that is warmed with
+    every Location on first use. Unknown names of a batch are inserted in a
+    single INSERT ... ON CONFLICT DO NOTHING statement, rows created by a
+    concurrent ingestion run are then read back in one SELECT, so parallel
+    workers never see an IntegrityError and never need to retry. Resolved
+    ids are cached once the transaction commits, so a rolled back insert
+    never leaves an id of a missing row in the cache.
+    """
+
+    FIELDS = ("city", "region")
+
+    def __init__(self):
+        self._ids = {field: dict() for field in self.FIELDS}
+        self._lock = threading.Lock()
+        self._warmed = False
+
+    def _load_all(self) -> Iterable[tuple]:
+        return Location.objects.using(router.db_for_write(Location))\
+            .values_list("id", "city", "region").iterator()
+
+    def warm(self) -> None:
+        """Load every known location into the cache"""
+        ids = {field: dict() for field in self.FIELDS}
+        for pk, city, region in self._load_all():
+            if city is not None:
+                ids["city"][city] = pk
+            if region is not None:
+                ids["region"][region] = pk
+        with self._lock:
+            for field in self.FIELDS:
+                ids[field].update(self._ids[field])
+            self._ids = ids
+            self._warmed = True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids = {field: dict() for field in self.FIELDS}
+            self._warmed = False
+
+    def _insert_missing(self, field: str, names: List[str]) -> Dict[str, int]:
+        """Insert names that do not exist yet, return the ids created here"""
+        db = router.db_for_write(Location)
+        connection = connections[db]
+        if connection.vendor != "postgresql":
+            Location.objects.using(db).bulk_create(
+                [Location(**{field: name}) for name in names],
+                ignore_conflicts=True
+            )
+            return dict()
+        column = connection.ops.quote_name(Location._meta.get_field(field).column)
+        sql = "INSERT INTO {table} ({column}) " \
+              "SELECT unnest(%s::varchar[]) " \
+              "ON CONFLICT DO NOTHING " \
+              "RETURNING id, {column}".format(
+                table=connection.ops.quote_name(Location._meta.db_table),
+                column=column)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [names])
+            return {name: pk for pk, name in cursor.fetchall()}
+
+    def _select(self, field: str, names: Iterable[str]) -> Dict[str, int]:
+        queryset = Location.objects.using(router.db_for_write(Location))\
+            .filter(**{"{}__in".format(field): list(names)})\
+            .values_list(field, "id")
+        return dict(queryset)
+
+    def resolve(self, field: str, names: Iterable[str]) -> Dict[str, int]:
+        """Return {name: location id} for every name, creating missing ones"""
+        if field not in self.FIELDS:
+            raise ValueError("Unknown location field: {}".format(field))
+        if not self._warmed:
+            self.warm()
+        cache = self._ids[field]
+        result = dict()
+        missing = set()
+        for name in names:
+            if name is None:
+                continue
+            pk = cache.get(name)
+            if pk is None:
+                missing.add(name)
+            else:
+                result[name] = pk
+        if missing:
+            # Sorted inserts make concurrent batches wait on each other's
+            # unique index entries in the same order, so they cannot deadlock.
+            found = self._insert_missing(field, sorted(missing))
+            if len(found) < len(missing):
+                found.update(self._select(field, missing - found.keys()))
+            self._cache_on_commit(field, found)
+            result.update(found)
+        return result
+
+    def _cache_on_commit(self, field: str, ids: Dict[str, int]) -> None:
+        def cache():
+            with self._lock:
+                self._ids[field].update(ids)
+
+        transaction.on_commit(cache, using=router.db_for_write(Location))
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def get_location_resolver() -> LocationResolver:
+    """Process-wide resolver shared by all ingestion workers"""
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                _resolver = LocationResolver()
+    return _resolver
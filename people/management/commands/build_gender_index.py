@@ -0,0 +1,50 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from people.gender_index import (
+    NameGenderIndex, get_learned_path, reset_gender_index
+)
+
+
+class Command(BaseCommand):
+    help = "Rebuild the offline name -> gender index from CSV files " \
+           "(name,gender,probability) and the names learned from Genderize"
+
+    GENDERS = {"m": "M", "male": "M", "f": "F", "female": "F"}
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="*")
+        parser.add_argument("--replace", action="store_true",
+                            help="Drop the current index instead of merging")
+
+    def read_csv(self, path):
+        with open(path, newline="") as f:
+            for row in csv.reader(f):
+                if len(row) < 2:
+                    continue
+                gender = self.GENDERS.get(row[1].strip().lower())
+                if gender is None:
+                    continue
+                try:
+                    probability = float(row[2]) if len(row) > 2 else 1.0
+                except ValueError:
+                    continue
+                yield row[0], gender, probability
+
+    def handle(self, *args, **options):
+        path = settings.GENDER_INDEX_PATH
+        records = []
+        for file_path in options["files"]:
+            try:
+                records.extend(self.read_csv(file_path))
+            except FileNotFoundError:
+                raise CommandError("File not found: {}".format(file_path))
+        index = NameGenderIndex(path, get_learned_path())
+        try:
+            index.rebuild(records, replace=options["replace"])
+        finally:
+            index.close()
+        reset_gender_index()
+        self.stdout.write("Index written to {}".format(path))
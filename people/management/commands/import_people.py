@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from people.models import (
+    ChangeGeneration, Location, Person, PersonDailyCount
+)
+
+
+COLUMNS = ("first_name", "last_name", "gender", "city", "region")
+GENDERS = {"m": "M", "male": "M", "f": "F", "female": "F"}
+
+
+# Longest value of every text column, longer ones would abort the COPY
+MAX_LENGTHS = {
+    "first_name": Person._meta.get_field("first_name").max_length,
+    "last_name": Person._meta.get_field("last_name").max_length,
+    "city": Location._meta.get_field("city").max_length,
+    "region": Location._meta.get_field("region").max_length,
+}
+
+
+def text_value(row: dict, field: str) -> str or None:
+    """Stripped text of a field, "" if missing, None if it is unusable"""
+    value = row.get(field)
+    if value is None:
+        return ""
+    if not isinstance(value, str) or "\x00" in value:
+        return None
+    value = value.strip()
+    if len(value) > MAX_LENGTHS[field]:
+        return None
+    return value
+
+
+def normalize_row(row: dict) -> tuple or None:
+    """Convert an input record to a staging row, None if it is unusable"""
+    if not isinstance(row, dict):
+        return None
+    gender = GENDERS.get(str(row.get("gender") or "").strip().lower())
+    first_name, last_name, city, region = (
+        text_value(row, field)
+        for field in ("first_name", "last_name", "city", "region"))
+    if None in (city, region):
+        return None
+    city, region = city or None, region or None
+    if not gender or not first_name or not last_name:
+        return None
+    if city is None and region is None:
+        return None
+    return first_name, last_name, gender, city, None if city else region
+
+
+def read_rows(f, file_format: str):
+    """Yield dicts from a CSV (with header) or NDJSON file"""
+    if file_format == "csv":
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield dict()
+
+
+def copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return value.replace("\\", "\\\\").replace("\t", "\\t")\
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
+class CopyStream(io.RawIOBase):
+    """File-like object feeding rows to COPY FROM STDIN in text format"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                row = next(self.rows)
+            except StopIteration:
+                break
+            self.buffer += ("\t".join(copy_value(v) for v in row) + "\n")\
+                .encode()
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+class Command(BaseCommand):
+    help = "Bulk import people from CSV or NDJSON files with " \
+           "columns first_name, last_name, gender and city or region"
+
+    STAGING_TABLE = "people_import"
+    SOURCE = "import"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+")
+        parser.add_argument("--format", choices=("csv", "ndjson"),
+                            help="Input format, guessed from the extension "
+                                 "by default")
+
+    def get_format(self, path, options):
+        if options["format"]:
+            return options["format"]
+        if path.endswith((".ndjson", ".jsonl", ".json")):
+            return "ndjson"
+        return "csv"
+
+    def staged_rows(self, paths, options):
+        for path in paths:
+            file_format = self.get_format(path, options)
+            try:
+                with open(path, newline="") as f:
+                    for row in read_rows(f, file_format):
+                        self.read += 1
+                        data = normalize_row(row)
+                        if data is None:
+                            self.skipped += 1
+                            continue
+                        yield data
+            except FileNotFoundError:
+                raise CommandError("File not found: {}".format(path))
+
+    def merge(self, cursor, created_at) -> int:
+        """Create missing locations, insert people, their daily rollups and
+        location totals and bump the generation of the touched locations in
+        set-based SQL"""
+        qn = cursor.db.ops.quote_name
+        location = qn(Location._meta.db_table)
+        person = qn(Person._meta.db_table)
+        daily_count = qn(PersonDailyCount._meta.db_table)
+        inserted = 0
+        for field in ("city", "region"):
+            cursor.execute(
+                "INSERT INTO {location} ({field}) "
+                "SELECT DISTINCT {field} FROM {staging} "
+                "WHERE {field} IS NOT NULL "
+                "ON CONFLICT DO NOTHING".format(
+                    location=location, field=field,
+                    staging=self.STAGING_TABLE))
+            cursor.execute(
+                "INSERT INTO {person} (first_name, last_name, gender, "
+                "location_id, created_at, source) "
+                "SELECT i.first_name, i.last_name, i.gender, l.id, %s, %s "
+                "FROM {staging} i JOIN {location} l "
+                "ON l.{field} = i.{field}".format(
+                    person=person, location=location, field=field,
+                    staging=self.STAGING_TABLE),
+                [created_at, self.SOURCE])
+            inserted += cursor.rowcount
+            cursor.execute(
+                "INSERT INTO {daily_count} (location_id, gender, day, count) "
+                "SELECT l.id, i.gender, %s, count(*) "
+                "FROM {staging} i JOIN {location} l "
+                "ON l.{field} = i.{field} "
+                "GROUP BY l.id, i.gender "
+                "ON CONFLICT (day, location_id, gender) "
+                "DO UPDATE SET count = {daily_count}.count + "
+                "EXCLUDED.count".format(
+                    daily_count=daily_count, location=location, field=field,
+                    staging=self.STAGING_TABLE),
+                [created_at.date()])
+            cursor.execute(
+                "UPDATE {location} SET "
+                "female_count = {location}.female_count + s.female, "
+                "male_count = {location}.male_count + s.male, "
+                "total_count = {location}.total_count + s.female + s.male "
+                "FROM (SELECT l.id, "
+                "count(*) FILTER (WHERE i.gender = 'F') AS female, "
+                "count(*) FILTER (WHERE i.gender = 'M') AS male "
+                "FROM {staging} i JOIN {location} l "
+                "ON l.{field} = i.{field} GROUP BY l.id) s "
+                "WHERE {location}.id = s.id".format(
+                    location=location, field=field,
+                    staging=self.STAGING_TABLE))
+        cursor.execute(
+            "UPDATE {location} SET generation = %s "
+            "WHERE city IN (SELECT city FROM {staging}) "
+            "OR region IN (SELECT region FROM {staging})".format(
+                location=location, staging=self.STAGING_TABLE),
+            [ChangeGeneration.next()])
+        return inserted
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(Person)]
+        if connection.vendor != "postgresql":
+            raise CommandError("import_people requires PostgreSQL")
+        self.read = self.skipped = 0
+        started = time.monotonic()
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "CREATE TEMPORARY TABLE {} ("
+                    "first_name varchar(250), last_name varchar(250), "
+                    "gender varchar(1), city varchar(250), "
+                    "region varchar(250)) ON COMMIT DROP".format(
+                        self.STAGING_TABLE))
+                cursor.copy_expert(
+                    "COPY {} ({}) FROM STDIN".format(
+                        self.STAGING_TABLE, ", ".join(COLUMNS)),
+                    CopyStream(self.staged_rows(options["files"], options))
+                )
+                cursor.execute("ANALYZE {}".format(self.STAGING_TABLE))
+                inserted = self.merge(cursor, timezone.now())
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.stdout.write(
+            "Imported {} of {} rows ({} skipped) in {:.2f}s, "
+            "{:.0f} rows/s".format(inserted, self.read, self.skipped,
+                                   elapsed, inserted / elapsed))
@@ -0,0 +1,43 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from people.workers import get_users_data_from_api
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Fetch new people from the upstream APIs configured in " \
+           "INGESTION_WORKERS, once or every --interval seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep ingesting, pausing this many seconds "
+                                 "between runs")
+
+    def run(self) -> None:
+        started = time.monotonic()
+        get_users_data_from_api()
+        self.stdout.write("Ingested in {:.3f}s".format(
+            time.monotonic() - started))
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        if not interval:
+            self.run()
+            return
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                # Upstreams or the database are down, failed runs are in
+                # the ingestion ledger, try again next round
+                logger.exception("Ingestion failed")
+                self.stderr.write("Ingestion failed: {}".format(e))
+            finally:
+                close_old_connections()
+            time.sleep(interval)
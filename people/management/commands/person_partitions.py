@@ -0,0 +1,45 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+
+from people.models import Location, Person
+from people.partitions import (
+    create_partitions, drop_expired_partitions, next_month
+)
+
+
+class Command(BaseCommand):
+    help = "Create the upcoming monthly Person partitions and drop the " \
+           "partitions older than the retention period. Run it daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int,
+                            default=settings.PERSON_PARTITION_MONTHS_AHEAD)
+        parser.add_argument("--retention-days", type=int,
+                            default=settings.PERSON_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(Person)]
+        if connection.vendor != "postgresql":
+            raise CommandError("Person partitions require PostgreSQL")
+        today = datetime.date.today()
+        last = today
+        for _ in range(options["months_ahead"]):
+            last = next_month(last)
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                created = create_partitions(cursor, today, last)
+                dropped = []
+                if options["retention_days"] is not None:
+                    cutoff = today - datetime.timedelta(
+                        days=options["retention_days"])
+                    dropped = drop_expired_partitions(cursor, cutoff)
+            if dropped:
+                # Counts of every location may have dropped
+                Location.touch(Location.objects.values_list("id", flat=True))
+        for name in created:
+            self.stdout.write("Created partition {}".format(name))
+        for name in dropped:
+            self.stdout.write("Dropped partition {}".format(name))
@@ -0,0 +1,25 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from people.models import IngestionRun
+
+
+class Command(BaseCommand):
+    help = "Delete the ingestion runs older than the retention period. " \
+           "Run it daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retention-days", type=int,
+                            default=settings.INGESTION_RUN_RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        if options["retention_days"] is None:
+            return
+        cutoff = timezone.now() - datetime.timedelta(
+            days=options["retention_days"])
+        deleted = IngestionRun.prune(cutoff)
+        self.stdout.write("Deleted {} ingestion runs started before "
+                          "{:%Y-%m-%d %H:%M}".format(deleted, cutoff))
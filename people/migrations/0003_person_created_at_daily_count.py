@@ -0,0 +1,54 @@
+# Generated by Django 2.2.4 on 2026-10-19 07:11
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_daily_counts(apps, schema_editor):
+    Person = apps.get_model('people', 'Person')
+    PersonDailyCount = apps.get_model('people', 'PersonDailyCount')
+    db = schema_editor.connection.alias
+    counts = Person.objects.using(db)\
+        .annotate(day=TruncDate('created_at'))\
+        .values('location_id', 'gender', 'day')\
+        .annotate(count=models.Count('id'))
+    PersonDailyCount.objects.using(db).bulk_create(
+        [PersonDailyCount(**row) for row in counts.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0002_auto_20190816_1310'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='person',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='source',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.CreateModel(
+            name='PersonDailyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(choices=[('M', 'Male'), ('F', 'Female')], max_length=1)),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_count', to='people.Location')),
+            ],
+            options={
+                'unique_together': {('day', 'location', 'gender')},
+            },
+        ),
+        migrations.RunPython(fill_daily_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,86 @@
+import datetime
+
+from django.conf import settings
+from django.db import migrations
+
+from people.partitions import (
+    DEFAULT_PARTITION, PERSON_TABLE, create_partitions, month_start,
+    next_month
+)
+
+
+COLUMNS = "id, gender, first_name, last_name, location_id, created_at, source"
+
+
+def create_table_sql(table, partitioned):
+    return (
+        "CREATE TABLE {table} ("
+        "id integer NOT NULL DEFAULT nextval('people_person_id_seq'), "
+        "gender varchar(1) NOT NULL, "
+        "first_name varchar(250) NOT NULL, "
+        "last_name varchar(250) NOT NULL, "
+        "location_id integer NOT NULL REFERENCES people_location (id) "
+        "DEFERRABLE INITIALLY DEFERRED, "
+        "created_at timestamp with time zone NOT NULL, "
+        "source varchar(100) NOT NULL, "
+        "PRIMARY KEY ({pk})){partition}".format(
+            table=table,
+            pk="id, created_at" if partitioned else "id",
+            partition=" PARTITION BY RANGE (created_at)" if partitioned else "")
+    )
+
+
+def replace_person_table(cursor, partitioned):
+    cursor.execute("DROP INDEX IF EXISTS people_person_location_id_idx, "
+                   "people_person_created_at_idx")
+    cursor.execute("ALTER INDEX people_person_pkey "
+                   "RENAME TO people_person_old_pkey")
+    cursor.execute("ALTER TABLE {0} RENAME TO {0}_old".format(PERSON_TABLE))
+    cursor.execute(create_table_sql(PERSON_TABLE, partitioned))
+    cursor.execute("CREATE INDEX people_person_location_id_idx "
+                   "ON {} (location_id)".format(PERSON_TABLE))
+    cursor.execute("CREATE INDEX people_person_created_at_idx "
+                   "ON {} (created_at)".format(PERSON_TABLE))
+    if partitioned:
+        cursor.execute("CREATE TABLE {} PARTITION OF {} DEFAULT".format(
+            DEFAULT_PARTITION, PERSON_TABLE))
+        cursor.execute("SELECT min(created_at), max(created_at) "
+                       "FROM {}_old".format(PERSON_TABLE))
+        first, last = cursor.fetchone()
+        today = datetime.date.today()
+        first = month_start(first.date() if first else today)
+        last = last.date() if last else today
+        for _ in range(settings.PERSON_PARTITION_MONTHS_AHEAD):
+            today = next_month(today)
+        create_partitions(cursor, first, max(last, today))
+    cursor.execute("INSERT INTO {table} ({columns}) "
+                   "SELECT {columns} FROM {table}_old".format(
+                    table=PERSON_TABLE, columns=COLUMNS))
+    cursor.execute("ALTER SEQUENCE people_person_id_seq "
+                   "OWNED BY {}.id".format(PERSON_TABLE))
+    cursor.execute("DROP TABLE {}_old".format(PERSON_TABLE))
+
+
+def partition_person(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        replace_person_table(cursor, partitioned=True)
+
+
+def unpartition_person(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        replace_person_table(cursor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0003_person_created_at_daily_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_person, unpartition_person),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-19 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0004_partition_person'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['location', 'gender'], name='person_location_gender_idx'),
+        ),
+    ]
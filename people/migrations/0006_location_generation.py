@@ -0,0 +1,26 @@
+# Generated by Django 2.2.4 on 2026-10-19 07:14
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0005_person_location_gender_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeGeneration',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='generation',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+    ]
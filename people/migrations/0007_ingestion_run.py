@@ -0,0 +1,40 @@
+# Generated by Django 2.2.4 on 2026-10-19 07:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0006_location_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('failed', 'Failed')], default='ok', max_length=10)),
+                ('duration_ms', models.FloatField(default=0)),
+                ('fetch_ms', models.FloatField(blank=True, null=True)),
+                ('validate_ms', models.FloatField(blank=True, null=True)),
+                ('persist_ms', models.FloatField(blank=True, null=True)),
+                ('upstream_status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('upstream_latency_ms', models.FloatField(blank=True, null=True)),
+                ('rows_fetched', models.PositiveIntegerField(default=0)),
+                ('rows_inserted', models.PositiveIntegerField(default=0)),
+                ('rows_skipped', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'ordering': ('-started_at',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ingestionrun',
+            index=models.Index(fields=['started_at', 'source'], name='ingestion_run_started_idx'),
+        ),
+    ]
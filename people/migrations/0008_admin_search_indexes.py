@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+# Case-insensitive prefix indexes matching the admin search lookups
+# (istartswith compiles to UPPER("column"::text) LIKE UPPER('prefix%'))
+INDEXES = (
+    ("person_last_name_upper_idx", "people_person", "last_name"),
+    ("location_city_upper_idx", "people_location", "city"),
+    ("location_region_upper_idx", "people_location", "region"),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS {} ON {} '
+            '(UPPER("{}"::text) text_pattern_ops)'.format(name, table, column))
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0007_ingestion_run'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
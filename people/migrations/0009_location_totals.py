@@ -0,0 +1,48 @@
+# Generated by Django 2.2.4 on 2026-10-19 08:03
+
+from django.db import migrations, models
+
+from people.partitions import refresh_location_totals
+
+
+def fill_location_totals(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        refresh_location_totals(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('people', '0008_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='female_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='male_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='total_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['female_count', 'id'], name='location_female_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['male_count', 'id'], name='location_male_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['total_count', 'id'], name='location_total_count_idx'),
+        ),
+        migrations.RunPython(fill_location_totals, migrations.RunPython.noop),
+    ]
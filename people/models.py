@@ -1,9 +1,77 @@
-from django.db import models
+import datetime
+
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.db.models import Avg, Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+
+class ChangeGeneration(models.Model):
+    """Monotonic token of a committed change to location counts"""
+    created_at = models.DateTimeField(default=timezone.now)
+
+    # Arbitrary advisory lock key serializing generation bumps on PostgreSQL
+    LOCK_KEY = 0x70656f70
+
+    @classmethod
+    def next(cls) -> int:
+        """Allocate a new generation inside the current transaction
+
+        On PostgreSQL the transaction holds an advisory lock until it ends,
+        so generations become visible in the order they were allocated and
+        a poller can never skip a change that commits late.
+        """
+        db = router.db_for_write(cls)
+        connection = connections[db]
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)",
+                               [cls.LOCK_KEY])
+        return cls.objects.using(db).create().pk
+
+    @classmethod
+    def current(cls) -> int:
+        """Latest allocated generation, it never moves backwards"""
+        return cls.objects.aggregate(
+            generation=models.Max("id"))["generation"] or 0
 
 
 class Location(models.Model):
     city = models.CharField(max_length=250, blank=True, null=True, unique=True)
     region = models.CharField(max_length=250, blank=True, null=True, unique=True)
+    generation = models.BigIntegerField(default=0, db_index=True)
+    # Running totals of the daily rollups, see PersonDailyCount.add_counts
+    female_count = models.IntegerField(default=0)
+    male_count = models.IntegerField(default=0)
+    total_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["female_count", "id"],
+                         name="location_female_count_idx"),
+            models.Index(fields=["male_count", "id"],
+                         name="location_male_count_idx"),
+            models.Index(fields=["total_count", "id"],
+                         name="location_total_count_idx"),
+        ]
+
+    def __str__(self):
+        return self.city or self.region or ""
+
+    @classmethod
+    def touch(cls, location_ids) -> int:
+        """Mark locations as changed with a new generation"""
+        generation = ChangeGeneration.next()
+        cls.objects.filter(id__in=set(location_ids))\
+            .update(generation=generation)
+        return generation
+
+    @staticmethod
+    def current_generation() -> int:
+        # Not Max(generation): deleting the last touched location would
+        # move it backwards and bring stale cache entries back
+        return ChangeGeneration.current()
 
     @staticmethod
     def form_data(queryset):
@@ -19,7 +87,70 @@ class Location(models.Model):
         return data
 
     @classmethod
-    def get_location_data(cls):
+    def get_person_counts(cls):
+        """Female, male and total persons per location"""
+        return cls.objects.annotate(
+            female=models.Count("person__gender",
+                                filter=Q(person__gender='F')),
+            male=models.Count("person__gender", filter=Q(person__gender='M')),
+            total=models.Count("person")).values("id", "city", "region",
+                                                 "female", "male", "total")
+
+    @classmethod
+    def get_counts(cls, date_from=None, date_to=None):
+        """Female, male and total persons per location from the rollups"""
+        queryset = cls.objects.all()
+        if date_from or date_to:
+            days = dict()
+            if date_from:
+                days["daily_count__day__gte"] = date_from
+            if date_to:
+                days["daily_count__day__lte"] = date_to
+            queryset = queryset.filter(**days)
+        count = "daily_count__count"
+        return queryset.values("id", "city", "region").annotate(
+            female=Coalesce(Sum(count, filter=Q(daily_count__gender='F')), 0),
+            male=Coalesce(Sum(count, filter=Q(daily_count__gender='M')), 0),
+            total=Coalesce(Sum(count), 0))
+
+    @classmethod
+    def get_totals(cls):
+        """Female, male and total persons per location from the running
+        totals, ordering by a count reads its index"""
+        return cls.objects.values(
+            "id", "city", "region", female=F("female_count"),
+            male=F("male_count"), total=F("total_count"))
+
+    @classmethod
+    def add_totals(cls, totals: dict) -> None:
+        """Add {location_id: (female, male)} to the running totals"""
+        if not totals:
+            return
+        connection = connections[router.db_for_write(cls)]
+        table = connection.ops.quote_name(cls._meta.db_table)
+        sql = "UPDATE {table} SET " \
+              "female_count = female_count + v.column2, " \
+              "male_count = male_count + v.column3, " \
+              "total_count = total_count + v.column2 + v.column3 " \
+              "FROM (VALUES {values}) AS v " \
+              "WHERE {table}.id = v.column1".format(
+                table=table,
+                values=", ".join(["(%s, %s, %s)"] * len(totals)))
+        params = []
+        for location_id, (female, male) in sorted(totals.items()):
+            params.extend((location_id, female, male))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    @classmethod
+    def get_location_data(cls, date_from=None, date_to=None):
+        if date_from or date_to:
+            queryset = PersonDailyCount.in_range(date_from, date_to)\
+                .values(city=models.F("location__city"),
+                        region=models.F("location__region"),
+                        person__gender=models.F("gender"))\
+                .annotate(gender_count=models.Sum("count"))
+            return cls.form_data(queryset)
         queryset = cls.objects.all()\
             .annotate()\
             .values('city', 'region')\
@@ -40,4 +171,199 @@ class Person(models.Model):
     last_name = models.CharField(max_length=250)
     location = models.ForeignKey(Location, related_name="person",
                                  on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    source = models.CharField(max_length=100, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["location", "gender"],
+                         name="person_location_gender_idx"),
+        ]
+
+    @classmethod
+    def create_many(cls, persons: list, source: str = "") -> list:
+        """Insert persons in bulk, add them to the daily rollups and bump
+        the generation of their locations"""
+        created_at = timezone.now()
+        for person in persons:
+            person.created_at = created_at
+            person.source = source
+        counts = dict()
+        for person in persons:
+            key = (person.location_id, person.gender, created_at.date())
+            counts[key] = counts.get(key, 0) + 1
+        with transaction.atomic(using=router.db_for_write(cls)):
+            persons = cls.objects.bulk_create(persons)
+            PersonDailyCount.add_counts(counts)
+            if persons:
+                Location.touch(person.location_id for person in persons)
+        return persons
+
+    @staticmethod
+    def daily_counts(queryset):
+        """(location_id, gender, day, count) rows of the persons"""
+        return queryset.order_by()\
+            .annotate(day=TruncDate("created_at"))\
+            .values_list("location_id", "gender", "day")\
+            .annotate(count=Count("id"))
+
+    @classmethod
+    def update_many(cls, queryset, **values) -> int:
+        """Set the gender and/or location_id of persons in one UPDATE and
+        move their counts between the daily rollups"""
+        if set(values) - {"gender", "location_id"}:
+            raise ValueError("Only gender and location_id can be updated")
+        with transaction.atomic(using=router.db_for_write(cls)):
+            counts = dict()
+            for location_id, gender, day, count in cls.daily_counts(queryset):
+                old = (location_id, gender, day)
+                new = (values.get("location_id", location_id),
+                       values.get("gender", gender), day)
+                if new != old:
+                    counts[old] = counts.get(old, 0) - count
+                    counts[new] = counts.get(new, 0) + count
+            updated = queryset.update(**values)
+            PersonDailyCount.add_counts(
+                {key: count for key, count in counts.items() if count})
+            if counts:
+                Location.touch(key[0] for key in counts)
+        return updated
+
+    @classmethod
+    def delete_many(cls, queryset) -> int:
+        """Delete persons in one DELETE and subtract them from the daily
+        rollups"""
+        with transaction.atomic(using=router.db_for_write(cls)):
+            counts = {(location_id, gender, day): -count
+                      for location_id, gender, day, count
+                      in cls.daily_counts(queryset)}
+            deleted, _ = queryset.delete()
+            PersonDailyCount.add_counts(counts)
+            if counts:
+                Location.touch(key[0] for key in counts)
+        return deleted
+
+
+class PersonDailyCount(models.Model):
+    """Number of persons ingested per location, gender and day"""
+    location = models.ForeignKey(Location, related_name="daily_count",
+                                 on_delete=models.CASCADE)
+    gender = models.CharField(max_length=1, choices=Person.GENDER_CHOICES)
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("day", "location", "gender")
+
+    @classmethod
+    def in_range(cls, date_from=None, date_to=None):
+        queryset = cls.objects.all()
+        if date_from:
+            queryset = queryset.filter(day__gte=date_from)
+        if date_to:
+            queryset = queryset.filter(day__lte=date_to)
+        return queryset
 
+    @classmethod
+    def add_counts(cls, counts: dict) -> None:
+        """Add {(location_id, gender, day): count} to the rollup rows and to
+        the running totals of the locations"""
+        if not counts:
+            return
+        connection = connections[router.db_for_write(cls)]
+        qn = connection.ops.quote_name
+        table = qn(cls._meta.db_table)
+        sql = "INSERT INTO {table} (location_id, gender, day, count) " \
+              "VALUES {values} " \
+              "ON CONFLICT (day, location_id, gender) " \
+              "DO UPDATE SET count = {table}.count + EXCLUDED.count".format(
+                table=table,
+                values=", ".join(["(%s, %s, %s, %s)"] * len(counts)))
+        params = []
+        for (location_id, gender, day), count in sorted(counts.items()):
+            params.extend((location_id, gender, day, count))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+        totals = dict()
+        for (location_id, gender, _), count in counts.items():
+            female, male = totals.get(location_id, (0, 0))
+            if gender == Person.GENDER_FEMALE:
+                female += count
+            elif gender == Person.GENDER_MALE:
+                male += count
+            totals[location_id] = (female, male)
+        Location.add_totals(totals)
+
+
+class IngestionRun(models.Model):
+    """Metrics of one run of an upstream API worker"""
+    STATUS_OK = 'ok'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_OK, 'OK'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    source = models.CharField(max_length=100)
+    started_at = models.DateTimeField(default=timezone.now)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=STATUS_OK)
+    duration_ms = models.FloatField(default=0)
+    fetch_ms = models.FloatField(blank=True, null=True)
+    validate_ms = models.FloatField(blank=True, null=True)
+    persist_ms = models.FloatField(blank=True, null=True)
+    upstream_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    upstream_latency_ms = models.FloatField(blank=True, null=True)
+    rows_fetched = models.PositiveIntegerField(default=0)
+    rows_inserted = models.PositiveIntegerField(default=0)
+    rows_skipped = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    class Meta:
+        ordering = ("-started_at",)
+        indexes = [
+            models.Index(fields=["started_at", "source"],
+                         name="ingestion_run_started_idx"),
+        ]
+
+    def __str__(self):
+        return "{} {:%Y-%m-%d %H:%M:%S} {}".format(
+            self.source, self.started_at, self.status)
+
+    @classmethod
+    def prune(cls, before) -> int:
+        """Delete the runs started before the given datetime"""
+        deleted, _ = cls.objects.filter(started_at__lt=before).delete()
+        return deleted
+
+    @staticmethod
+    def start_of_day(day: datetime.date) -> datetime.datetime:
+        start = datetime.datetime.combine(day, datetime.time.min)
+        if settings.USE_TZ:
+            start = timezone.make_aware(start)
+        return start
+
+    @classmethod
+    def get_summary(cls, date_from=None, date_to=None):
+        """Runs, rows and average phase timings per source and day"""
+        queryset = cls.objects.order_by()
+        # Datetime bounds instead of started_at__date, so the filter can use
+        # the started_at index
+        if date_from:
+            queryset = queryset.filter(
+                started_at__gte=cls.start_of_day(date_from))
+        if date_to:
+            queryset = queryset.filter(started_at__lt=cls.start_of_day(
+                date_to + datetime.timedelta(days=1)))
+        return queryset.annotate(day=TruncDate("started_at"))\
+            .values("day", "source")\
+            .annotate(runs=Count("id"),
+                      failed=Count("id", filter=Q(status=cls.STATUS_FAILED)),
+                      rows_fetched=Sum("rows_fetched"),
+                      rows_inserted=Sum("rows_inserted"),
+                      rows_skipped=Sum("rows_skipped"),
+                      duration_ms=Sum("duration_ms"),
+                      fetch_ms=Avg("fetch_ms"),
+                      validate_ms=Avg("validate_ms"),
+                      persist_ms=Avg("persist_ms"),
+                      upstream_latency_ms=Avg("upstream_latency_ms"))\
+            .order_by("-day", "source")
@@ -0,0 +1,136 @@
+"""Monthly range partitions of the Person table (PostgreSQL 11+)
+
+people_person is partitioned by RANGE (created_at), one partition per
+calendar month named people_person_pYYYY_MM, plus a default partition
+that only catches rows outside of the prepared months.
+"""
+import datetime
+import re
+
+
+PERSON_TABLE = "people_person"
+DEFAULT_PARTITION = "people_person_default"
+DAILY_COUNT_TABLE = "people_persondailycount"
+LOCATION_TABLE = "people_location"
+PARTITION_NAME = re.compile(r"^people_person_p(\d{4})_(\d{2})$")
+
+
+def month_start(day: datetime.date) -> datetime.date:
+    return day.replace(day=1)
+
+
+def next_month(day: datetime.date) -> datetime.date:
+    day = month_start(day)
+    if day.month == 12:
+        return day.replace(year=day.year + 1, month=1)
+    return day.replace(month=day.month + 1)
+
+
+def partition_name(month: datetime.date) -> str:
+    return "people_person_p{:04d}_{:02d}".format(month.year, month.month)
+
+
+def partition_month(name: str) -> datetime.date or None:
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    return datetime.date(int(match.group(1)), int(match.group(2)), 1)
+
+
+def create_partition(cursor, month: datetime.date) -> None:
+    """Create the partition of a month
+
+    Rows that already landed in the default partition for that month are
+    moved into the new table before it is attached, otherwise PostgreSQL
+    refuses to create the partition.
+    """
+    month = month_start(month)
+    bounds = [month.isoformat(), next_month(month).isoformat()]
+    values = "FOR VALUES FROM (%s) TO (%s)"
+    name = partition_name(month)
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM {} "
+        "WHERE created_at >= %s AND created_at < %s)".format(
+            DEFAULT_PARTITION), bounds
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} "
+                       "{}".format(name, PERSON_TABLE, values), bounds)
+        return
+    cursor.execute("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS "
+                   "INCLUDING CONSTRAINTS)".format(name, PERSON_TABLE))
+    cursor.execute(
+        "WITH moved AS (DELETE FROM {default} "
+        "WHERE created_at >= %s AND created_at < %s RETURNING *) "
+        "INSERT INTO {name} SELECT * FROM moved".format(
+            default=DEFAULT_PARTITION, name=name), bounds
+    )
+    cursor.execute("ALTER TABLE {} ATTACH PARTITION {} {}".format(
+        PERSON_TABLE, name, values), bounds)
+
+
+def list_partitions(cursor) -> list:
+    """Return the months of the existing monthly partitions, sorted"""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass", [PERSON_TABLE]
+    )
+    months = [partition_month(name) for name, in cursor.fetchall()]
+    return sorted(month for month in months if month)
+
+
+def create_partitions(cursor, first: datetime.date,
+                      last: datetime.date) -> list:
+    """Create the monthly partitions from first to last month inclusive"""
+    existing = set(list_partitions(cursor))
+    created = []
+    month = month_start(first)
+    while month <= last:
+        if month not in existing:
+            create_partition(cursor, month)
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
+
+
+def drop_expired_partitions(cursor, cutoff: datetime.date) -> list:
+    """Drop every partition holding only rows older than cutoff
+
+    Whole partitions are dropped instead of deleting rows, the daily
+    rollups of the dropped months are removed as well so the aggregates
+    stay consistent with the remaining people.
+    """
+    dropped = []
+    boundary = None
+    for month in list_partitions(cursor):
+        if next_month(month) > cutoff:
+            break
+        cursor.execute("DROP TABLE {}".format(partition_name(month)))
+        dropped.append(partition_name(month))
+        boundary = next_month(month)
+    if boundary is not None:
+        cursor.execute(
+            "DELETE FROM {} WHERE day < %s".format(DAILY_COUNT_TABLE),
+            [boundary]
+        )
+        refresh_location_totals(cursor)
+    return dropped
+
+
+def refresh_location_totals(cursor) -> None:
+    """Recompute the running totals of every location from the rollups"""
+    total = "COALESCE((SELECT SUM(count) FROM {daily_count} d " \
+            "WHERE d.location_id = {location}.id{gender}), 0)"
+    cursor.execute(
+        "UPDATE {location} SET female_count = {female}, "
+        "male_count = {male}, total_count = {total}".format(
+            location=LOCATION_TABLE,
+            female=total.format(daily_count=DAILY_COUNT_TABLE,
+                                location=LOCATION_TABLE,
+                                gender=" AND d.gender = 'F'"),
+            male=total.format(daily_count=DAILY_COUNT_TABLE,
+                              location=LOCATION_TABLE,
+                              gender=" AND d.gender = 'M'"),
+            total=total.format(daily_count=DAILY_COUNT_TABLE,
+                               location=LOCATION_TABLE, gender="")))
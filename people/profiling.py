@@ -0,0 +1,158 @@
+"""Per-request profiling of the API
+
+With PROFILING_ENABLED, a request sent with ?_profile=1 or the
+X-Profile: 1 header by a staff user (or anybody in DEBUG) runs under
+cProfile and gets a JSON summary instead of its response: the top
+functions by cumulative time, the SQL statements with their timings and
+the outbound HTTP calls. With PROFILING_DIR set the raw profile is saved
+as a .prof file for pstats or snakeviz. When disabled the middleware
+removes itself from the stack.
+"""
+import contextvars
+import cProfile
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+
+
+PROFILE_PARAM = "_profile"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+# Lists collecting the outbound HTTP calls, innermost last
+_http_calls = contextvars.ContextVar("people_http_calls", default=())
+
+
+@contextmanager
+def collect_http_calls():
+    """Collect the outbound HTTP calls made inside the block"""
+    calls = []
+    token = _http_calls.set(_http_calls.get() + (calls,))
+    try:
+        yield calls
+    finally:
+        _http_calls.reset(token)
+
+
+@contextmanager
+def track_http_call(method: str, url: str):
+    """Record an outbound HTTP call for the enclosing collect_http_calls()
+    blocks, the caller sets the "status" of the yielded dict"""
+    call = {"method": method, "url": url, "status": None}
+    started = time.monotonic()
+    try:
+        yield call
+    finally:
+        collectors = _http_calls.get()
+        if collectors:
+            call["duration_ms"] = round((time.monotonic() - started) * 1000, 3)
+            for calls in collectors:
+                calls.append(call)
+
+
+class QueryRecorder:
+    """execute_wrapper collecting every SQL statement with its timing"""
+
+    def __init__(self, alias: str, queries: list):
+        self.alias = alias
+        self.queries = queries
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "alias": self.alias,
+                "sql": sql,
+                "many": many,
+                "duration_ms": round((time.monotonic() - started) * 1000, 3),
+            })
+
+
+def top_functions(profiler: cProfile.Profile, limit: int) -> list:
+    stats = pstats.Stats(profiler)
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3],
+                  reverse=True)[:limit]
+    return [{
+        "function": "{}:{}({})".format(filename, line, name),
+        "calls": calls,
+        "total_ms": round(total * 1000, 3),
+        "cumulative_ms": round(cumulative * 1000, 3),
+    } for (filename, line, name), (_, calls, total, cumulative, _) in rows]
+
+
+def profile_path(request) -> str:
+    """Path of a new .prof file, unique across requests of the same second
+    and across processes"""
+    name = re.sub(r"[^\w]+", "-", request.path).strip("-") or "root"
+    return os.path.join(settings.PROFILING_DIR, "{}-{}-{}.prof".format(
+        name, time.strftime("%Y%m%d-%H%M%S"), uuid.uuid4().hex[:12]))
+
+
+class ProfilingMiddleware:
+    """Return a profile summary instead of the response when asked to"""
+
+    # cProfile can not profile overlapping requests of different threads
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    @staticmethod
+    def should_profile(request) -> bool:
+        if request.GET.get(PROFILE_PARAM) != "1" \
+                and request.META.get(PROFILE_HEADER) != "1":
+            return False
+        if settings.DEBUG:
+            return True
+        user = getattr(request, "user", None)
+        return bool(user is not None and user.is_staff)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        with self._lock:
+            return self.profile(request)
+
+    def profile(self, request) -> JsonResponse:
+        queries = []
+        profiler = cProfile.Profile()
+        started = time.monotonic()
+        with ExitStack() as stack:
+            calls = stack.enter_context(collect_http_calls())
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(
+                    QueryRecorder(alias, queries)))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.monotonic() - started
+        saved = None
+        if settings.PROFILING_DIR:
+            os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+            saved = profile_path(request)
+            profiler.dump_stats(saved)
+        return JsonResponse({
+            "path": request.get_full_path(),
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "functions": top_functions(profiler,
+                                       settings.PROFILING_TOP_FUNCTIONS),
+            "sql": queries,
+            "sql_duration_ms": round(sum(q["duration_ms"] for q in queries), 3),
+            "http": calls,
+            "profile_file": saved,
+        })
@@ -0,0 +1,62 @@
+"""Database routing of the read-only aggregate queries
+
+The aggregate viewsets run inside replica_reads(), where the ORM reads
+of this app go to settings.READ_REPLICA_DATABASE. Everything else,
+including all writes and the reads done while ingesting, uses the
+primary database.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+PRIMARY_DATABASE = 'default'
+REPLICA = "replica"
+PRIMARY = "primary"
+
+_reads = contextvars.ContextVar("people_reads", default=None)
+
+
+@contextmanager
+def replica_reads():
+    token = _reads.set(REPLICA)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    token = _reads.set(PRIMARY)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+def pin_primary() -> None:
+    """Read from the primary until the enclosing replica_reads() ends"""
+    _reads.set(PRIMARY)
+
+
+class ReplicaRouter:
+    app_label = "people"
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label \
+                and _reads.get() == REPLICA:
+            return settings.READ_REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return PRIMARY_DATABASE
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY_DATABASE, settings.READ_REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
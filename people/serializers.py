@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 from people.models import Location
 
@@ -46,3 +47,50 @@ class GenderLocationSerializer(serializers.Serializer):
             gender: LocationCount(obj[list(obj.keys())[0]], many=True).data,
             "Total": total
         }
+
+
+class LocationLookupSerializer(serializers.Serializer):
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=250), required=False,
+        max_length=settings.LOCATION_LOOKUP_MAX_SIZE)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False,
+        max_length=settings.LOCATION_LOOKUP_MAX_SIZE)
+
+    def validate(self, attrs):
+        if not attrs.get("names") and not attrs.get("ids"):
+            raise serializers.ValidationError(
+                "Send a list of location names or ids"
+            )
+        return attrs
+
+
+class LocationLookupResultSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    city = serializers.CharField()
+    region = serializers.CharField()
+    male = serializers.IntegerField()
+    female = serializers.IntegerField()
+    total = serializers.IntegerField()
+
+
+class IngestionSummarySerializer(serializers.Serializer):
+    day = serializers.DateField()
+    source = serializers.CharField()
+    runs = serializers.IntegerField()
+    failed = serializers.IntegerField()
+    rows_fetched = serializers.IntegerField()
+    rows_inserted = serializers.IntegerField()
+    rows_skipped = serializers.IntegerField()
+    rows_per_second = serializers.SerializerMethodField()
+    fetch_ms = serializers.FloatField()
+    validate_ms = serializers.FloatField()
+    persist_ms = serializers.FloatField()
+    upstream_latency_ms = serializers.FloatField()
+
+    @staticmethod
+    def get_rows_per_second(obj):
+        """Inserted rows per second of run time"""
+        if not obj["duration_ms"]:
+            return None
+        return round(obj["rows_inserted"] / obj["duration_ms"] * 1000, 3)
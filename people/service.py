@@ -1,10 +1,42 @@
 from abc import ABC, abstractmethod, abstractstaticmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import partial
 from typing import List
+import asyncio
+import contextvars
 import json
+import logging
 import jsonschema
 import requests
+from django.conf import settings
+from django.db import close_old_connections
 from rest_framework import serializers
-from people.models import Person, Location
+from people.gender_index import get_gender_index
+from people.ingestion import IngestionRecorder, error_message
+from people.locations import get_location_resolver
+from people.models import Person
+from people.profiling import track_http_call
+from people.transport import get_upstream_transport
+from people.upstreams import (
+    UPSTREAM_ERRORS, UpstreamUnavailable, get_upstream_guard
+)
+from people.workers import get_worker_registry
+
+
+logger = logging.getLogger(__name__)
+
+_upstream_executor = None
+
+
+def get_upstream_executor() -> ThreadPoolExecutor:
+    """Threads of the blocking upstream requests of the async workers"""
+    global _upstream_executor
+    if _upstream_executor is None:
+        _upstream_executor = ThreadPoolExecutor(
+            max_workers=settings.ASGI_UPSTREAM_THREADS,
+            thread_name_prefix="upstream")
+    return _upstream_executor
 
 
 class GetDataFromApi(ABC):
@@ -14,19 +46,68 @@ class GetDataFromApi(ABC):
         self.url = None
         self.params = params
         self.api_name = "GetDataFromApi"
+        self.response_type = dict
         self.schema_path = "path/to/your/schema/for/validate/response/data"
+        self.recorder = None
+
+    @staticmethod
+    def get_retry_after(response) -> int or None:
+        value = response.headers.get("Retry-After")
+        if response.status_code in (429, 503) and isinstance(value, str) \
+                and value.isdigit():
+            return int(value)
+        return None
+
+    @staticmethod
+    def fetch(url, params) -> tuple:
+        """Send the request to the api, return the status and the data"""
+        guard = get_upstream_guard(url)
+        with guard.request() as outcome, \
+                track_http_call("GET", url) as call:
+            response = requests.get(url, params=params, timeout=guard.timeout)
+            call["status"] = outcome["status"] = response.status_code
+            outcome["retry_after"] = GetDataFromApi.get_retry_after(response)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            if response.status_code == 200:
+                raise serializers.ValidationError(
+                    "Response of {} is not JSON".format(url))
+            # Error pages of proxies and load balancers
+            return response.status_code, response.text
+
+    @staticmethod
+    def get_error_message(status: int, data) -> str:
+        """Message of a failed response, whatever shape its body has"""
+        error = data.get("error") if isinstance(data, dict) else None
+        if isinstance(error, dict) and isinstance(error.get("message"), str):
+            return error["message"]
+        if isinstance(error, str):
+            return error
+        body = data if isinstance(data, str) else json.dumps(data)
+        return "Upstream answered {}: {}".format(status, body[:200])
 
     @staticmethod
     def get_response(url, params) -> dict or Exception:
         """Creating request to api and check response status"""
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            return response.json()
+        status, data = get_upstream_transport().get(
+            url, params, GetDataFromApi.fetch)
+        if status == 200:
+            return data
         else:
             raise serializers.ValidationError(
-                response.json()['error']['message']
+                GetDataFromApi.get_error_message(status, data)
             )
 
+    async def get_response_async(self, url, params) -> dict or Exception:
+        """Run the blocking get_response on the upstream thread pool, so
+        the requests of several workers overlap without blocking the event
+        loop. Each request in flight holds one of ASGI_UPSTREAM_THREADS."""
+        loop = asyncio.get_running_loop()
+        # The context carries the HTTP call collectors into the thread
+        return await loop.run_in_executor(get_upstream_executor(), partial(
+            contextvars.copy_context().run, self.get_response, url, params))
+
     @staticmethod
     def get_api_schema(path):
         """Open schema file and convert to json"""
@@ -58,19 +139,109 @@ class GetDataFromApi(ABC):
 
     def _get_valid_response_data(self, type_data) -> dict or str:
         """Get response data from API and validate format of it"""
-        resp = self.get_response(self.url, params=self.params)
-        data = self._validate_response_data(resp, type_data)
+        with self.phase("fetch"):
+            resp = self.get_response(self.url, params=self.params)
+        with self.phase("validate"):
+            data = self._validate_response_data(resp, type_data)
         return data
 
+    async def _get_valid_response_data_async(self, type_data) -> dict or str:
+        with self.phase("fetch"):
+            resp = await self.get_response_async(self.url, params=self.params)
+        with self.phase("validate"):
+            return self._validate_response_data(resp, type_data)
+
+    def phase(self, name: str):
+        """Time a phase of the recorded run, if any"""
+        if self.recorder is None:
+            return nullcontext()
+        return self.recorder.phase(name)
+
+    @contextmanager
+    def record_run(self):
+        """Store an IngestionRun of the run inside the block"""
+        self.recorder = recorder = IngestionRecorder(self.api_name)
+        try:
+            yield recorder
+        except Exception as e:
+            recorder.fail(e)
+            raise
+        finally:
+            self.recorder = None
+            recorder.finish()
+
+    def _save_persons(self, location_field: str, persons: list) -> list:
+        """Create Person objects in bulk from (location name, data) pairs"""
+        location_ids = get_location_resolver().resolve(
+            location_field, {name for name, _ in persons})
+        created = Person.create_many([
+            Person(location_id=location_ids[name], **data)
+            for name, data in persons if name in location_ids
+        ], source=self.api_name)
+        if self.recorder is not None:
+            self.recorder.add_rows(len(persons), len(created))
+        return created
+
     @abstractstaticmethod
     def form_data_for_person(user_data):
         """Format data in dict for creating Person object"""
         raise Exception("You must change this method")
 
     @abstractmethod
+    def process_response_data(self, data):
+        """Creating Person objects from valid response data"""
+        raise Exception("You must change this method")
+
+    def fetch_related_data(self, data):
+        """Query the other APIs the rows depend on, timed as fetch"""
+        return data
+
     def get_data_from_api(self):
         """Get valid response data and creating Person objects"""
-        raise Exception("You must change this method")
+        with self.record_run():
+            data = self._get_valid_response_data(self.response_type)
+            with self.phase("fetch"):
+                data = self.fetch_related_data(data)
+            with self.phase("persist"):
+                return self.process_response_data(data)
+
+    def _fetch_related_in_thread(self, data):
+        with self.phase("fetch"):
+            return self.fetch_related_data(data)
+
+    def _process_in_thread(self, data):
+        try:
+            with self.phase("persist"):
+                return self.process_response_data(data)
+        finally:
+            close_old_connections()
+
+    def _finish_run_in_thread(self, recorder: IngestionRecorder):
+        try:
+            recorder.finish()
+        finally:
+            close_old_connections()
+
+    async def get_data_from_api_async(self):
+        """Fetch without blocking the event loop, then store in a thread"""
+        self.recorder = recorder = IngestionRecorder(self.api_name)
+        loop = asyncio.get_running_loop()
+        try:
+            data = await self._get_valid_response_data_async(
+                self.response_type)
+            data = await loop.run_in_executor(
+                get_upstream_executor(), partial(
+                    contextvars.copy_context().run,
+                    self._fetch_related_in_thread, data))
+            return await loop.run_in_executor(None, self._process_in_thread,
+                                              data)
+        except Exception as e:
+            recorder.fail(e)
+            raise
+        finally:
+            self.recorder = None
+            await loop.run_in_executor(None, self._finish_run_in_thread,
+                                       recorder)
 
 
 class RandomUserApiWorker(GetDataFromApi):
@@ -91,14 +262,11 @@ class RandomUserApiWorker(GetDataFromApi):
         data["last_name"] = user_data["name"]["last"]
         return data
 
-    def get_data_from_api(self) -> None:
-        users = self._get_valid_response_data(dict)
-        for user in users["results"]:
-            city = user["location"]["city"]
-            location = Location.objects.get_or_create(city=city)[0]
-            data = self.form_data_for_person(user)
-            data["location"] = location
-            Person.objects.create(**data)
+    def process_response_data(self, users: dict) -> None:
+        self._save_persons("city", [
+            (user["location"]["city"], self.form_data_for_person(user))
+            for user in users["results"]
+        ])
 
 
 class UINamesApiWorker(GetDataFromApi):
@@ -109,6 +277,7 @@ class UINamesApiWorker(GetDataFromApi):
         self.url = 'https://uinames.com/api/'
         self.schema_path = "people/api_validator_schema/UINamesApiSchema"
         self.api_name = "UINames Api"
+        self.response_type = list
 
     @staticmethod
     def form_data_for_person(user_data: dict) -> dict:
@@ -119,14 +288,11 @@ class UINamesApiWorker(GetDataFromApi):
         data["last_name"] = user_data["surname"]
         return data
 
-    def get_data_from_api(self) -> None:
-        users = self._get_valid_response_data(list)
-        for user in users:
-            region = user["region"]
-            location = Location.objects.get_or_create(region=region)[0]
-            data = self.form_data_for_person(user)
-            data["location"] = location
-            Person.objects.create(**data)
+    def process_response_data(self, users: list) -> None:
+        self._save_persons("region", [
+            (user["region"], self.form_data_for_person(user))
+            for user in users
+        ])
 
 
 class GenderizeApi(GetDataFromApi):
@@ -144,9 +310,21 @@ class GenderizeApi(GetDataFromApi):
         return data
 
     def get_data_from_api(self) -> dict:
-        gender_data = self._get_valid_response_data(dict)
+        name = (self.params or {}).get("name")
+        if name:
+            known = get_gender_index().lookup(name)
+            if known:
+                return {"gender": known[0]}
+        gender_data = self._get_valid_response_data(self.response_type)
+        return self.process_response_data(gender_data)
+
+    def process_response_data(self, gender_data: dict) -> dict:
+        name = (self.params or {}).get("name")
         data = dict()
         data["gender"] = self.form_data_for_person(gender_data["gender"])
+        if name and gender_data["gender"] in ("male", "female"):
+            get_gender_index().add(name, data["gender"],
+                                   gender_data.get("probability") or 0)
         return data
 
 
@@ -158,6 +336,7 @@ class JsonPlaceholderApiWorker(GetDataFromApi):
         self.url = 'http://jsonplaceholder.typicode.com/users'
         self.schema_path = "people/api_validator_schema/JsonPlaceholderApiSchema"
         self.api_name = "JsonPlaceholder Api"
+        self.response_type = list
 
     @staticmethod
     def form_data_for_person(user_data: dict) -> dict:
@@ -170,14 +349,13 @@ class JsonPlaceholderApiWorker(GetDataFromApi):
         data.update(gender)
         return data
 
-    def get_data_from_api(self) -> None:
-        users = self._get_valid_response_data(list)
-        for user in users:
-            city = user["address"]["city"]
-            location = Location.objects.get_or_create(city=city)[0]
-            data = self.form_data_for_person(user)
-            data["location"] = location
-            Person.objects.create(**data)
+    def fetch_related_data(self, users: list) -> list:
+        """Ask Genderize for the gender of every user"""
+        return [(user["address"]["city"], self.form_data_for_person(user))
+                for user in users]
+
+    def process_response_data(self, persons: list) -> None:
+        self._save_persons("city", persons)
 
 
 class ApiWorker:
@@ -200,19 +378,60 @@ class ApiWorker:
                     "Api Worker must be instance of class GetDataFromApi"
                 )
 
+    @staticmethod
+    def _worker_failed(worker: GetDataFromApi, error: Exception) -> Exception:
+        # The run is already in the ingestion ledger and HTTP failures on
+        # the circuit breaker of the upstream
+        logger.warning("%s failed: %s", worker.api_name, error_message(error))
+        return error
+
+    @classmethod
+    def _get_worker_data(cls, worker: GetDataFromApi) -> Exception or None:
+        """Run a worker, return its upstream failure instead of raising it,
+        so that one sick source does not stop the healthy ones"""
+        try:
+            worker.get_data_from_api()
+        except UPSTREAM_ERRORS as e:
+            return cls._worker_failed(worker, e)
+        return None
+
+    @classmethod
+    async def _get_worker_data_async(cls, worker: GetDataFromApi) \
+            -> Exception or None:
+        try:
+            await worker.get_data_from_api_async()
+        except UPSTREAM_ERRORS as e:
+            return cls._worker_failed(worker, e)
+        return None
+
+    @staticmethod
+    def raise_if_all_failed(errors: list) -> None:
+        """Nothing was ingested, report the first failure"""
+        if errors and all(error is not None for error in errors):
+            raise errors[0]
+
     def get_data(self) -> None:
         self.check_worker()
-        if self.many:
-            for worker in self.api_worker:
-                worker.get_data_from_api()
-        else:
-            self.api_worker.get_data_from_api()
+        workers = self.api_worker if self.many else [self.api_worker]
+        self.raise_if_all_failed([self._get_worker_data(worker)
+                                  for worker in workers])
+
+    async def get_data_async(self) -> None:
+        """Run all workers concurrently, overlapping their API requests"""
+        self.check_worker()
+        workers = self.api_worker if self.many else [self.api_worker]
+        self.raise_if_all_failed(await asyncio.gather(*[
+            self._get_worker_data_async(worker) for worker in workers]))
+
+
+def get_api_workers() -> List[GetDataFromApi]:
+    """Workers due to run, as configured in INGESTION_WORKERS"""
+    return get_worker_registry().get_workers()
 
 
 def get_users_data_from_api() -> None:
-    api_workers = [
-        RandomUserApiWorker(params={'results': 5}),
-        UINamesApiWorker(params={'amount': 10}),
-        JsonPlaceholderApiWorker()
-    ]
-    ApiWorker(api_workers).get_data()
+    ApiWorker(get_api_workers()).get_data()
+
+
+async def get_users_data_from_api_async() -> None:
+    await ApiWorker(get_api_workers()).get_data_async()
@@ -1,9 +1,71 @@
-from unittest import TestCase, mock
-from rest_framework import serializers
-import requests
+import asyncio
+import copy
+import datetime
+import gzip
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import TestCase, mock, skipUnless
+
 import jsonschema
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from people import async_views, compression, partitions
+from people.admin import EstimatedCountPaginator, estimate_count
+from people.events import (
+    LocationChangeBroadcaster, Subscriber, fetch_changes, fetch_snapshot,
+    format_event, get_since, location_stream
+)
+from people.gender_index import NameGenderIndex, get_learned_path
+from people.ingestion import IngestionRecorder
+from people.locations import LocationResolver
+from people.management.commands.import_people import (
+    Command as ImportPeopleCommand, CopyStream, normalize_row, read_rows
+)
+from people.models import IngestionRun, Location, Person, PersonDailyCount
+from people.profiling import ProfilingMiddleware, track_http_call
+from people.renderers import FastJSONParser, FastJSONRenderer
+from people.routers import (
+    ReplicaRouter, pin_primary, primary_reads, replica_reads
+)
+from people.serializers import (
+    IngestionSummarySerializer, LocationLookupSerializer
+)
 from people.service import *
-from people.models import Location, Person
+from people.transport import (
+    CACHE, LIVE, RECORD, REPLAY, ResponseStore, UpstreamTransport,
+    request_key, reset_upstream_transport
+)
+from people.upstreams import (
+    AimdLimiter, CircuitBreaker, TokenBucket, UpstreamGuard,
+    UpstreamUnavailable, get_upstream_metrics, reset_upstream_guards
+)
+from people.views import (
+    DateRangeMixin, GenderPersonCountByLocationViewSet,
+    LocationPersonCountByGenderViewSet, ReplicaReadMixin,
+    UpstreamMetricsViewSet
+)
+from people.workers import WorkerRegistry, reset_worker_registry
 
 
 class GetResponseTestCase(TestCase):
@@ -156,11 +218,14 @@ class RandomUserApiFormDataForPerson(RandomUserApiTestCaseMixin):
 
 class RandomUserApiGetDataFromApiTestCase(RandomUserApiTestCaseMixin):
 
-    @mock.patch("people.models.Location.objects.get_or_create")
-    @mock.patch("people.models.Person.objects.create")
-    def test_get_data_from_api_success(self, mock_person, mock_location):
-        mock_person.return_value = None
-        mock_location.return_value = [None, False]
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_get_data_from_api_success(self, mock_person, mock_location,
+                                  mock_save):
+        mock_person.return_value = []
+        resolver = mock_location.return_value
+        resolver.resolve.return_value = {"test": 1}
         count = 5
         self.data['results'] = self.data['results'] * count
         service = RandomUserApiWorker()
@@ -171,14 +236,18 @@ class RandomUserApiGetDataFromApiTestCase(RandomUserApiTestCaseMixin):
             return_value=self.form_data
         )
         service.get_data_from_api()
-        self.assertEqual(mock_person.call_count, count)
-        self.assertEqual(mock_location.call_count, count)
-
-    @mock.patch("people.models.Location.objects.get_or_create")
-    @mock.patch("people.models.Person.objects.create")
-    def test_get_data_from_api_failed(self, mock_person, mock_location):
-        mock_person.return_value = None
-        mock_location.return_value = [None, False]
+        self.assertEqual(mock_person.call_count, 1)
+        self.assertEqual(len(mock_person.call_args[0][0]), count)
+        resolver.resolve.assert_called_once_with(mock.ANY, {"test"})
+
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_get_data_from_api_failed(self, mock_person, mock_location,
+                                  mock_save):
+        mock_person.return_value = []
+        resolver = mock_location.return_value
+        resolver.resolve.return_value = {"test": 1}
         count = 5
         self.data['results'] = self.data['results'] * count
         service = RandomUserApiWorker()
@@ -191,7 +260,7 @@ class RandomUserApiGetDataFromApiTestCase(RandomUserApiTestCaseMixin):
         with self.assertRaises(serializers.ValidationError):
             service.get_data_from_api()
         self.assertEqual(mock_person.call_count, 0)
-        self.assertEqual(mock_location.call_count, 0)
+        self.assertEqual(resolver.resolve.call_count, 0)
 
 
 class UINamesApiTestCaseMixin(RandomUserApiTestCaseMixin):
@@ -228,11 +297,14 @@ class UINamesApiFormDataForPerson(UINamesApiTestCaseMixin):
 
 class UINamesApiGetDataFromApiTestCase(UINamesApiTestCaseMixin):
 
-    @mock.patch("people.models.Location.objects.get_or_create")
-    @mock.patch("people.models.Person.objects.create")
-    def test_get_data_from_api_success(self, mock_person, mock_location):
-        mock_person.return_value = None
-        mock_location.return_value = [None, False]
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_get_data_from_api_success(self, mock_person, mock_location,
+                                  mock_save):
+        mock_person.return_value = []
+        resolver = mock_location.return_value
+        resolver.resolve.return_value = {"test": 1}
         count = 5
         self.data = self.data * count
         service = UINamesApiWorker()
@@ -243,14 +315,18 @@ class UINamesApiGetDataFromApiTestCase(UINamesApiTestCaseMixin):
             return_value=self.form_data
         )
         service.get_data_from_api()
-        self.assertEqual(mock_person.call_count, count)
-        self.assertEqual(mock_location.call_count, count)
-
-    @mock.patch("people.models.Location.objects.get_or_create")
-    @mock.patch("people.models.Person.objects.create")
-    def test_get_data_from_api_failed(self, mock_person, mock_location):
-        mock_person.return_value = None
-        mock_location.return_value = [None, False]
+        self.assertEqual(mock_person.call_count, 1)
+        self.assertEqual(len(mock_person.call_args[0][0]), count)
+        resolver.resolve.assert_called_once_with(mock.ANY, {"test"})
+
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_get_data_from_api_failed(self, mock_person, mock_location,
+                                  mock_save):
+        mock_person.return_value = []
+        resolver = mock_location.return_value
+        resolver.resolve.return_value = {"test": 1}
         count = 5
         self.data = self.data * count
         service = UINamesApiWorker()
@@ -263,7 +339,7 @@ class UINamesApiGetDataFromApiTestCase(UINamesApiTestCaseMixin):
         with self.assertRaises(serializers.ValidationError):
             service.get_data_from_api()
         self.assertEqual(mock_person.call_count, 0)
-        self.assertEqual(mock_location.call_count, 0)
+        self.assertEqual(resolver.resolve.call_count, 0)
 
 
 class GenderizeApiFormDataForPersonTestCase(TestCase):
@@ -298,6 +374,124 @@ class GenderizeApiGetDataFromApiTestCase(TestCase):
             service.get_data_from_api()
 
 
+class GenderizeApiGenderIndexTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.index = mock.MagicMock()
+        patcher = mock.patch("people.service.get_gender_index",
+                             return_value=self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_data_from_api_known_name(self):
+        self.index.lookup.return_value = ("F", 0.98)
+        service = GenderizeApi(params={"name": "leanne"})
+        service._get_valid_response_data = mock.MagicMock()
+        result = service.get_data_from_api()
+        self.assertEqual(result, {"gender": "F"})
+        service._get_valid_response_data.assert_not_called()
+
+    def test_get_data_from_api_unknown_name_is_learned(self):
+        self.index.lookup.return_value = None
+        service = GenderizeApi(params={"name": "ervin"})
+        service._get_valid_response_data = mock.MagicMock(
+            return_value={"gender": "male", "probability": 0.99})
+        result = service.get_data_from_api()
+        self.assertEqual(result, {"gender": "M"})
+        self.index.add.assert_called_once_with("ervin", "M", 0.99)
+
+    def test_get_data_from_api_unknown_gender_not_learned(self):
+        self.index.lookup.return_value = None
+        service = GenderizeApi(params={"name": "xyz"})
+        service._get_valid_response_data = mock.MagicMock(
+            return_value={"gender": None})
+        service.get_data_from_api()
+        self.index.add.assert_not_called()
+
+
+class NameGenderIndexTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, "names.tsv")
+        self.records = [("Leanne", "F", 0.98), ("ervin", "M", 0.99),
+                        ("clementine", "F", 0.97), ("dennis", "M", 0.99)]
+        NameGenderIndex.build(self.path, self.records)
+
+    def test_lookup_bundled_names(self):
+        index = NameGenderIndex(self.path)
+        self.assertEqual(index.lookup("leanne"), ("F", 0.98))
+        self.assertEqual(index.lookup(" Dennis "), ("M", 0.99))
+        self.assertEqual(index.lookup("clementine"), ("F", 0.97))
+        self.assertEqual(index.lookup("ervin"), ("M", 0.99))
+        self.assertIsNone(index.lookup("patricia"))
+        self.assertIsNone(index.lookup("a"))
+        self.assertIsNone(index.lookup("zzz"))
+
+    def test_lookup_empty_or_missing_file(self):
+        open(self.path, "w").close()
+        self.assertIsNone(NameGenderIndex(self.path).lookup("leanne"))
+        missing = os.path.join(self.tmp.name, "missing.tsv")
+        self.assertIsNone(NameGenderIndex(missing).lookup("leanne"))
+
+    def test_add_is_persisted_and_overrides_negative_lookup(self):
+        index = NameGenderIndex(self.path)
+        self.assertIsNone(index.lookup("patricia"))
+        index.add("Patricia", "F", 0.99)
+        self.assertEqual(index.lookup("patricia"), ("F", 0.99))
+        reopened = NameGenderIndex(self.path)
+        self.assertEqual(reopened.lookup("patricia"), ("F", 0.99))
+
+    def test_rebuild_merges_names_learned_by_every_process(self):
+        learned_path = os.path.join(self.tmp.name, "data", "names.learned")
+        index = NameGenderIndex(self.path, learned_path)
+        other = NameGenderIndex(self.path, learned_path)
+        index.add("patricia", "F", 0.99)
+        other.add("kurtis", "M", 0.98)
+        index.rebuild([("glenna", "F", 0.97)])
+        index.close()
+        self.assertEqual(os.path.getsize(learned_path), 0)
+        rebuilt = NameGenderIndex(self.path, learned_path)
+        self.assertEqual(rebuilt.lookup("patricia"), ("F", 0.99))
+        self.assertEqual(rebuilt.lookup("kurtis"), ("M", 0.98))
+        self.assertEqual(rebuilt.lookup("glenna"), ("F", 0.97))
+        self.assertEqual(rebuilt.lookup("leanne"), ("F", 0.98))
+
+    def test_add_to_read_only_location_is_kept_in_memory(self):
+        index = NameGenderIndex(self.path, os.path.join(
+            self.tmp.name, "names.learned"))
+        with mock.patch("people.gender_index.os.open",
+                        side_effect=PermissionError("read-only")), \
+                self.assertLogs("people.gender_index", "WARNING"):
+            index.add("patricia", "F", 0.99)
+        self.assertEqual(index.lookup("patricia"), ("F", 0.99))
+
+    def test_learned_names_are_kept_outside_the_package(self):
+        with override_settings(GENDER_INDEX_LEARNED_DIR=self.tmp.name):
+            self.assertEqual(get_learned_path(),
+                             os.path.join(self.tmp.name, "names.tsv.learned"))
+
+    def test_bundled_index_is_sorted(self):
+        with open(settings.GENDER_INDEX_PATH, "rb") as f:
+            names = [line.split(b"\t", 1)[0] for line in f]
+        self.assertGreater(len(names), 100)
+        self.assertEqual(names, sorted(set(names)))
+        index = NameGenderIndex(settings.GENDER_INDEX_PATH, os.path.join(
+            self.tmp.name, "names.learned"))
+        self.assertEqual(index.lookup("Leanne"), ("F", 0.99))
+        self.assertEqual(index.lookup("ervin"), ("M", 0.99))
+
+    def test_lookup_large_index(self):
+        records = [("name{:06d}".format(i), "M" if i % 2 else "F", 0.5)
+                   for i in range(0, 20000, 3)]
+        NameGenderIndex.build(self.path, records)
+        index = NameGenderIndex(self.path)
+        for name, gender, _ in records[::97]:
+            self.assertEqual(index.lookup(name), (gender, 0.5))
+        self.assertIsNone(index.lookup("name000001"))
+
+
 class JsonPlaceholderApiTestCaseMixin(RandomUserApiTestCaseMixin):
 
     def setUp(self) -> None:
@@ -331,11 +525,14 @@ class JsonPlaceholderApiFormDataForPersonTesCase(JsonPlaceholderApiTestCaseMixin
 
 class JsonPlaceholderApiGetDataFromApiTestCase(JsonPlaceholderApiTestCaseMixin):
 
-    @mock.patch("people.models.Location.objects.get_or_create")
-    @mock.patch("people.models.Person.objects.create")
-    def test_get_data_from_api_success(self, mock_person, mock_location):
-        mock_person.return_value = None
-        mock_location.return_value = [None, False]
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_get_data_from_api_success(self, mock_person, mock_location,
+                                  mock_save):
+        mock_person.return_value = []
+        resolver = mock_location.return_value
+        resolver.resolve.return_value = {"test": 1}
         count = 5
         self.data = self.data * count
         service = JsonPlaceholderApiWorker()
@@ -346,14 +543,18 @@ class JsonPlaceholderApiGetDataFromApiTestCase(JsonPlaceholderApiTestCaseMixin):
             return_value=self.form_data
         )
         service.get_data_from_api()
-        self.assertEqual(mock_person.call_count, count)
-        self.assertEqual(mock_location.call_count, count)
-
-    @mock.patch("people.models.Location.objects.get_or_create")
-    @mock.patch("people.models.Person.objects.create")
-    def test_get_data_from_api_failed(self, mock_person, mock_location):
-        mock_person.return_value = None
-        mock_location.return_value = [None, False]
+        self.assertEqual(mock_person.call_count, 1)
+        self.assertEqual(len(mock_person.call_args[0][0]), count)
+        resolver.resolve.assert_called_once_with(mock.ANY, {"test"})
+
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_get_data_from_api_failed(self, mock_person, mock_location,
+                                  mock_save):
+        mock_person.return_value = []
+        resolver = mock_location.return_value
+        resolver.resolve.return_value = {"test": 1}
         count = 5
         self.data = self.data * count
         service = JsonPlaceholderApiWorker()
@@ -366,7 +567,7 @@ class JsonPlaceholderApiGetDataFromApiTestCase(JsonPlaceholderApiTestCaseMixin):
         with self.assertRaises(serializers.ValidationError):
             service.get_data_from_api()
         self.assertEqual(mock_person.call_count, 0)
-        self.assertEqual(mock_location.call_count, 0)
+        self.assertEqual(resolver.resolve.call_count, 0)
 
 
 class ApiWorkerTestCaseMixin(TestCase):
@@ -437,6 +638,1880 @@ class ApiWorkerGetDataTestCase(ApiWorkerTestCaseMixin):
         self.assertEqual(self.worker_with_method.get_data_from_api.call_count, 0)
 
 
+class InMemoryLocationResolver(LocationResolver):
+    """Resolver backed by a thread-safe store with unique name semantics"""
+
+    def __init__(self, store: dict, lock: threading.Lock):
+        super(InMemoryLocationResolver, self).__init__()
+        self.store = store
+        self.store_lock = lock
+        self.insert_calls = 0
+
+    def _load_all(self):
+        with self.store_lock:
+            return [(pk, name if field == "city" else None,
+                     name if field == "region" else None)
+                    for (field, name), pk in self.store.items()]
+
+    def _insert_missing(self, field, names):
+        self.insert_calls += 1
+        created = dict()
+        for name in names:
+            with self.store_lock:
+                if (field, name) not in self.store:
+                    self.store[(field, name)] = len(self.store) + 1
+                    created[name] = self.store[(field, name)]
+        return created
+
+    def _select(self, field, names):
+        with self.store_lock:
+            return {name: self.store[(field, name)] for name in names
+                    if (field, name) in self.store}
+
+
+class LocationResolverTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.store = {("city", "kyiv"): 1}
+        self.resolver = InMemoryLocationResolver(self.store, threading.Lock())
+        self.committed = []
+        patcher = mock.patch("people.locations.transaction.on_commit",
+                             side_effect=lambda func, using: func())
+        self.on_commit = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resolve_warms_cache_and_creates_missing(self):
+        result = self.resolver.resolve("city", ["kyiv", "lviv", None])
+        self.assertEqual(result, {"kyiv": 1, "lviv": 2})
+        self.assertEqual(self.resolver.insert_calls, 1)
+
+    def test_resolve_known_names_from_cache(self):
+        self.resolver.resolve("city", ["kyiv", "lviv"])
+        result = self.resolver.resolve("city", ["lviv", "kyiv"])
+        self.assertEqual(result, {"kyiv": 1, "lviv": 2})
+        self.assertEqual(self.resolver.insert_calls, 1)
+
+    def test_resolve_fields_are_independent(self):
+        result = self.resolver.resolve("region", ["kyiv"])
+        self.assertEqual(result, {"kyiv": 2})
+
+    def test_resolve_wrong_field(self):
+        with self.assertRaises(ValueError):
+            self.resolver.resolve("country", ["kyiv"])
+
+    def test_resolve_caches_after_commit(self):
+        callbacks = []
+        self.on_commit.side_effect = lambda func, using: callbacks.append(
+            func)
+        self.assertEqual(self.resolver.resolve("city", ["lviv"]),
+                         {"lviv": 2})
+        self.assertNotIn("lviv", self.resolver._ids["city"])
+        callbacks[0]()
+        self.assertEqual(self.resolver._ids["city"]["lviv"], 2)
+
+
+@skipUnless(connection.vendor == "postgresql",
+            "INSERT ... ON CONFLICT races need PostgreSQL")
+class LocationResolverDatabaseTestCase(TransactionTestCase):
+    """Concurrent ingestion threads against the real database"""
+
+    databases = {"default"} if connection.vendor == "postgresql" else set()
+
+    def test_resolve_concurrent_workers(self):
+        names = ["city{}".format(i) for i in range(300)]
+        shared = LocationResolver()
+        resolvers = [shared] * 4 + [LocationResolver() for _ in range(4)]
+        results, errors = [], []
+        start = threading.Barrier(len(resolvers))
+
+        def ingest(resolver, seed):
+            rnd = random.Random(seed)
+            try:
+                start.wait()
+                for _ in range(20):
+                    batch = rnd.sample(names, 40)
+                    with transaction.atomic():
+                        results.append(resolver.resolve("city", batch))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=ingest, args=(resolver, i))
+                   for i, resolver in enumerate(resolvers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        stored = dict(Location.objects.values_list("city", "id"))
+        self.assertEqual(len(stored), len(set(names) & set(
+            name for result in results for name in result)))
+        for result in results:
+            self.assertEqual(len(result), 40)
+            for name, pk in result.items():
+                self.assertEqual(stored[name], pk)
+
+    def test_rolled_back_insert_is_not_cached(self):
+        resolver = LocationResolver()
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                created = resolver.resolve("city", ["Lviv"])
+                raise RuntimeError()
+        self.assertFalse(Location.objects.filter(city="Lviv").exists())
+        self.assertNotIn("Lviv", resolver._ids["city"])
+        pk = resolver.resolve("city", ["Lviv"])["Lviv"]
+        self.assertNotEqual(pk, created["Lviv"])
+        self.assertEqual(Location.objects.get(city="Lviv").pk, pk)
+
+
+class ImportPeopleTestCase(TestCase):
+
+    def test_normalize_row_city(self):
+        row = {"first_name": " Leanne ", "last_name": "Graham",
+               "gender": "female", "city": "Gwenborough", "region": "x"}
+        self.assertEqual(normalize_row(row),
+                         ("Leanne", "Graham", "F", "Gwenborough", None))
+
+    def test_normalize_row_region(self):
+        row = {"first_name": "Ervin", "last_name": "Howell",
+               "gender": "M", "city": "", "region": "Kyiv"}
+        self.assertEqual(normalize_row(row),
+                         ("Ervin", "Howell", "M", None, "Kyiv"))
+
+    def test_normalize_row_invalid(self):
+        row = {"first_name": "Ervin", "last_name": "Howell", "gender": "M"}
+        self.assertIsNone(normalize_row(row))
+        row.update(city="Kyiv", gender="unknown")
+        self.assertIsNone(normalize_row(row))
+        self.assertIsNone(normalize_row({}))
+
+    def test_normalize_row_not_an_object(self):
+        for row in ([1, 2], "Kyiv", 3, None):
+            self.assertIsNone(normalize_row(row))
+
+    def test_normalize_row_wrong_types(self):
+        row = {"first_name": "Ervin", "last_name": "Howell", "gender": "M",
+               "city": "Kyiv"}
+        for field, value in (("city", 123), ("region", ["Kyiv"]),
+                             ("first_name", {"first": "Ervin"}),
+                             ("last_name", True), ("city", "Ky\x00iv")):
+            self.assertIsNone(normalize_row(dict(row, **{field: value})))
+        self.assertEqual(normalize_row(dict(row, region=None)),
+                         ("Ervin", "Howell", "M", "Kyiv", None))
+
+    def test_normalize_row_too_long(self):
+        row = {"first_name": "Ervin", "last_name": "Howell", "gender": "M",
+               "city": "Kyiv"}
+        for field in ("first_name", "last_name", "city", "region"):
+            self.assertIsNone(normalize_row(dict(row, **{field: "x" * 251})))
+        self.assertEqual(normalize_row(dict(row, city=" {} ".format(
+            "x" * 250)))[3], "x" * 250)
+
+    def test_malformed_rows_are_skipped(self):
+        lines = ['{"first_name": "Ervin", "last_name": "Howell", '
+                 '"gender": "M", "city": "Kyiv"}',
+                 '[1, 2]', 'broken', '{"first_name": "Ervin", '
+                 '"last_name": "Howell", "gender": "M", "city": 123}',
+                 json.dumps({"first_name": "Ervin", "last_name": "Howell",
+                             "gender": "M", "region": "x" * 251})]
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson") as f:
+            f.write("\n".join(lines))
+            f.flush()
+            command = ImportPeopleCommand()
+            command.read = command.skipped = 0
+            rows = list(command.staged_rows([f.name], {"format": None}))
+        self.assertEqual(rows, [("Ervin", "Howell", "M", "Kyiv", None)])
+        self.assertEqual((command.read, command.skipped), (5, 4))
+
+    def test_read_rows_csv_and_ndjson(self):
+        csv_file = io.StringIO("first_name,last_name,gender,city\n"
+                               "Leanne,Graham,F,Gwenborough\n")
+        ndjson_file = io.StringIO('{"first_name": "Leanne"}\n\nbroken\n')
+        self.assertEqual(list(read_rows(csv_file, "csv")), [
+            {"first_name": "Leanne", "last_name": "Graham", "gender": "F",
+             "city": "Gwenborough"}])
+        self.assertEqual(list(read_rows(ndjson_file, "ndjson")),
+                         [{"first_name": "Leanne"}, {}])
+
+    def test_copy_stream_escapes_values(self):
+        rows = [("a\tb", "c\\d", "M", None, "e\nf")] * 100
+        stream = CopyStream(rows)
+        data = b""
+        while True:
+            chunk = stream.read(64)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), 64)
+            data += chunk
+        line = b"a\\tb\tc\\\\d\tM\t\\N\te\\nf\n"
+        self.assertEqual(data, line * 100)
+
+
+class PersonCreateManyTestCase(TestCase):
+
+    @mock.patch("people.models.Location.touch")
+    @mock.patch("people.models.transaction.atomic")
+    @mock.patch("people.models.PersonDailyCount.add_counts")
+    @mock.patch("people.models.Person.objects.bulk_create")
+    def test_create_many_updates_daily_counts(self, mock_bulk_create,
+                                              mock_add_counts, mock_atomic,
+                                              mock_touch):
+        mock_bulk_create.side_effect = lambda persons: persons
+        persons = [Person(location_id=1, gender="M"),
+                   Person(location_id=1, gender="M"),
+                   Person(location_id=1, gender="F"),
+                   Person(location_id=2, gender="F")]
+        result = Person.create_many(persons, source="test")
+        self.assertEqual(result, persons)
+        day = persons[0].created_at.date()
+        mock_add_counts.assert_called_once_with({
+            (1, "M", day): 2, (1, "F", day): 1, (2, "F", day): 1
+        })
+        self.assertEqual({p.source for p in persons}, {"test"})
+        self.assertEqual(len({p.created_at for p in persons}), 1)
+        self.assertEqual(list(mock_touch.call_args[0][0]), [1, 1, 1, 2])
+
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_worker_passes_source(self, mock_create_many, mock_resolver):
+        mock_resolver.return_value.resolve.return_value = {"kyiv": 1}
+        service = UINamesApiWorker()
+        service._save_persons("region", [("kyiv", {"gender": "M"})])
+        self.assertEqual(mock_create_many.call_args[1],
+                         {"source": service.api_name})
+
+
+class DateRangeMixinTestCase(TestCase):
+
+    def get_date_range(self, query):
+        view = DateRangeMixin()
+        view.request = Request(RequestFactory().get("/", query))
+        return view.get_date_range()
+
+    def test_get_date_range_empty(self):
+        self.assertEqual(self.get_date_range({}), (None, None))
+
+    def test_get_date_range_success(self):
+        result = self.get_date_range({"from": "2019-08-01",
+                                      "to": "2019-08-07"})
+        self.assertEqual(result, (datetime.date(2019, 8, 1),
+                                  datetime.date(2019, 8, 7)))
+
+    def test_get_date_range_wrong_format(self):
+        for query in ({"from": "yesterday"}, {"to": "2019-02-30"}):
+            with self.assertRaises(serializers.ValidationError):
+                self.get_date_range(query)
+
+    def test_get_date_range_reversed(self):
+        with self.assertRaises(serializers.ValidationError):
+            self.get_date_range({"from": "2019-08-07", "to": "2019-08-01"})
+
+    def test_in_range_filters(self):
+        query = str(PersonDailyCount.in_range(
+            datetime.date(2019, 8, 1), datetime.date(2019, 8, 7)).query)
+        self.assertIn("2019-08-01", query)
+        self.assertIn("2019-08-07", query)
+
+
+class LocationAggregateParamsTestCase(TestCase):
+
+    def get_view(self, query):
+        view = LocationPersonCountByGenderViewSet()
+        view.request = Request(RequestFactory().get("/", query))
+        view.format_kwarg = None
+        return view
+
+    def test_get_aggregate_params_success(self):
+        view = self.get_view({"ordering": "-female", "limit": "20",
+                              "gender": "F", "min_total": "0"})
+        self.assertEqual(view.get_aggregate_params(), {
+            "ordering": "-female", "limit": 20, "gender": "F", "min_total": 0
+        })
+
+    def test_get_aggregate_params_failed(self):
+        for query in ({"ordering": "city"}, {"limit": "0"},
+                      {"limit": "many"}, {"gender": "X"},
+                      {"min_total": "-1"}):
+            with self.assertRaises(serializers.ValidationError):
+                self.get_view(query).get_aggregate_params()
+
+    def test_get_queryset_without_params_counts_persons(self):
+        query = str(self.get_view({}).get_queryset().query)
+        self.assertIn("people_person", query)
+        self.assertNotIn("people_persondailycount", query)
+
+    def test_get_queryset_top_n_reads_totals(self):
+        view = self.get_view({"ordering": "-female", "limit": "20",
+                              "gender": "M", "min_total": "5"})
+        query = str(view.get_queryset().query)
+        self.assertNotIn("people_persondailycount", query)
+        self.assertNotIn("GROUP BY", query)
+        self.assertIn("\"people_location\".\"male_count\" > 0", query)
+        self.assertIn("\"people_location\".\"total_count\" >= 5", query)
+        self.assertIn("\"people_location\".\"female_count\" AS \"female\"",
+                      query)
+        self.assertIn("ORDER BY \"female\" DESC, \"people_location\".\"id\" "
+                      "DESC", query)
+        self.assertIn("LIMIT 20", query)
+
+    def test_get_queryset_top_n_in_date_range(self):
+        view = self.get_view({"ordering": "total", "limit": "20",
+                              "from": "2019-08-01"})
+        query = str(view.get_queryset().query)
+        self.assertIn("JOIN \"people_persondailycount\"", query)
+        self.assertIn("ORDER BY \"total\" ASC, \"people_location\".\"id\" "
+                      "ASC", query)
+
+    def test_min_total_message(self):
+        with self.assertRaises(serializers.ValidationError) as error:
+            self.get_view({"min_total": "-1"}).get_aggregate_params()
+        self.assertEqual(error.exception.detail["min_total"],
+                         "Must be zero or a positive number")
+
+
+class LocationLookupTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.rows = [
+            {"id": 1, "city": "Kyiv", "region": None,
+             "female": 2, "male": 1, "total": 3},
+            {"id": 7, "city": None, "region": "Bosnia and Herzegovina",
+             "female": 0, "male": 4, "total": 4},
+        ]
+        self.factory = RequestFactory()
+
+    def test_lookup_serializer_validation(self):
+        self.assertTrue(LocationLookupSerializer(
+            data={"names": ["Kyiv"], "ids": [7]}).is_valid())
+        self.assertFalse(LocationLookupSerializer(data={}).is_valid())
+        self.assertFalse(LocationLookupSerializer(
+            data={"ids": [0]}).is_valid())
+        self.assertFalse(LocationLookupSerializer(
+            data={"names": ["x"] * 1001}).is_valid())
+
+    @mock.patch("people.views.LocationPersonCountByGenderViewSet."
+                "get_person_counts")
+    def test_lookup_keyed_by_id(self, mock_counts):
+        queryset = mock_counts.return_value
+        queryset.filter.return_value = self.rows
+        view = LocationPersonCountByGenderViewSet.as_view({"post": "lookup"})
+        request = self.factory.post("/", {"names": ["Kyiv"], "ids": [7]},
+                                    content_type="application/json")
+        response = view(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            "1": {"id": 1, "city": "Kyiv", "region": None,
+                  "male": 1, "female": 2, "total": 3},
+            "7": {"id": 7, "city": None, "region": "Bosnia and Herzegovina",
+                  "male": 4, "female": 0, "total": 4},
+        })
+        self.assertEqual(queryset.filter.call_count, 1)
+
+    @mock.patch("people.views.LocationPersonCountByGenderViewSet."
+                "get_person_counts")
+    def test_lookup_city_and_region_of_same_name(self, mock_counts):
+        mock_counts.return_value.filter.return_value = [
+            {"id": 3, "city": "Lviv", "region": None,
+             "female": 1, "male": 0, "total": 1},
+            {"id": 4, "city": None, "region": "Lviv",
+             "female": 0, "male": 2, "total": 2},
+            {"id": 5, "city": None, "region": None,
+             "female": 1, "male": 1, "total": 2},
+        ]
+        view = LocationPersonCountByGenderViewSet.as_view({"post": "lookup"})
+        request = self.factory.post("/", {"names": ["Lviv"], "ids": [5]},
+                                    content_type="application/json")
+        response = view(request)
+        self.assertEqual(sorted(response.data), ["3", "4", "5"])
+        self.assertEqual(response.data["3"]["total"], 1)
+        self.assertEqual(response.data["4"]["total"], 2)
+        self.assertEqual(json.loads(response.rendered_content)["5"]["total"],
+                         2)
+
+    def test_lookup_bad_request(self):
+        view = LocationPersonCountByGenderViewSet.as_view({"post": "lookup"})
+        request = self.factory.post("/", {"names": []},
+                                    content_type="application/json")
+        self.assertEqual(view(request).status_code, 400)
+
+
+class LocationChangesTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.view = LocationPersonCountByGenderViewSet.as_view(
+            {"get": "changes"})
+        self.factory = RequestFactory()
+        self.rows = [{"id": 1, "city": "Kyiv", "region": None,
+                      "female": 2, "male": 1, "total": 3}]
+
+    @mock.patch("people.models.Location.current_generation")
+    @mock.patch("people.views.LocationPersonCountByGenderViewSet."
+                "get_person_counts")
+    def test_changes_since_token(self, mock_counts, mock_generation):
+        mock_generation.return_value = 42
+        mock_counts.return_value.filter.return_value = self.rows
+        response = self.view(self.factory.get("/", {"since": "40"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["token"], 42)
+        self.assertEqual(response.data["results"], [
+            {"location": "Kyiv",
+             "gender_count": {"male": 1, "female": 2, "total": 3}}])
+        mock_counts.return_value.filter.assert_called_once_with(
+            generation__gt=40)
+
+    @mock.patch("people.models.Location.current_generation")
+    @mock.patch("people.views.LocationPersonCountByGenderViewSet."
+                "get_person_counts")
+    def test_changes_without_token_returns_all(self, mock_counts,
+                                               mock_generation):
+        mock_generation.return_value = 42
+        mock_counts.return_value = self.rows
+        response = self.view(self.factory.get("/"))
+        self.assertEqual(response.data["token"], 42)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_changes_wrong_token(self):
+        response = self.view(self.factory.get("/", {"since": "x"}))
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch("people.models.ChangeGeneration.objects.aggregate")
+    def test_current_generation_follows_the_sequence(self, mock_aggregate):
+        mock_aggregate.return_value = {"generation": 9}
+        self.assertEqual(Location.current_generation(), 9)
+        self.assertEqual(
+            mock_aggregate.call_args[1]["generation"].source_expressions[0]
+            .name, "id")
+        mock_aggregate.return_value = {"generation": None}
+        self.assertEqual(Location.current_generation(), 0)
+
+    @mock.patch("people.management.commands.ingest.get_users_data_from_api")
+    def test_ingest_command(self, mock_ingest):
+        call_command("ingest", stdout=io.StringIO())
+        mock_ingest.assert_called_once_with()
+
+    @mock.patch("people.management.commands.ingest.time.sleep")
+    @mock.patch("people.management.commands.ingest.get_users_data_from_api")
+    def test_ingest_command_keeps_running(self, mock_ingest, mock_sleep):
+        mock_ingest.side_effect = [serializers.ValidationError("upstream"),
+                                   None]
+        mock_sleep.side_effect = [None, KeyboardInterrupt]
+        stderr = io.StringIO()
+        with self.assertRaises(KeyboardInterrupt):
+            call_command("ingest", interval=60, stdout=io.StringIO(),
+                         stderr=stderr)
+        self.assertEqual(mock_ingest.call_count, 2)
+        mock_sleep.assert_called_with(60)
+        self.assertIn("upstream", stderr.getvalue())
+
+    @mock.patch("people.management.commands.ingest.close_old_connections")
+    @mock.patch("people.management.commands.ingest.time.sleep")
+    @mock.patch("people.management.commands.ingest.get_users_data_from_api")
+    def test_ingest_command_survives_unreachable_upstreams(
+            self, mock_ingest, mock_sleep, mock_close):
+        mock_ingest.side_effect = [requests.ConnectionError("refused"),
+                                   requests.Timeout("slow"), None]
+        mock_sleep.side_effect = [None, None, KeyboardInterrupt]
+        stderr = io.StringIO()
+        with self.assertLogs("people.management.commands.ingest", "ERROR"), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command("ingest", interval=5, stdout=io.StringIO(),
+                         stderr=stderr)
+        self.assertEqual(mock_ingest.call_count, 3)
+        self.assertEqual(mock_close.call_count, 3)
+        self.assertIn("refused", stderr.getvalue())
+
+    @mock.patch("people.models.Location.objects.filter")
+    @mock.patch("people.models.ChangeGeneration.next")
+    def test_touch_sets_new_generation(self, mock_next, mock_filter):
+        mock_next.return_value = 7
+        self.assertEqual(Location.touch([1, 2, 1]), 7)
+        mock_filter.assert_called_once_with(id__in={1, 2})
+        mock_filter.return_value.update.assert_called_once_with(generation=7)
+
+
+class LocationEventsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.changes = {"1": {"male": 1, "female": 2, "total": 3}}
+
+    def test_subscriber_coalesces_updates(self):
+        async def scenario():
+            subscriber = Subscriber(max_pending=10)
+            subscriber.publish(2, {"1": {"total": 1}, "2": {"total": 1}})
+            subscriber.publish(3, {"1": {"total": 2}})
+            return await subscriber.get(timeout=1)
+
+        token, changes = asyncio.run(scenario())
+        self.assertEqual(token, 3)
+        self.assertEqual(changes, {"1": {"total": 2}, "2": {"total": 1}})
+
+    def test_subscriber_overflow_and_timeout(self):
+        async def scenario():
+            subscriber = Subscriber(max_pending=1)
+            self.assertIsNone(await subscriber.get(timeout=0.01))
+            subscriber.publish(2, {"1": {}, "2": {}})
+            return subscriber
+
+        self.assertTrue(asyncio.run(scenario()).overflowed)
+
+    def test_broadcaster_fans_out_one_query(self):
+        fetch = mock.MagicMock(return_value=(5, self.changes))
+
+        async def scenario():
+            broadcaster = LocationChangeBroadcaster(
+                poll_interval=60, max_pending=10, fetch=fetch,
+                fetch_token=lambda: 4)
+            await broadcaster.start()
+            subscribers = [broadcaster.subscribe() for _ in range(100)]
+            await broadcaster.poll()
+            updates = [await s.get(timeout=1) for s in subscribers]
+            await broadcaster.stop()
+            return updates
+
+        updates = asyncio.run(scenario())
+        self.assertEqual(updates, [(5, self.changes)] * 100)
+        self.assertIn(mock.call(4), fetch.call_args_list)
+        self.assertLessEqual(fetch.call_count, 2)
+
+    def test_get_since(self):
+        self.assertEqual(get_since({"query_string": b"since=12"}), 12)
+        self.assertEqual(get_since({"query_string": b"since=1",
+                                    "headers": [(b"last-event-id", b"9")]}), 9)
+        self.assertIsNone(get_since({"query_string": b"since=x"}))
+        self.assertIsNone(get_since({}))
+
+    def location_rows(self):
+        return [
+            {"id": 3, "city": "Lviv", "region": None,
+             "female": 1, "male": 0, "total": 1},
+            {"id": 4, "city": None, "region": "Lviv",
+             "female": 0, "male": 2, "total": 2},
+            {"id": 5, "city": None, "region": None,
+             "female": 1, "male": 1, "total": 2},
+            {"id": 6, "city": None, "region": None,
+             "female": 0, "male": 1, "total": 1},
+        ]
+
+    @mock.patch("people.events.close_old_connections")
+    @mock.patch("people.models.Location.get_person_counts")
+    @mock.patch("people.models.Location.current_generation", return_value=9)
+    def test_changes_of_same_named_locations_kept_apart(
+            self, mock_generation, mock_counts, mock_close):
+        mock_counts.return_value = self.location_rows()
+        token, changes = fetch_changes(None)
+        self.assertEqual(token, 9)
+        self.assertEqual(sorted(changes), ["3", "4", "5", "6"])
+        self.assertEqual(changes["3"]["city"], "Lviv")
+        self.assertEqual(changes["4"]["region"], "Lviv")
+        self.assertEqual(changes["4"]["total"], 2)
+        self.assertEqual(changes["6"]["total"], 1)
+
+    @mock.patch("people.events.close_old_connections")
+    @mock.patch("people.models.Location.objects")
+    @mock.patch("people.models.Location.get_counts")
+    @mock.patch("people.models.Location.current_generation", return_value=9)
+    def test_snapshot_of_same_named_locations_kept_apart(
+            self, mock_generation, mock_counts, mock_objects, mock_close):
+        mock_counts.return_value = self.location_rows()
+        mock_objects.values_list.return_value = [(3, 7), (4, 8), (5, 2)]
+        token, entries = fetch_snapshot()
+        self.assertEqual(token, 9)
+        self.assertEqual({key: (generation, counts["total"])
+                          for key, (generation, counts) in entries.items()},
+                         {"3": (7, 1), "4": (8, 2), "5": (2, 2), "6": (0, 1)})
+
+    def test_initial_state_shares_one_snapshot(self):
+        fetch_snapshot = mock.MagicMock(return_value=(5, {
+            "1": (5, {"total": 3}), "2": (2, {"total": 1})}))
+        fetch = mock.MagicMock(return_value=(6, {"2": {"total": 2}}))
+
+        async def scenario():
+            broadcaster = LocationChangeBroadcaster(
+                poll_interval=60, max_pending=10, fetch=fetch,
+                fetch_token=lambda: 5, fetch_snapshot=fetch_snapshot)
+            await broadcaster.start()
+            states = await asyncio.gather(*[
+                broadcaster.initial_state(None) for _ in range(50)])
+            since = await broadcaster.initial_state(3)
+            await broadcaster.poll()
+            polled = await broadcaster.initial_state(5)
+            await broadcaster.stop()
+            return states, since, polled
+
+        states, since, polled = asyncio.run(scenario())
+        fetch_snapshot.assert_called_once_with()
+        self.assertEqual(states, [(5, {"1": {"total": 3},
+                                       "2": {"total": 1}})] * 50)
+        self.assertEqual(since, (5, {"1": {"total": 3}}))
+        self.assertEqual(polled, (6, {"2": {"total": 2}}))
+
+    def test_snapshot_catches_up_with_polls(self):
+        fetch = mock.MagicMock(return_value=(8, {"2": {"total": 2}}))
+
+        async def scenario():
+            broadcaster = LocationChangeBroadcaster(
+                poll_interval=60, max_pending=10, fetch=fetch,
+                fetch_token=lambda: 8,
+                fetch_snapshot=lambda: (6, {"2": (6, {"total": 1})}))
+            await broadcaster.start()
+            return await broadcaster.initial_state(None)
+
+        self.assertEqual(asyncio.run(scenario()),
+                         (8, {"2": {"total": 2}}))
+        fetch.assert_called_once_with(6)
+
+    def test_poll_failures_are_logged(self):
+        fetch = mock.MagicMock(side_effect=RuntimeError("database is down"))
+
+        async def scenario():
+            broadcaster = LocationChangeBroadcaster(
+                poll_interval=0, max_pending=10, fetch=fetch,
+                fetch_token=lambda: 1)
+            broadcaster.subscribe()
+            while fetch.call_count < 2:
+                await asyncio.sleep(0.001)
+            await broadcaster.stop()
+
+        with self.assertLogs("people.events", "ERROR") as logs:
+            asyncio.run(scenario())
+        self.assertIn("database is down", "\n".join(logs.output))
+
+    @override_settings(SSE_HEARTBEAT=0.01)
+    def test_location_stream(self):
+        sent = []
+        fetch = mock.MagicMock(side_effect=lambda since: (7, dict()))
+        snapshot = (7, {"1": (4, self.changes["1"]),
+                        "2": (2, {"male": 0, "female": 1, "total": 1})})
+
+        async def scenario():
+            broadcaster = LocationChangeBroadcaster(
+                poll_interval=60, max_pending=10, fetch=fetch,
+                fetch_token=lambda: 7, fetch_snapshot=lambda: snapshot)
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+                if len(sent) == 3:
+                    disconnected.set()
+
+            async def publish():
+                while not broadcaster.subscribers:
+                    await asyncio.sleep(0)
+                for subscriber in broadcaster.subscribers:
+                    subscriber.publish(8, {"2": {"total": 1}})
+
+            with mock.patch("people.events.get_broadcaster",
+                            return_value=broadcaster):
+                await asyncio.gather(
+                    location_stream({"query_string": b"since=3"},
+                                    receive, send),
+                    publish())
+            return broadcaster
+
+        broadcaster = asyncio.run(scenario())
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertEqual(sent[1]["body"], format_event(7, self.changes))
+        self.assertEqual(sent[2]["body"], format_event(8, {"2": {"total": 1}}))
+        self.assertEqual(broadcaster.subscribers, set())
+
+
+class PartitionsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.cursor = mock.MagicMock()
+        self.cursor.fetchall.return_value = [
+            ("people_person_p2019_07",), ("people_person_p2019_08",),
+            ("people_person_default",), ("people_person_p2019_06",),
+        ]
+        self.cursor.fetchone.return_value = (False,)
+
+    def executed(self):
+        return [c[0][0] for c in self.cursor.execute.call_args_list]
+
+    def test_partition_names(self):
+        month = datetime.date(2019, 12, 17)
+        self.assertEqual(partitions.partition_name(month),
+                         "people_person_p2019_12")
+        self.assertEqual(partitions.next_month(month),
+                         datetime.date(2020, 1, 1))
+        self.assertEqual(partitions.partition_month("people_person_p2019_12"),
+                         datetime.date(2019, 12, 1))
+        self.assertIsNone(partitions.partition_month("people_person_default"))
+
+    def test_list_partitions_sorted(self):
+        self.assertEqual(partitions.list_partitions(self.cursor), [
+            datetime.date(2019, 6, 1), datetime.date(2019, 7, 1),
+            datetime.date(2019, 8, 1)])
+
+    def test_create_partitions_only_missing(self):
+        created = partitions.create_partitions(
+            self.cursor, datetime.date(2019, 8, 20), datetime.date(2019, 10, 5))
+        self.assertEqual(created, ["people_person_p2019_09",
+                                   "people_person_p2019_10"])
+        sql = [q for q in self.executed() if q.startswith("CREATE TABLE")]
+        self.assertEqual(len(sql), 2)
+        self.assertIn("PARTITION OF people_person", sql[0])
+
+    def test_create_partition_moves_default_rows(self):
+        self.cursor.fetchone.return_value = (True,)
+        partitions.create_partition(self.cursor, datetime.date(2019, 9, 1))
+        sql = self.executed()
+        self.assertIn("DELETE FROM people_person_default", sql[2])
+        self.assertIn("ATTACH PARTITION people_person_p2019_09", sql[3])
+
+    def test_drop_expired_partitions(self):
+        dropped = partitions.drop_expired_partitions(
+            self.cursor, datetime.date(2019, 8, 15))
+        self.assertEqual(dropped, ["people_person_p2019_06",
+                                   "people_person_p2019_07"])
+        self.assertIn("DELETE FROM people_persondailycount", self.executed()[-2])
+        self.assertEqual(self.cursor.execute.call_args_list[-2][0][1],
+                         [datetime.date(2019, 8, 1)])
+        self.assertIn("UPDATE people_location SET female_count",
+                      self.executed()[-1])
+
+    def test_drop_expired_partitions_nothing_expired(self):
+        dropped = partitions.drop_expired_partitions(
+            self.cursor, datetime.date(2019, 6, 30))
+        self.assertEqual(dropped, [])
+        self.assertEqual(len(self.executed()), 1)
+
+
+class AsyncIngestionTestCase(TestCase):
+
+    @mock.patch("people.ingestion.IngestionRecorder.save")
+    def test_get_data_from_api_async(self, mock_save):
+        service = RandomUserApiWorker(params={"results": 5})
+        service.get_response = mock.MagicMock(return_value={"results": []})
+        service._validate_response_data = mock.MagicMock(
+            side_effect=lambda data, type_data: data)
+        service.process_response_data = mock.MagicMock(return_value=None)
+        asyncio.run(service.get_data_from_api_async())
+        service.get_response.assert_called_once_with(
+            service.url, {"results": 5})
+        service.process_response_data.assert_called_once_with(
+            {"results": []})
+
+    def test_get_response_async_runs_on_upstream_threads(self):
+        service = RandomUserApiWorker()
+        service.get_response = mock.MagicMock(
+            side_effect=lambda url, params: threading.current_thread().name)
+        name = asyncio.run(service.get_response_async(service.url, {}))
+        self.assertTrue(name.startswith("upstream"))
+
+    def test_get_data_async_overlaps_workers(self):
+        running, overlapped = [], []
+
+        async def fetch():
+            running.append(1)
+            await asyncio.sleep(0.01)
+            overlapped.append(len(running))
+
+        workers = [mock.Mock(spec=GetDataFromApi) for _ in range(3)]
+        for worker in workers:
+            worker.get_data_from_api_async.side_effect = fetch
+        asyncio.run(ApiWorker(workers).get_data_async())
+        self.assertEqual(overlapped, [3, 3, 3])
+
+    def test_get_data_async_check_worker(self):
+        with self.assertRaises(serializers.ValidationError):
+            asyncio.run(ApiWorker([mock.Mock()]).get_data_async())
+
+
+class AsyncViewsTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.scope = {
+            "type": "http", "method": "GET", "path": "/api/location/",
+            "query_string": b"limit=5", "server": ("testserver", 80),
+            "client": ("127.0.0.1", 5000),
+            "headers": [(b"content-type", b"application/json"),
+                        (b"accept", b"application/json"),
+                        (b"x-test", b"a"), (b"x-test", b"b")],
+        }
+
+    def test_build_environ(self):
+        environ = async_views.build_environ(self.scope, b"{}")
+        self.assertEqual(environ["PATH_INFO"], "/api/location/")
+        self.assertEqual(environ["QUERY_STRING"], "limit=5")
+        self.assertEqual(environ["CONTENT_TYPE"], "application/json")
+        self.assertEqual(environ["HTTP_ACCEPT"], "application/json")
+        self.assertEqual(environ["HTTP_X_TEST"], "a,b")
+        self.assertEqual(environ["wsgi.input"].read(), b"{}")
+
+    @override_settings(INGEST_ON_REQUEST=True)
+    @mock.patch("people.async_views.dispatch")
+    @mock.patch("people.async_views.get_users_data_from_api_async")
+    def test_location_list_ingests_before_dispatch(self, mock_ingest,
+                                                   mock_dispatch):
+        mock_ingest.side_effect = serializers.ValidationError("upstream")
+        asyncio.run(async_views.location_list(self.scope, None, None))
+        error = mock_dispatch.call_args[1]["people.ingestion"]
+        self.assertIsInstance(error, serializers.ValidationError)
+
+    @override_settings(INGEST_ON_REQUEST=True)
+    @mock.patch("people.async_views.dispatch")
+    @mock.patch("people.async_views.get_users_data_from_api_async")
+    def test_location_list_hands_connection_errors_to_view(self, mock_ingest,
+                                                           mock_dispatch):
+        mock_ingest.side_effect = requests.ConnectionError("refused")
+        asyncio.run(async_views.location_list(self.scope, None, None))
+        error = mock_dispatch.call_args[1]["people.ingestion"]
+        self.assertIsInstance(error, requests.ConnectionError)
+
+    @override_settings(INGEST_ON_REQUEST=False)
+    @mock.patch("people.async_views.dispatch")
+    @mock.patch("people.async_views.get_users_data_from_api_async")
+    def test_location_list_without_ingestion(self, mock_ingest,
+                                             mock_dispatch):
+        asyncio.run(async_views.location_list(self.scope, None, None))
+        mock_ingest.assert_not_called()
+        self.assertNotIn("people.ingestion", mock_dispatch.call_args[1])
+
+    @override_settings(INGEST_ON_REQUEST=False)
+    @mock.patch("people.views.get_users_data_from_api")
+    def test_view_ingests_only_when_configured(self, mock_ingest):
+        view = LocationPersonCountByGenderViewSet()
+        view.request = Request(RequestFactory().get("/"))
+        view.ingest()
+        mock_ingest.assert_not_called()
+
+    @override_settings(INGEST_ON_REQUEST=True)
+    @mock.patch("people.views.get_users_data_from_api")
+    def test_view_skips_ingestion_done_by_asgi(self, mock_ingest):
+        view = LocationPersonCountByGenderViewSet()
+        view.request = Request(RequestFactory().get("/"))
+        view.request.META["people.ingestion"] = True
+        view.ingest()
+        mock_ingest.assert_not_called()
+        view.request.META["people.ingestion"] = \
+            serializers.ValidationError("upstream")
+        with self.assertRaises(serializers.ValidationError):
+            view.ingest()
+        del view.request.META["people.ingestion"]
+        view.ingest()
+        mock_ingest.assert_called_once_with()
+
+
+class ReplicaRouterTestCase(TestCase):
+
+    class View(ReplicaReadMixin, APIView):
+        authentication_classes = []
+        permission_classes = []
+
+        def get(self, request):
+            if request.query_params.get("ingest"):
+                self.ingested_writes()
+            return Response({"db": router.db_for_read(Location)})
+
+    def setUp(self) -> None:
+        self.router = ReplicaRouter()
+        replica = override_settings(READ_REPLICA_DATABASE="replica")
+        replica.enable()
+        self.addCleanup(replica.disable)
+
+    def test_reads_go_to_replica_only_inside_replica_reads(self):
+        self.assertIsNone(self.router.db_for_read(Location))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Location), "replica")
+            self.assertEqual(self.router.db_for_read(Person), "replica")
+            with primary_reads():
+                self.assertIsNone(self.router.db_for_read(Location))
+            self.assertEqual(self.router.db_for_read(Location), "replica")
+        self.assertIsNone(self.router.db_for_read(Location))
+
+    def test_writes_stay_on_primary(self):
+        with replica_reads():
+            self.assertEqual(self.router.db_for_write(Person), "default")
+            instance = Location(city="Kyiv")
+            instance._state.db = "replica"
+            self.assertEqual(
+                self.router.db_for_write(Location, instance=instance),
+                "default")
+
+    def test_pin_primary_lasts_until_replica_reads_ends(self):
+        with replica_reads():
+            pin_primary()
+            self.assertIsNone(self.router.db_for_read(Location))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(Location), "replica")
+
+    def test_view_reads_from_replica(self):
+        response = self.View.as_view()(RequestFactory().get("/"))
+        self.assertEqual(response.data, {"db": "replica"})
+        self.assertNotIn(ReplicaReadMixin.PRIMARY_COOKIE, response.cookies)
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=5)
+    def test_read_your_writes_window(self):
+        response = self.View.as_view()(RequestFactory().get("/?ingest=1"))
+        self.assertEqual(response.data, {"db": "default"})
+        cookie = response.cookies[ReplicaReadMixin.PRIMARY_COOKIE]
+        self.assertEqual(cookie["max-age"], 5)
+        request = RequestFactory().get("/")
+        request.COOKIES[ReplicaReadMixin.PRIMARY_COOKIE] = "1"
+        response = self.View.as_view()(request)
+        self.assertEqual(response.data, {"db": "default"})
+
+    def test_read_your_writes_disabled(self):
+        response = self.View.as_view()(RequestFactory().get("/?ingest=1"))
+        self.assertEqual(response.data, {"db": "replica"})
+        self.assertNotIn(ReplicaReadMixin.PRIMARY_COOKIE, response.cookies)
+
+
+@override_settings(READ_REPLICA_DATABASE="replica", INGEST_ON_REQUEST=True)
+class ReplicaDatabaseTestCase(TransactionTestCase):
+    """Two connections, the "replica" alias mirroring the primary"""
+
+    databases = {"default", "replica"}
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch("people.service.get_location_resolver",
+                             return_value=LocationResolver())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.view = LocationPersonCountByGenderViewSet.as_view({"get": "list"})
+
+    @staticmethod
+    def ingest():
+        RandomUserApiWorker().process_response_data({"results": [
+            {"gender": "female", "name": {"first": "Leanne", "last": "Graham"},
+             "location": {"city": "Kyiv"}},
+            {"gender": "male", "name": {"first": "Ervin", "last": "Howell"},
+             "location": {"city": "Kyiv"}},
+        ]})
+
+    def get(self, request) -> tuple:
+        """Response and the SQL run on the (primary, replica) connections"""
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = self.view(request).render()
+        return response, ([query["sql"] for query in primary],
+                          [query["sql"] for query in replica])
+
+    @mock.patch("people.views.get_users_data_from_api")
+    def test_ingestion_writes_to_primary_list_reads_from_replica(
+            self, mock_ingest):
+        mock_ingest.side_effect = self.ingest
+        response, (primary, replica) = self.get(RequestFactory().get("/"))
+        self.assertEqual(json.loads(response.content), [{
+            "location": "Kyiv",
+            "gender_count": {"male": 1, "female": 1, "total": 2}
+        }])
+        self.assertTrue(any(sql.startswith("INSERT INTO \"people_person\"")
+                            for sql in primary))
+        self.assertTrue(any(sql.startswith("UPDATE") for sql in primary))
+        self.assertTrue(replica)
+        self.assertTrue(all(sql.startswith("SELECT") for sql in replica))
+        self.assertTrue(any("\"people_location\"" in sql for sql in replica))
+
+    @override_settings(READ_YOUR_WRITES_SECONDS=5)
+    @mock.patch("people.views.get_users_data_from_api")
+    def test_read_your_writes_reads_from_primary(self, mock_ingest):
+        mock_ingest.side_effect = self.ingest
+        response, (primary, replica) = self.get(RequestFactory().get("/"))
+        self.assertEqual(
+            json.loads(response.content)[0]["gender_count"]["total"], 2)
+        self.assertEqual(replica, [])
+        self.assertTrue(any(sql.startswith("SELECT") and
+                            "\"people_location\"" in sql for sql in primary))
+
+    def test_events_poller_reads_from_replica(self):
+        self.ingest()
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            token, changes = fetch_changes(None)
+            snapshot_token, snapshot = fetch_snapshot()
+        self.assertEqual(token, snapshot_token)
+        self.assertEqual([(counts["city"], counts["total"])
+                          for counts in changes.values()], [("Kyiv", 2)])
+        self.assertEqual(snapshot.keys(), changes.keys())
+        self.assertEqual(len(primary), 0)
+        self.assertTrue(replica)
+
+
+class FastJSONTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.payloads = [
+            [{"location": "Київ", "gender_count": {
+                "male": 1, "female": 2, "total": 3}},
+             {"location": None, "gender_count": {
+                 "male": 0, "female": 0, "total": 0}}],
+            [{"data": {"Male": [{"location": "Lviv", "gender_count": 4}],
+                       "Total": 4}},
+             {"data": {"Female": [], "Total": 0}}],
+            {"token": 2 ** 63 - 1, "results": []},
+            {"text": "\x00\x1f\"\\/\n\u2028\u2029 \U0001f600",
+             "day": datetime.date(2019, 8, 1),
+             "at": datetime.datetime(2019, 8, 1, tzinfo=datetime.timezone.utc)},
+            {"big": 2 ** 70, 1: "non-string key"},
+        ]
+
+    def test_render_matches_drf(self):
+        for data in self.payloads:
+            self.assertEqual(FastJSONRenderer().render(data),
+                             JSONRenderer().render(data))
+
+    def test_render_indented_falls_back(self):
+        data = self.payloads[0]
+        self.assertEqual(
+            FastJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"))
+
+    @mock.patch("people.renderers.orjson", None)
+    def test_render_without_orjson(self):
+        data = self.payloads[0]
+        self.assertEqual(FastJSONRenderer().render(data),
+                         JSONRenderer().render(data))
+
+    def test_parse_matches_drf(self):
+        for data in self.payloads[:3]:
+            body = JSONRenderer().render(data)
+            self.assertEqual(FastJSONParser().parse(io.BytesIO(body)),
+                             JSONParser().parse(io.BytesIO(body)))
+
+    def test_parse_falls_back_to_stdlib(self):
+        body = b'{"names": ["\\ud800"], "ids": [36893488147419103232]}'
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(body)),
+                         JSONParser().parse(io.BytesIO(body)))
+
+    def test_parse_error(self):
+        for body in (b"", b"{", b'{"a": NaN}'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(io.BytesIO(body))
+
+
+class CompressedCacheTestCase(TestCase):
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.view = GenderPersonCountByLocationViewSet.as_view({"get": "list"})
+        self.factory = RequestFactory()
+        self.data = [{"M": [{"city": "Kyiv {}".format(i), "region": None,
+                             "gender_count": i} for i in range(50)],
+                      "Total": 1225},
+                     {"F": [], "Total": 0}]
+
+    def get(self, accept_encoding="", **params):
+        request = self.factory.get("/", params,
+                                   HTTP_ACCEPT_ENCODING=accept_encoding)
+        response = self.view(request)
+        if hasattr(response, "render"):
+            response = response.render()
+        return response
+
+    def test_choose_encoding(self):
+        self.assertEqual(compression.choose_encoding(""), "identity")
+        self.assertEqual(compression.choose_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(compression.choose_encoding("gzip;q=0"), "identity")
+        self.assertEqual(compression.choose_encoding("*"), "gzip")
+        self.assertEqual(compression.choose_encoding("br"), "identity")
+        with mock.patch("people.compression.brotli"):
+            self.assertEqual(compression.choose_encoding("gzip, br"), "br")
+            self.assertEqual(
+                compression.choose_encoding("gzip, br;q=0.5"), "gzip")
+
+    def test_compress_skips_small_bodies(self):
+        self.assertEqual(compression.compress(b"[]"), {"identity": b"[]"})
+        variants = compression.compress(b"[1]" * 100)
+        self.assertEqual(gzip.decompress(variants["gzip"]), b"[1]" * 100)
+
+    @mock.patch("people.models.Location.current_generation")
+    @mock.patch("people.models.Location.get_location_data")
+    def test_compressed_once_per_generation(self, mock_data, mock_generation):
+        mock_data.side_effect = lambda *args: copy.deepcopy(self.data)
+        mock_generation.return_value = 5
+        plain = self.get()
+        self.assertFalse(plain.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", plain["Vary"])
+        with mock.patch("people.compression.compress_string") as mock_gzip:
+            compressed = self.get("gzip")
+        mock_gzip.assert_not_called()
+        self.assertEqual(mock_data.call_count, 1)
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(self.get().content, plain.content)
+        self.get("gzip", to="2019-01-01")
+        self.assertEqual(mock_data.call_count, 2)
+        mock_generation.return_value = 6
+        self.get("gzip")
+        self.assertEqual(mock_data.call_count, 3)
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.factory = RequestFactory()
+        enabled = override_settings(PROFILING_ENABLED=True, DEBUG=False,
+                                    PROFILING_DIR=None)
+        enabled.enable()
+        self.addCleanup(enabled.disable)
+
+    @staticmethod
+    def view(request):
+        with track_http_call("GET", "https://randomuser.me/api/") as call:
+            call["status"] = 200
+        return HttpResponse("ok")
+
+    def staff_request(self, path="/api/gender/?_profile=1", **extra):
+        request = self.factory.get(path, **extra)
+        request.user = mock.Mock(is_staff=True)
+        return request
+
+    def test_disabled_middleware_is_not_used(self):
+        with override_settings(PROFILING_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(self.view)
+
+    def test_only_staff_or_debug_can_profile(self):
+        should_profile = ProfilingMiddleware.should_profile
+        self.assertTrue(should_profile(self.staff_request()))
+        self.assertTrue(should_profile(self.staff_request(
+            "/api/gender/", HTTP_X_PROFILE="1")))
+        self.assertFalse(should_profile(self.staff_request("/api/gender/")))
+        request = self.staff_request()
+        request.user.is_staff = False
+        self.assertFalse(should_profile(request))
+        with override_settings(DEBUG=True):
+            self.assertTrue(should_profile(request))
+
+    def test_http_calls_are_not_recorded_outside_profiling(self):
+        with track_http_call("GET", "https://uinames.com/api/") as call:
+            call["status"] = 500
+        self.assertNotIn("duration_ms", call)
+
+    def test_profile_summary(self):
+        response = ProfilingMiddleware(self.view)(self.staff_request())
+        summary = json.loads(response.content.decode())
+        self.assertEqual(summary["status"], 200)
+        self.assertEqual(summary["path"], "/api/gender/?_profile=1")
+        self.assertTrue(summary["functions"])
+        self.assertEqual(summary["sql"], [])
+        self.assertEqual(len(summary["http"]), 1)
+        self.assertEqual(summary["http"][0]["status"], 200)
+        self.assertIsNone(summary["profile_file"])
+
+    def test_profile_saved(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROFILING_DIR=directory):
+                response = ProfilingMiddleware(self.view)(
+                    self.staff_request())
+            path = json.loads(response.content.decode())["profile_file"]
+            self.assertEqual(os.path.dirname(path), directory)
+            self.assertTrue(os.path.getsize(path))
+
+    def test_profiles_of_same_second_saved_apart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = os.path.join(directory, "profiles")
+            with override_settings(PROFILING_DIR=directory), \
+                    mock.patch("people.profiling.time.strftime",
+                               return_value="20200101-000000"):
+                paths = {json.loads(ProfilingMiddleware(self.view)(
+                    self.staff_request()).content.decode())["profile_file"]
+                    for _ in range(3)}
+            self.assertEqual(len(paths), 3)
+            self.assertEqual(len(os.listdir(directory)), 3)
+
+    def test_not_profiled_request_passes_through(self):
+        response = ProfilingMiddleware(self.view)(
+            self.staff_request("/api/gender/"))
+        self.assertEqual(response.content, b"ok")
+
+
+class IngestionRunTestCase(TestCase):
+
+    def setUp(self) -> None:
+        reset_upstream_guards()
+        self.addCleanup(reset_upstream_guards)
+        self.runs = []
+        patcher = mock.patch(
+            "people.ingestion.IngestionRecorder.save", autospec=True,
+            side_effect=lambda recorder: self.runs.append(recorder.run))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.users = {"results": [
+            {"gender": "male", "location": {"city": city},
+             "name": {"first": "A", "last": "B"}}
+            for city in ("Kyiv", "Lviv", "Unknown")]}
+
+    def response(self, status_code, data):
+        response = mock.Mock(status_code=status_code)
+        response.json.return_value = data
+        return response
+
+    @mock.patch("people.service.requests.get")
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    def test_successful_run(self, mock_create, mock_resolver, mock_get):
+        mock_get.return_value = self.response(200, self.users)
+        mock_resolver.return_value.resolve.return_value = {"Kyiv": 1,
+                                                           "Lviv": 2}
+        mock_create.side_effect = lambda persons, source: persons
+        service = RandomUserApiWorker(params={"results": 3})
+        service._validate_response_data = mock.MagicMock(
+            side_effect=lambda data, type_data: data)
+        service.get_data_from_api()
+        run, = self.runs
+        self.assertEqual(run.source, "RandomUser Api")
+        self.assertEqual(run.status, IngestionRun.STATUS_OK)
+        self.assertEqual((run.rows_fetched, run.rows_inserted,
+                          run.rows_skipped), (3, 2, 1))
+        self.assertEqual(run.upstream_status, 200)
+        self.assertIsNotNone(run.upstream_latency_ms)
+        for value in (run.fetch_ms, run.validate_ms, run.persist_ms):
+            self.assertGreaterEqual(value, 0)
+        self.assertGreaterEqual(run.duration_ms, run.fetch_ms)
+        self.assertIsNone(service.recorder)
+
+    @mock.patch("people.service.requests.get")
+    def test_failed_run(self, mock_get):
+        mock_get.return_value = self.response(
+            500, {"error": {"message": "Upstream is down"}})
+        service = RandomUserApiWorker(params={"results": 3})
+        with self.assertRaises(serializers.ValidationError):
+            service.get_data_from_api()
+        run, = self.runs
+        self.assertEqual(run.status, IngestionRun.STATUS_FAILED)
+        self.assertEqual(run.error, "Upstream is down")
+        self.assertEqual(run.upstream_status, 500)
+        self.assertIsNone(run.validate_ms)
+        self.assertIsNone(run.persist_ms)
+
+    @mock.patch("people.service.requests.get")
+    def test_async_run(self, mock_get):
+        mock_get.return_value = self.response(200, self.users)
+        service = RandomUserApiWorker(params={"results": 3})
+        service._validate_response_data = mock.MagicMock(
+            side_effect=KeyError("results"))
+        with self.assertRaises(KeyError):
+            asyncio.run(service.get_data_from_api_async())
+        run, = self.runs
+        self.assertEqual(run.status, IngestionRun.STATUS_FAILED)
+        self.assertEqual(run.error, "KeyError: 'results'")
+        self.assertEqual(run.upstream_status, 200)
+
+    def test_summary_rows_per_second(self):
+        row = {"day": datetime.date(2019, 8, 1), "source": "RandomUser Api",
+               "runs": 2, "failed": 1, "rows_fetched": 10,
+               "rows_inserted": 8, "rows_skipped": 2, "duration_ms": 400.0,
+               "fetch_ms": 150.0, "validate_ms": 10.0, "persist_ms": 40.0,
+               "upstream_latency_ms": 140.0}
+        data = IngestionSummarySerializer(row).data
+        self.assertEqual(data["day"], "2019-08-01")
+        self.assertEqual(data["rows_per_second"], 20.0)
+        row["duration_ms"] = 0
+        self.assertIsNone(
+            IngestionSummarySerializer(row).data["rows_per_second"])
+
+    def test_summary_filters_on_indexed_datetimes(self):
+        query = str(IngestionRun.get_summary(
+            datetime.date(2019, 8, 1), datetime.date(2019, 8, 7)).query)
+        where = query.split("WHERE", 1)[1].split("GROUP BY", 1)[0]
+        self.assertIn("\"started_at\" >= 2019-08-01 00:00:00", where)
+        self.assertIn("\"started_at\" < 2019-08-08 00:00:00", where)
+        self.assertNotIn("2019-08-07", where)
+
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    @mock.patch("people.service.get_gender_index")
+    @mock.patch("people.service.requests.get")
+    def test_per_row_upstream_calls_are_fetch_time(self, mock_get,
+                                                   mock_index, mock_create,
+                                                   mock_resolver):
+        users = [{"name": "Leanne Graham", "address": {"city": "Kyiv"}}]
+        genderize = {"name": "leanne", "gender": "female",
+                     "probability": 0.98, "count": 10}
+        mock_get.side_effect = lambda url, **kwargs: self.response(
+            200, genderize if "genderize" in url else users)
+        mock_index.return_value.lookup.return_value = None
+        mock_resolver.return_value.resolve.return_value = {"Kyiv": 1}
+        mock_create.side_effect = lambda persons, source: persons
+        upstream_calls = []
+        add_upstream_calls = IngestionRecorder.add_upstream_calls
+        with mock.patch("people.ingestion.IngestionRecorder"
+                        ".add_upstream_calls", autospec=True,
+                        side_effect=lambda recorder, calls: (
+                            upstream_calls.append(calls),
+                            add_upstream_calls(recorder, calls))):
+            JsonPlaceholderApiWorker().get_data_from_api()
+        run, = self.runs
+        self.assertEqual(run.rows_inserted, 1)
+        # The users, then their genders, both in fetch phases
+        self.assertEqual([[call["url"] for call in calls]
+                          for calls in upstream_calls],
+                         [["http://jsonplaceholder.typicode.com/users"],
+                          ["https://api.genderize.io/"]])
+        self.assertIsNotNone(run.upstream_latency_ms)
+
+    @mock.patch("people.models.IngestionRun.objects.filter")
+    def test_prune_deletes_runs_before_cutoff(self, mock_filter):
+        mock_filter.return_value.delete.return_value = (
+            3, {"people.IngestionRun": 3})
+        cutoff = datetime.datetime(2019, 8, 1, tzinfo=datetime.timezone.utc)
+        self.assertEqual(IngestionRun.prune(cutoff), 3)
+        mock_filter.assert_called_once_with(started_at__lt=cutoff)
+
+    @mock.patch("people.management.commands.prune_ingestion_runs.timezone"
+                ".now")
+    @mock.patch("people.models.IngestionRun.prune", return_value=2)
+    def test_prune_command_retention(self, mock_prune, mock_now):
+        mock_now.return_value = datetime.datetime(
+            2019, 8, 31, tzinfo=datetime.timezone.utc)
+        stdout = io.StringIO()
+        call_command("prune_ingestion_runs", retention_days=30,
+                     stdout=stdout)
+        mock_prune.assert_called_once_with(datetime.datetime(
+            2019, 8, 1, tzinfo=datetime.timezone.utc))
+        self.assertIn("Deleted 2", stdout.getvalue())
+        with override_settings(INGESTION_RUN_RETENTION_DAYS=None):
+            call_command("prune_ingestion_runs", stdout=io.StringIO())
+        self.assertEqual(mock_prune.call_count, 1)
+
+
+class AdminEstimatedCountTestCase(TestCase):
+
+    def setUp(self) -> None:
+        patcher = mock.patch("people.admin.connections")
+        self.connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.connection = self.connections.__getitem__.return_value
+        self.connection.vendor = "postgresql"
+        self.cursor = self.connection.cursor.return_value.__enter__\
+            .return_value
+
+    def test_unfiltered_estimate_sums_partitions(self):
+        self.cursor.fetchone.return_value = (12000000,)
+        self.assertEqual(estimate_count(Person.objects.all()), 12000000)
+        sql, params = self.cursor.execute.call_args[0]
+        self.assertIn("pg_inherits", sql)
+        self.assertEqual(params, ["people_person", "people_person"])
+
+    def test_filtered_estimate_explains_query(self):
+        self.cursor.fetchone.return_value = ([{"Plan": {"Plan Rows": 5000}}],)
+        self.assertEqual(estimate_count(Person.objects.filter(gender="M")),
+                         5000)
+        self.assertTrue(self.cursor.execute.call_args[0][0].startswith(
+            "EXPLAIN (FORMAT JSON) SELECT"))
+
+    def test_other_databases_are_not_estimated(self):
+        self.connection.vendor = "sqlite"
+        self.assertIsNone(estimate_count(Person.objects.all()))
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=100000)
+    def test_paginator_counts_small_results_exactly(self):
+        class Rows:
+            counted = 0
+
+            def count(self):
+                self.counted += 1
+                return 42
+
+        queryset = Rows()
+        with mock.patch("people.admin.estimate_count") as mock_estimate:
+            mock_estimate.return_value = 12000000
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count,
+                             12000000)
+            self.assertEqual(queryset.counted, 0)
+            mock_estimate.return_value = 50
+            self.assertEqual(EstimatedCountPaginator(queryset, 100).count, 42)
+
+
+@mock.patch("people.models.transaction.atomic", mock.MagicMock())
+@mock.patch("people.models.Location.touch")
+@mock.patch("people.models.PersonDailyCount.add_counts")
+@mock.patch("people.models.Person.daily_counts")
+class PersonBulkChangeTestCase(TestCase):
+
+    day = datetime.date(2019, 8, 1)
+
+    def test_update_many_moves_rollup_counts(self, mock_counts, mock_add,
+                                             mock_touch):
+        mock_counts.return_value = [(1, "M", self.day, 3),
+                                    (1, "F", self.day, 2),
+                                    (2, "M", self.day, 4)]
+        queryset = mock.Mock()
+        queryset.update.return_value = 9
+        self.assertEqual(Person.update_many(queryset, gender="F"), 9)
+        queryset.update.assert_called_once_with(gender="F")
+        mock_add.assert_called_once_with({(1, "M", self.day): -3,
+                                          (1, "F", self.day): 3,
+                                          (2, "M", self.day): -4,
+                                          (2, "F", self.day): 4})
+        self.assertEqual(set(mock_touch.call_args[0][0]), {1, 2})
+
+    def test_update_many_location(self, mock_counts, mock_add, mock_touch):
+        mock_counts.return_value = [(1, "M", self.day, 3)]
+        Person.update_many(mock.Mock(), gender="M", location_id=2)
+        mock_add.assert_called_once_with({(1, "M", self.day): -3,
+                                          (2, "M", self.day): 3})
+
+    def test_update_many_rejects_other_fields(self, mock_counts, mock_add,
+                                              mock_touch):
+        with self.assertRaises(ValueError):
+            Person.update_many(mock.Mock(), first_name="A")
+
+    def test_delete_many_subtracts_rollup_counts(self, mock_counts, mock_add,
+                                                 mock_touch):
+        mock_counts.return_value = [(1, "M", self.day, 3)]
+        queryset = mock.Mock()
+        queryset.delete.return_value = (3, {"people.Person": 3})
+        self.assertEqual(Person.delete_many(queryset), 3)
+        mock_add.assert_called_once_with({(1, "M", self.day): -3})
+        self.assertEqual(list(mock_touch.call_args[0][0]), [1])
+
+
+class LocationTotalsTestCase(TestCase):
+
+    day = datetime.date(2019, 8, 1)
+
+    def setUp(self) -> None:
+        patcher = mock.patch("people.models.connections")
+        self.cursor = patcher.start().__getitem__.return_value.cursor\
+            .return_value.__enter__.return_value
+        self.addCleanup(patcher.stop)
+
+    @mock.patch("people.models.Location.add_totals")
+    def test_add_counts_moves_totals(self, mock_add_totals):
+        PersonDailyCount.add_counts({(1, "M", self.day): -3,
+                                     (1, "F", self.day): 3,
+                                     (2, "M", self.day): 4,
+                                     (2, "M", self.day.replace(day=2)): 1})
+        mock_add_totals.assert_called_once_with({1: (3, -3), 2: (0, 5)})
+
+    def test_add_totals_one_update(self):
+        Location.add_totals({2: (0, 5), 1: (3, -3)})
+        sql, params = self.cursor.execute.call_args[0]
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        self.assertIn("FROM (VALUES (%s, %s, %s), (%s, %s, %s)) AS v", sql)
+        self.assertEqual(params, [1, 3, -3, 2, 0, 5])
+
+    def test_add_totals_nothing(self):
+        Location.add_totals({})
+        self.cursor.execute.assert_not_called()
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class UpstreamControlTestCase(TestCase):
+
+    def setUp(self) -> None:
+        reset_upstream_guards()
+        self.addCleanup(reset_upstream_guards)
+        self.clock = Clock()
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2, burst=3, clock=self.clock)
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.try_acquire(), 0.5)
+        self.assertTrue(bucket.acquire(1, sleep=self.clock.sleep))
+        self.assertEqual(self.clock.now, 100.5)
+        bucket.pause(10)
+        self.assertFalse(bucket.acquire(5, sleep=self.clock.sleep))
+        self.clock.now += 10
+        self.assertTrue(bucket.acquire(5, sleep=self.clock.sleep))
+
+    def test_aimd_limiter(self):
+        limiter = AimdLimiter(maximum=4)
+        for _ in range(4):
+            self.assertTrue(limiter.acquire(0))
+        self.assertFalse(limiter.acquire(0))
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 2)
+        self.assertFalse(limiter.acquire(0))
+        for _ in range(3):
+            limiter.release(overloaded=False)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertGreater(limiter.limit, 2)
+        for _ in range(100):
+            self.assertTrue(limiter.acquire(0))
+            limiter.release(overloaded=False)
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(5):
+            self.assertTrue(limiter.acquire(0))
+            limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 1)
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30,
+                                 clock=self.clock)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def guard(self, **config):
+        options = dict(rate=100, burst=100, max_concurrency=4,
+                       failure_threshold=2, reset_timeout=30,
+                       acquire_timeout=0)
+        options.update(config)
+        return UpstreamGuard("api.test", **options)
+
+    def test_guard_opens_on_failures(self):
+        guard = self.guard()
+        for status in (500, 429):
+            with guard.request() as outcome:
+                outcome["status"] = status
+        with self.assertRaises(UpstreamUnavailable):
+            with guard.request():
+                pass
+        metrics = guard.metrics()
+        self.assertEqual(metrics["state"], "open")
+        self.assertEqual(metrics["failed"], 2)
+        self.assertEqual(metrics["rejected_open"], 1)
+        self.assertEqual(metrics["concurrency_limit"], 1)
+
+    def test_guard_counts_exceptions_as_failures(self):
+        guard = self.guard()
+        with self.assertRaises(requests.ConnectionError):
+            with guard.request():
+                raise requests.ConnectionError()
+        self.assertEqual(guard.metrics()["failed"], 1)
+        self.assertEqual(guard.limiter.in_flight, 0)
+
+    def test_guard_honors_retry_after(self):
+        guard = self.guard()
+        with guard.request() as outcome:
+            outcome["status"] = 429
+            outcome["retry_after"] = 60
+        with self.assertRaises(UpstreamUnavailable):
+            with guard.request():
+                pass
+        self.assertEqual(guard.metrics()["rejected_rate"], 1)
+        self.assertEqual(guard.breaker.state, CircuitBreaker.CLOSED)
+
+    @mock.patch("people.service.requests.get")
+    def test_get_response_fails_fast_when_open(self, mock_get):
+        mock_get.return_value = mock.Mock(status_code=503, headers={})
+        mock_get.return_value.json.return_value = {
+            "error": {"message": "Service unavailable"}}
+        with override_settings(UPSTREAM_CONTROL={"default": dict(
+                rate=100, burst=100, max_concurrency=4, failure_threshold=3,
+                reset_timeout=30, acquire_timeout=0, timeout=10)}):
+            for _ in range(3):
+                with self.assertRaises(serializers.ValidationError):
+                    GetDataFromApi.get_response("https://api.test/", {})
+            with self.assertRaises(UpstreamUnavailable):
+                GetDataFromApi.get_response("https://api.test/", {})
+        self.assertEqual(mock_get.call_count, 3)
+        mock_get.assert_called_with("https://api.test/", params={},
+                                    timeout=10)
+        self.assertEqual(get_upstream_metrics()["api.test"]["state"], "open")
+
+    def test_sick_upstream_does_not_stop_healthy_workers(self):
+        sick = mock.Mock(spec=GetDataFromApi, api_name="Sick Api")
+        healthy = mock.Mock(spec=GetDataFromApi, api_name="Healthy Api")
+        for error in (UpstreamUnavailable(), serializers.ValidationError(),
+                      requests.ConnectionError()):
+            sick.get_data_from_api.side_effect = error
+            with self.assertLogs("people.service", "WARNING"):
+                ApiWorker([sick, healthy]).get_data()
+        self.assertEqual(healthy.get_data_from_api.call_count, 3)
+        with self.assertRaises(requests.ConnectionError), \
+                self.assertLogs("people.service", "WARNING"):
+            ApiWorker([sick, sick]).get_data()
+        sick.get_data_from_api.side_effect = KeyError()
+        with self.assertRaises(KeyError):
+            ApiWorker([sick, healthy]).get_data()
+
+    def test_sick_upstream_does_not_stop_healthy_workers_async(self):
+        sick = mock.Mock(spec=GetDataFromApi, api_name="Sick Api")
+        sick.get_data_from_api_async.side_effect = \
+            serializers.ValidationError("Too many requests")
+        healthy = mock.Mock(spec=GetDataFromApi, api_name="Healthy Api")
+        with self.assertLogs("people.service", "WARNING"):
+            asyncio.run(ApiWorker([sick, healthy]).get_data_async())
+        healthy.get_data_from_api_async.assert_called_once_with()
+        with self.assertRaises(serializers.ValidationError), \
+                self.assertLogs("people.service", "WARNING"):
+            asyncio.run(ApiWorker([sick]).get_data_async())
+
+    def test_get_response_error_bodies(self):
+        responses = [
+            (429, {"error": "Request limit reached"}, "Request limit reached"),
+            (401, {"error": {"message": "Invalid key"}}, "Invalid key"),
+            (500, ["unexpected"], 'Upstream answered 500: ["unexpected"]'),
+            (502, "<html>502 Bad Gateway</html>",
+             "Upstream answered 502: <html>502 Bad Gateway</html>"),
+        ]
+        for status, data, message in responses:
+            with mock.patch("people.service.get_upstream_transport") \
+                    as mock_transport:
+                mock_transport.return_value.get.return_value = status, data
+                with self.assertRaises(serializers.ValidationError) as error:
+                    GetDataFromApi.get_response("https://api.test/", {})
+            self.assertEqual(error.exception.detail, [message])
+
+    @mock.patch("people.service.requests.get")
+    def test_fetch_non_json_body(self, mock_get):
+        mock_get.return_value = mock.Mock(
+            status_code=502, headers={}, text="<html>Bad Gateway</html>")
+        mock_get.return_value.json.side_effect = json.JSONDecodeError(
+            "Expecting value", "<html>", 0)
+        self.assertEqual(GetDataFromApi.fetch("https://api.test/", {}),
+                         (502, "<html>Bad Gateway</html>"))
+        mock_get.return_value.status_code = 200
+        with self.assertRaises(serializers.ValidationError):
+            GetDataFromApi.fetch("https://api.test/", {})
+
+    def test_rate_limited_upstream_keeps_other_rows(self):
+        response = mock.Mock(status_code=429, headers={"Retry-After": "30"})
+        response.json.return_value = {
+            "error": {"message": "Too many requests"}}
+        self.assert_failed_upstream_keeps_other_rows(
+            response, 429, "Too many requests")
+
+    def test_rate_limit_error_string_keeps_other_rows(self):
+        response = mock.Mock(status_code=429, headers={})
+        response.json.return_value = {"error": "Request limit reached"}
+        self.assert_failed_upstream_keeps_other_rows(
+            response, 429, "Request limit reached")
+
+    def test_bad_gateway_page_keeps_other_rows(self):
+        response = mock.Mock(status_code=502, headers={},
+                             text="<html><h1>502 Bad Gateway</h1></html>")
+        response.json.side_effect = ValueError("No JSON object")
+        self.assert_failed_upstream_keeps_other_rows(
+            response, 502, "502 Bad Gateway")
+
+    @mock.patch("people.service.get_location_resolver")
+    @mock.patch("people.models.Person.create_many")
+    @mock.patch("people.service.requests.get")
+    def assert_failed_upstream_keeps_other_rows(self, failed, status, message,
+                                                mock_get, mock_create,
+                                                mock_resolver):
+        def get(url, params, timeout):
+            if "uinames" in url:
+                return failed
+            response = mock.Mock(status_code=200, headers={})
+            response.json.return_value = {"results": [{
+                "gender": "female", "name": {"first": "Olena", "last": "Ko"},
+                "location": {"city": "Kyiv"}}]}
+            return response
+
+        mock_get.side_effect = get
+        mock_create.side_effect = lambda persons, source: persons
+        mock_resolver.return_value.resolve.return_value = {"Kyiv": 1}
+        runs = []
+        with mock.patch("people.ingestion.IngestionRecorder.save",
+                        autospec=True,
+                        side_effect=lambda recorder: runs.append(
+                            recorder.run)), \
+                mock.patch.object(RandomUserApiWorker,
+                                  "_validate_response_data",
+                                  side_effect=lambda data, type_data: data), \
+                self.assertLogs("people.service", "WARNING") as logs:
+            ApiWorker([UINamesApiWorker(params={"amount": 10}),
+                       RandomUserApiWorker(params={"results": 1})]).get_data()
+        persons = mock_create.call_args[0][0]
+        self.assertEqual([(p.first_name, p.location_id) for p in persons],
+                         [("Olena", 1)])
+        self.assertIn(message, logs.output[0])
+        self.assertEqual([(run.source, run.status, run.upstream_status)
+                          for run in runs],
+                         [("UINames Api", "failed", status),
+                          ("RandomUser Api", "ok", 200)])
+        metrics = get_upstream_metrics()
+        self.assertEqual(metrics["uinames.com"]["failed"], 1)
+        self.assertEqual(metrics["randomuser.me"]["succeeded"], 1)
+
+    def test_metrics_view(self):
+        with mock.patch("people.views.get_upstream_metrics") as mock_metrics:
+            mock_metrics.return_value = {"api.test": {"state": "closed"}}
+            response = UpstreamMetricsViewSet.as_view({"get": "list"})(
+                RequestFactory().get("/"))
+        self.assertEqual(response.data, {"api.test": {"state": "closed"}})
+
+
+class UpstreamTransportTestCase(TestCase):
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        reset_upstream_transport()
+        self.addCleanup(reset_upstream_transport)
+
+    def transport(self, mode: str) -> UpstreamTransport:
+        transport = UpstreamTransport(mode, ResponseStore(self.path))
+        self.addCleanup(transport.store.close)
+        return transport
+
+    def test_request_key(self):
+        self.assertEqual(request_key("https://api.test/", {"b": 2, "a": 1}),
+                         request_key("https://api.test/", {"a": "1", "b": "2"}))
+        self.assertNotEqual(request_key("https://api.test/", {"a": 1}),
+                            request_key("https://api.test/", {"a": 2}))
+        self.assertEqual(request_key("https://api.test/", None),
+                         request_key("https://api.test/", {}))
+
+    def test_record_then_replay_round_robin(self):
+        fetch = mock.Mock(side_effect=[(200, {"results": ["Ірина"]}),
+                                       (200, {"results": [2]}),
+                                       (500, {"error": {"message": "down"}})])
+        record = self.transport(RECORD)
+        for _ in range(3):
+            record.get("https://api.test/", {"results": 5}, fetch)
+        self.assertEqual(fetch.call_count, 3)
+        self.assertEqual(len(record.store), 3)
+
+        replay = self.transport(REPLAY)
+        fetch.reset_mock()
+        self.assertEqual(
+            [replay.get("https://api.test/", {"results": 5}, fetch)
+             for _ in range(4)],
+            [(200, {"results": ["Ірина"]}), (200, {"results": [2]}),
+             (500, {"error": {"message": "down"}}),
+             (200, {"results": ["Ірина"]})])
+        fetch.assert_not_called()
+        with self.assertRaises(serializers.ValidationError):
+            replay.get("https://api.test/", {"results": 6}, fetch)
+
+    def test_cache_records_missing_successful_responses(self):
+        fetch = mock.Mock(side_effect=[(503, {"error": {"message": "down"}}),
+                                       (200, {"name": "anna"})])
+        cache = self.transport(CACHE)
+        self.assertEqual(cache.get("https://api.test/", {}, fetch)[0], 503)
+        self.assertEqual(len(cache.store), 0)
+        for _ in range(3):
+            self.assertEqual(cache.get("https://api.test/", {}, fetch),
+                             (200, {"name": "anna"}))
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(len(cache.store), 1)
+
+    def test_live_does_not_touch_the_store(self):
+        transport = UpstreamTransport(LIVE)
+        fetch = mock.Mock(return_value=(200, {}))
+        self.assertEqual(transport.get("https://api.test/", {}, fetch),
+                         (200, {}))
+        self.assertEqual(os.listdir(self.path), [])
+        with self.assertRaises(ValueError):
+            UpstreamTransport("offline")
+
+    @mock.patch("people.service.requests.get")
+    def test_get_response_replays_without_network(self, mock_get):
+        mock_get.return_value = mock.Mock(status_code=200, headers={})
+        mock_get.return_value.json.return_value = {"results": [1]}
+        with override_settings(UPSTREAM_TRANSPORT=RECORD,
+                               UPSTREAM_STORE_DIR=self.path):
+            self.assertEqual(GetDataFromApi.get_response(
+                "https://api.test/", {"results": 1}), {"results": [1]})
+        reset_upstream_transport()
+        with override_settings(UPSTREAM_TRANSPORT=REPLAY,
+                               UPSTREAM_STORE_DIR=self.path):
+            self.assertEqual(GetDataFromApi.get_response(
+                "https://api.test/", {"results": 1}), {"results": [1]})
+        mock_get.assert_called_once()
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ["responses.dat", "responses.idx"])
+
+
+class WorkerRegistryTestCase(TestCase):
+
+    def setUp(self) -> None:
+        reset_worker_registry()
+        self.addCleanup(reset_worker_registry)
+
+    def test_workers_are_built_from_settings(self):
+        workers = get_api_workers()
+        self.assertEqual([type(worker) for worker in workers],
+                         [RandomUserApiWorker, UINamesApiWorker,
+                          JsonPlaceholderApiWorker])
+        self.assertEqual(workers[0].params, {"results": 5})
+        workers[0].params["results"] = 50
+        self.assertEqual(get_api_workers()[0].params, {"results": 5})
+
+    def test_interval_schedules_workers(self):
+        clock = Clock()
+        registry = WorkerRegistry([
+            {"class": "people.service.RandomUserApiWorker",
+             "params": {"results": 1}, "interval": 60},
+            {"class": "people.service.UINamesApiWorker"},
+        ], clock=clock)
+        self.assertEqual(len(registry.get_workers()), 2)
+        self.assertEqual([type(worker) for worker in registry.get_workers()],
+                         [UINamesApiWorker])
+        clock.now += 60
+        self.assertEqual(len(registry.get_workers()), 2)
+
+    def test_invalid_config(self):
+        with self.assertRaises(ImproperlyConfigured):
+            WorkerRegistry([{"params": {}}])
+        with self.assertRaises(ImproperlyConfigured):
+            WorkerRegistry([{"class": "people.service.UINamesApiWorker",
+                             "batch": 10}])
+        registry = WorkerRegistry([{"class": "people.service.Missing"}])
+        with self.assertRaises(ImportError):
+            registry.get_workers()
+
+    @override_settings(INGESTION_WORKERS=[])
+    def test_no_workers(self):
+        with mock.patch("people.service.requests.get") as mock_get:
+            get_users_data_from_api()
+        mock_get.assert_not_called()
+
+    @staticmethod
+    def startup(*imports) -> dict:
+        """Import the WSGI application and the URLconf in a fresh
+        interpreter, return its loaded modules and resident pages"""
+        code = "\n".join([
+            "import json, sys",
+            "import test_people_segmentation.wsgi",
+            "import test_people_segmentation.urls",
+        ] + ["import {}".format(name) for name in imports] + [
+            # ru_maxrss would include the peak of this (forked) process
+            "rss = open('/proc/self/statm').read().split()[1]",
+            "print(json.dumps({'modules': sorted(sys.modules), "
+            "'rss': int(rss)}))",
+        ])
+        env = dict(os.environ,
+                   DJANGO_SETTINGS_MODULE="test_people_segmentation.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=settings.BASE_DIR, env=env,
+            check=True, stdout=subprocess.PIPE).stdout
+        return json.loads(output.decode())
+
+    @skipUnless(os.path.exists("/proc/self/statm"), "needs procfs")
+    def test_startup_does_not_import_ingestion(self):
+        lazy = self.startup()
+        for name in ("people.service", "people.transport",
+                     "people.ingestion", "jsonschema"):
+            self.assertNotIn(name, lazy["modules"])
+        eager = self.startup("people.service")
+        self.assertIn("jsonschema", eager["modules"])
+        self.assertLess(lazy["rss"], eager["rss"])
+
+
 class LocationTestCase(TestCase):
 
     def setUp(self) -> None:
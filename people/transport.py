@@ -0,0 +1,181 @@
+"""Record/replay store of upstream API responses
+
+UPSTREAM_TRANSPORT selects how GetDataFromApi.get_response reaches the
+upstream APIs:
+
+- "live" always calls them;
+- "record" calls them and appends every response to the store;
+- "replay" serves recorded responses only, without network access;
+- "cache" serves recorded responses and records the missing ones, a local
+  HTTP cache for development and staging.
+
+The store in UPSTREAM_STORE_DIR is an append-only data file of zlib
+compressed JSON bodies plus a text index of "key status offset length"
+lines, the key being a hash of the URL and the sorted params. Replay maps
+the data file into memory. A request recorded several times is replayed
+round robin, in recording order, so a store of many recorded runs can be
+pushed through the ingestion pipeline as a benchmark input. Only one
+process should record into a store at a time.
+"""
+import hashlib
+import json
+import mmap
+import os
+import threading
+import zlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from rest_framework import serializers
+
+
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+CACHE = "cache"
+MODES = (LIVE, RECORD, REPLAY, CACHE)
+
+DATA_FILE = "responses.dat"
+INDEX_FILE = "responses.idx"
+
+
+def request_key(url: str, params) -> str:
+    if isinstance(params, dict):
+        query = urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+    else:
+        query = str(params or "")
+    return hashlib.sha1("{}?{}".format(url, query).encode()).hexdigest()
+
+
+class ResponseStore:
+    """Append-only, memory-mapped store of compressed responses"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_path = os.path.join(path, DATA_FILE)
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self._entries = dict()
+        self._next = dict()
+        self._mm = None
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self) -> None:
+        try:
+            with open(self.index_path) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 4:
+                        key, status, offset, length = parts
+                        self._entries.setdefault(key, []).append(
+                            (int(status), int(offset), int(length)))
+        except FileNotFoundError:
+            pass
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> list:
+        return list(self._entries)
+
+    def count(self, key: str) -> int:
+        """Number of responses recorded for a request"""
+        return len(self._entries.get(key, ()))
+
+    def _map(self, end: int) -> mmap.mmap:
+        """Map the data file, again if it grew past the current mapping"""
+        if self._mm is None or len(self._mm) < end:
+            if self._mm is not None:
+                self._mm.close()
+            with open(self.data_path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mm
+
+    def lookup(self, key: str) -> tuple or None:
+        """Next recorded (status, body) of a request, None if unknown"""
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            position = self._next.get(key, 0)
+            self._next[key] = (position + 1) % len(entries)
+            status, offset, length = entries[position]
+            mm = self._map(offset + length)
+            compressed = mm[offset:offset + length]
+        return status, zlib.decompress(compressed)
+
+    def append(self, key: str, status: int, body: bytes) -> None:
+        compressed = zlib.compress(body)
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.data_path, "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(compressed)
+            with open(self.index_path, "a") as f:
+                f.write("{}\t{}\t{}\t{}\n".format(
+                    key, status, offset, len(compressed)))
+            self._entries.setdefault(key, []).append(
+                (status, offset, len(compressed)))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._mm is not None:
+                self._mm.close()
+                self._mm = None
+
+
+class UpstreamTransport:
+    """Route upstream requests to the network and/or the response store"""
+
+    def __init__(self, mode: str, store: ResponseStore = None):
+        if mode not in MODES:
+            raise ValueError("Unknown upstream transport: {}".format(mode))
+        self.mode = mode
+        self.store = store
+
+    def get(self, url: str, params, fetch) -> tuple:
+        """Return (status, data) of a GET request, fetch(url, params)
+        sends it to the upstream API"""
+        if self.mode == LIVE:
+            return fetch(url, params)
+        key = request_key(url, params)
+        if self.mode in (REPLAY, CACHE):
+            found = self.store.lookup(key)
+            if found is not None:
+                return found[0], json.loads(found[1].decode())
+            if self.mode == REPLAY:
+                raise serializers.ValidationError(
+                    "No recorded response for {}".format(url))
+        status, data = fetch(url, params)
+        # The cache keeps successful responses only
+        if self.mode == RECORD or status == 200:
+            self.store.append(key, status, json.dumps(
+                data, separators=(",", ":"), ensure_ascii=False).encode())
+        return status, data
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_upstream_transport() -> UpstreamTransport:
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                mode = settings.UPSTREAM_TRANSPORT
+                store = None if mode == LIVE \
+                    else ResponseStore(settings.UPSTREAM_STORE_DIR)
+                _transport = UpstreamTransport(mode, store)
+    return _transport
+
+
+def reset_upstream_transport() -> None:
+    global _transport
+    with _transport_lock:
+        if _transport is not None and _transport.store is not None:
+            _transport.store.close()
+        _transport = None
@@ -0,0 +1,266 @@
+"""Per-upstream request control of the API workers
+
+Every upstream host gets an UpstreamGuard made of a token bucket limiting
+the request rate, an AIMD limiter adapting the number of concurrent
+requests (additive increase while the host answers well, multiplicative
+decrease on 429, 5xx, errors or slow answers) and a circuit breaker that
+fails fast while the host is unhealthy. Guards live per process and their
+state is exposed by get_upstream_metrics().
+"""
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.exceptions import APIException
+
+
+class UpstreamUnavailable(APIException):
+    status_code = 503
+    default_detail = "Upstream API is temporarily unavailable."
+    default_code = "upstream_unavailable"
+
+
+# Failures of a single upstream, the other workers still run
+UPSTREAM_ERRORS = (serializers.ValidationError, requests.RequestException,
+                   UpstreamUnavailable)
+
+
+class TokenBucket:
+    """Allow rate requests per second with bursts of up to burst"""
+
+    def __init__(self, rate: float, burst: int, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token, return 0, or the seconds until one is available"""
+        with self._lock:
+            now = self.clock()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, timeout: float, sleep=time.sleep) -> bool:
+        deadline = self.clock() + timeout
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+            if self.clock() + wait > deadline:
+                return False
+            sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for a while, as asked by Retry-After"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+            self.tokens = 0.0
+
+
+class AimdLimiter:
+    """Concurrency limit with additive increase, multiplicative decrease"""
+
+    def __init__(self, maximum: int, minimum: int = 1,
+                 decrease: float = 0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease = decrease
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, overloaded: bool) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                # About +1 once a whole window of requests went well
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """Open after failure_threshold failures in a row, let a single trial
+    request through after reset_timeout and close again when it succeeds"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float,
+                 clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN \
+                    and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def cancel_trial(self) -> None:
+        """The trial request allowed in half-open state was not sent"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN \
+                    or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+
+
+class UpstreamGuard:
+    """Rate limit, concurrency limit and circuit breaker of one upstream"""
+
+    def __init__(self, name: str, rate: float, burst: int,
+                 max_concurrency: int, failure_threshold: int,
+                 reset_timeout: float, acquire_timeout: float,
+                 latency_threshold: float = None, timeout: float = None):
+        self.name = name
+        self.acquire_timeout = acquire_timeout
+        self.latency_threshold = latency_threshold
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AimdLimiter(max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.counters = {"requests": 0, "succeeded": 0, "failed": 0,
+                         "rejected_open": 0, "rejected_rate": 0,
+                         "rejected_concurrency": 0}
+        self._lock = threading.Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def reject(self, reason: str):
+        self.count("rejected_{}".format(reason))
+        return UpstreamUnavailable(
+            "{} is unavailable ({})".format(self.name, {
+                "open": "circuit open",
+                "rate": "rate limited",
+                "concurrency": "too many requests in flight",
+            }[reason]))
+
+    @staticmethod
+    def is_failure(status: int or None) -> bool:
+        return status is None or status == 429 or status >= 500
+
+    @contextmanager
+    def request(self):
+        """Guard one request, the caller sets "status" and optionally
+        "retry_after" (seconds) of the yielded dict"""
+        if not self.breaker.allow():
+            raise self.reject("open")
+        if not self.bucket.acquire(self.acquire_timeout):
+            self.breaker.cancel_trial()
+            raise self.reject("rate")
+        if not self.limiter.acquire(self.acquire_timeout):
+            self.breaker.cancel_trial()
+            raise self.reject("concurrency")
+        self.count("requests")
+        outcome = {"status": None, "retry_after": None}
+        started = time.monotonic()
+        failed = True
+        try:
+            yield outcome
+            failed = self.is_failure(outcome["status"])
+        finally:
+            slow = self.latency_threshold is not None \
+                and time.monotonic() - started > self.latency_threshold
+            self.limiter.release(overloaded=failed or slow)
+            if outcome["retry_after"]:
+                self.bucket.pause(outcome["retry_after"])
+            if failed:
+                self.count("failed")
+                self.breaker.record_failure()
+            else:
+                self.count("succeeded")
+                self.breaker.record_success()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            metrics = dict(self.counters)
+        metrics.update({
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "tokens": round(self.bucket.tokens, 2),
+        })
+        return metrics
+
+
+_guards = dict()
+_guards_lock = threading.Lock()
+
+
+def upstream_name(url: str) -> str:
+    return urlsplit(url).netloc or url
+
+
+def get_upstream_guard(url: str) -> UpstreamGuard:
+    """Process-wide guard of the upstream host of url"""
+    name = upstream_name(url)
+    guard = _guards.get(name)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.get(name)
+            if guard is None:
+                config = dict(settings.UPSTREAM_CONTROL["default"])
+                config.update(settings.UPSTREAM_CONTROL.get(name, {}))
+                guard = _guards[name] = UpstreamGuard(name, **config)
+    return guard
+
+
+def get_upstream_metrics() -> dict:
+    return {name: guard.metrics() for name, guard in sorted(_guards.items())}
+
+
+def reset_upstream_guards() -> None:
+    with _guards_lock:
+        _guards.clear()
@@ -1,10 +1,25 @@
 from django.urls import path
-from people.views import LocationPersonCountByGenderViewSet, GenderPersonCountByLocationViewSet
+from people.views import (
+    LocationPersonCountByGenderViewSet, GenderPersonCountByLocationViewSet,
+    IngestionSummaryViewSet, UpstreamMetricsViewSet
+)
 
 urlpatterns = [
     path('location/', LocationPersonCountByGenderViewSet.as_view({'get': 'list'}),
          name='location'),
+    path('location/changes/',
+         LocationPersonCountByGenderViewSet.as_view({'get': 'changes'}),
+         name='location-changes'),
+    path('location/lookup/',
+         LocationPersonCountByGenderViewSet.as_view({'post': 'lookup'}),
+         name='location-lookup'),
     path('gender/',
          GenderPersonCountByLocationViewSet.as_view({'get': 'list'}),
-         name='gender')
+         name='gender'),
+    path('ingestion/',
+         IngestionSummaryViewSet.as_view({'get': 'list'}),
+         name='ingestion'),
+    path('upstreams/',
+         UpstreamMetricsViewSet.as_view({'get': 'list'}),
+         name='upstreams')
 ]
\ No newline at end of file
@@ -1,30 +1,260 @@
-from django.db.models import Count, Q
-from rest_framework.viewsets import GenericViewSet
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet, ViewSet
 from rest_framework.mixins import ListModelMixin
-from people.serializers import LocationGenderSerializer, GenderLocationSerializer
-from people.models import Location
-from people.service import get_users_data_from_api
+from people.serializers import (
+    LocationGenderSerializer, GenderLocationSerializer,
+    LocationLookupSerializer, LocationLookupResultSerializer,
+    IngestionSummarySerializer
+)
+from people.models import IngestionRun, Location, Person
+from people.compression import cache_response, get_cached_response
+from people.routers import pin_primary, primary_reads, replica_reads
+from people.upstreams import get_upstream_metrics
+from people.workers import get_users_data_from_api
 
+# WSGI environ key carrying the result of an ingestion run done before the
+# request reached the view
+INGESTION_ENVIRON_KEY = "people.ingestion"
 
-class LocationPersonCountByGenderViewSet(ListModelMixin, GenericViewSet):
+
+class DateRangeMixin:
+    """Read the optional ?from=&to= (YYYY-MM-DD, inclusive) filters"""
+
+    def get_date_range(self) -> tuple:
+        dates = []
+        for param in ("from", "to"):
+            value = self.request.query_params.get(param)
+            if not value:
+                dates.append(None)
+                continue
+            try:
+                date = parse_date(value)
+            except ValueError:
+                date = None
+            if date is None:
+                raise serializers.ValidationError(
+                    {param: "Wrong date format, use YYYY-MM-DD"}
+                )
+            dates.append(date)
+        if dates[0] and dates[1] and dates[0] > dates[1]:
+            raise serializers.ValidationError(
+                {"from": "Start date must not be after end date"}
+            )
+        return tuple(dates)
+
+
+class ReplicaReadMixin:
+    """Run the read-only queries of the view on the read replica
+
+    A client that triggered ingestion gets a cookie and reads from the
+    primary for settings.READ_YOUR_WRITES_SECONDS, so it does not miss its
+    own writes while the replica lags behind.
+    """
+
+    PRIMARY_COOKIE = "people_read_primary"
+
+    ingested = False
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads():
+            if request.COOKIES.get(self.PRIMARY_COOKIE):
+                pin_primary()
+            return super().dispatch(request, *args, **kwargs)
+
+    def ingested_writes(self) -> None:
+        """Read the rest of this request and the window from the primary"""
+        if settings.READ_YOUR_WRITES_SECONDS:
+            self.ingested = True
+            pin_primary()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.ingested:
+            response.set_cookie(self.PRIMARY_COOKIE, "1",
+                                max_age=settings.READ_YOUR_WRITES_SECONDS,
+                                httponly=True)
+        return response
+
+
+class CompressedCacheMixin:
+    """Serve responses from the cache of precompressed bodies, valid until
+    the location change generation moves (see people.compression)"""
+
+    def cached_response(self, request, get_response):
+        if "indent" in request.META.get("HTTP_ACCEPT", ""):
+            return get_response()
+        generation = Location.current_generation()
+        response = get_cached_response(request, generation)
+        if response is None:
+            response = get_response()
+            response.add_post_render_callback(
+                lambda rendered: cache_response(request, generation, rendered))
+        return response
+
+
+class LocationPersonCountByGenderViewSet(ReplicaReadMixin,
+                                         CompressedCacheMixin, DateRangeMixin,
+                                         ListModelMixin, GenericViewSet):
     serializer_class = LocationGenderSerializer
     queryset = Location.objects.all()
 
+    ORDERING_FIELDS = ("female", "male", "total")
+
+    def get_aggregate_params(self) -> dict:
+        """Read ?ordering=&limit=&gender=&min_total= query parameters"""
+        query_params = self.request.query_params
+        params = dict()
+        ordering = query_params.get("ordering")
+        if ordering:
+            if ordering.lstrip("-") not in self.ORDERING_FIELDS:
+                raise serializers.ValidationError({
+                    "ordering": "Must be one of {}, prefixed with '-' for "
+                                "descending order".format(
+                                    ", ".join(self.ORDERING_FIELDS))
+                })
+            params["ordering"] = ordering
+        gender = query_params.get("gender")
+        if gender:
+            if gender not in (Person.GENDER_MALE, Person.GENDER_FEMALE):
+                raise serializers.ValidationError(
+                    {"gender": "Must be M or F"}
+                )
+            params["gender"] = gender
+        for param, minimum, message in (
+                ("limit", 1, "Must be a positive number"),
+                ("min_total", 0, "Must be zero or a positive number")):
+            value = query_params.get(param)
+            if not value:
+                continue
+            try:
+                params[param] = int(value)
+            except ValueError:
+                params[param] = minimum - 1
+            if params[param] < minimum:
+                raise serializers.ValidationError({param: message})
+        return params
+
+    def get_person_counts(self):
+        return Location.get_person_counts()
+
     def get_queryset(self):
-        queryset = self.queryset.annotate(
-            female=Count("person__gender", filter=Q(person__gender='F')),
-            male=Count("person__gender", filter=Q(person__gender='M')),
-            total=Count("person")).values("id", "city", "region", "female",
-                                          "male", "total")
+        date_from, date_to = self.get_date_range()
+        params = self.get_aggregate_params()
+        if not (date_from or date_to or params):
+            return self.get_person_counts()
+        if date_from or date_to:
+            queryset = Location.get_counts(date_from, date_to)
+        else:
+            # Top-N over all time reads the indexed running totals instead
+            # of aggregating every rollup row
+            queryset = Location.get_totals()
+        if "gender" in params:
+            field = "female" if params["gender"] == Person.GENDER_FEMALE \
+                else "male"
+            queryset = queryset.filter(**{"{}__gt".format(field): 0})
+        if "min_total" in params:
+            queryset = queryset.filter(total__gte=params["min_total"])
+        if "ordering" in params:
+            # Ties in the same direction, so one (count, id) index serves
+            # both directions
+            ordering = params["ordering"]
+            queryset = queryset.order_by(
+                ordering, "-id" if ordering.startswith("-") else "id")
+        if "limit" in params:
+            queryset = queryset[:params["limit"]]
         return queryset
 
+    def ingest(self) -> None:
+        """Fetch new people before listing when INGEST_ON_REQUEST is set,
+        unless the ASGI deployment has already done it asynchronously (see
+        people.async_views)"""
+        if not settings.INGEST_ON_REQUEST:
+            return
+        ingested = self.request.META.get(INGESTION_ENVIRON_KEY)
+        if ingested is None:
+            with primary_reads():
+                get_users_data_from_api()
+        elif isinstance(ingested, Exception):
+            raise ingested
+        self.ingested_writes()
+
     def list(self, request, *args, **kwargs):
-        get_users_data_from_api()
-        return super(LocationPersonCountByGenderViewSet, self).list(request, *args, **kwargs)
+        self.ingest()
+        return self.cached_response(request, lambda: super(
+            LocationPersonCountByGenderViewSet, self).list(request, *args, **kwargs))
+
+    def changes(self, request, *args, **kwargs):
+        """Locations whose counts changed after the ?since= token, all
+        locations when no token is given"""
+        since = request.query_params.get("since")
+        try:
+            since = int(since) if since else None
+        except ValueError:
+            raise serializers.ValidationError(
+                {"since": "Must be a token returned by this endpoint"}
+            )
+        return self.cached_response(request, lambda: self.get_changes(since))
 
+    def get_changes(self, since: int or None) -> Response:
+        # Read the token first: a change committed meanwhile is then sent
+        # again on the next poll instead of being skipped.
+        token = Location.current_generation()
+        queryset = self.get_person_counts()
+        if since is not None:
+            queryset = queryset.filter(generation__gt=since)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response({"token": token, "results": serializer.data})
 
-class GenderPersonCountByLocationViewSet(ListModelMixin, GenericViewSet):
+    def lookup(self, request, *args, **kwargs):
+        """Counts of the requested locations, keyed by location id: a city
+        and a region may share a name"""
+        serializer = LocationLookupSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        names = serializer.validated_data.get("names", [])
+        ids = serializer.validated_data.get("ids", [])
+        date_from, date_to = self.get_date_range()
+        if date_from or date_to:
+            queryset = Location.get_counts(date_from, date_to)
+        else:
+            queryset = self.get_person_counts()
+        queryset = queryset.filter(
+            Q(city__in=names) | Q(region__in=names) | Q(id__in=ids))
+        data = {
+            str(obj["id"]): LocationLookupResultSerializer(obj).data
+            for obj in queryset
+        }
+        return Response(data)
+
+
+class GenderPersonCountByLocationViewSet(ReplicaReadMixin,
+                                         CompressedCacheMixin, DateRangeMixin,
+                                         ListModelMixin, GenericViewSet):
     serializer_class = GenderLocationSerializer
 
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(
+            GenderPersonCountByLocationViewSet, self).list(request, *args, **kwargs))
+
     def get_queryset(self):
-        return Location.get_location_data()
+        return Location.get_location_data(*self.get_date_range())
+
+
+class IngestionSummaryViewSet(ReplicaReadMixin, DateRangeMixin,
+                              ListModelMixin, GenericViewSet):
+    """Ingestion runs per source and day, newest first"""
+    serializer_class = IngestionSummarySerializer
+
+    def get_queryset(self):
+        return IngestionRun.get_summary(*self.get_date_range())
+
+
+class UpstreamMetricsViewSet(ViewSet):
+    """Rate limiter, concurrency limit and circuit breaker state of every
+    upstream API used by this process"""
+
+    def list(self, request, *args, **kwargs):
+        return Response(get_upstream_metrics())
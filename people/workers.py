@@ -0,0 +1,97 @@
+"""Registry of the API workers run by an ingestion
+
+INGESTION_WORKERS declares the worker classes by dotted path together with
+their request params (the batch sizes) and an optional schedule, the
+minimum number of seconds between two runs of the worker in a process.
+The classes, and with them people.service, requests and jsonschema, are
+only imported when an ingestion runs, so processes that only serve reads
+start faster and use less memory.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+class WorkerSpec:
+    """One configured worker, its class is imported on first use"""
+
+    KEYS = {"class", "params", "interval"}
+
+    def __init__(self, config: dict):
+        unknown = set(config) - self.KEYS
+        if "class" not in config or unknown:
+            raise ImproperlyConfigured(
+                "INGESTION_WORKERS entries take a 'class' and optionally "
+                "'params' and 'interval', got: {}".format(sorted(config)))
+        self.path = config["class"]
+        self.params = config.get("params")
+        self.interval = config.get("interval") or 0
+        self.last_run = None
+        self._worker_class = None
+
+    @property
+    def worker_class(self):
+        if self._worker_class is None:
+            self._worker_class = import_string(self.path)
+        return self._worker_class
+
+    def is_due(self, now: float) -> bool:
+        return self.last_run is None or now - self.last_run >= self.interval
+
+    def create(self):
+        params = dict(self.params) if self.params is not None else None
+        return self.worker_class(params=params)
+
+
+class WorkerRegistry:
+    """Hand out fresh instances of the workers due to run"""
+
+    def __init__(self, config: list, clock=time.monotonic):
+        self.specs = [WorkerSpec(entry) for entry in config]
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    def due(self) -> list:
+        """Specs whose interval has elapsed, noted as run now"""
+        with self._lock:
+            now = self.clock()
+            specs = [spec for spec in self.specs if spec.is_due(now)]
+            for spec in specs:
+                spec.last_run = now
+        return specs
+
+    def get_workers(self) -> list:
+        return [spec.create() for spec in self.due()]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_worker_registry() -> WorkerRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = WorkerRegistry(settings.INGESTION_WORKERS)
+    return _registry
+
+
+def reset_worker_registry() -> None:
+    global _registry
+    with _registry_lock:
+        _registry = None
+
+
+def get_users_data_from_api() -> None:
+    """Run the due workers, importing people.service on first use"""
+    from people import service
+    service.get_users_data_from_api()
+
+
+async def get_users_data_from_api_async() -> None:
+    from people import service
+    await service.get_users_data_from_api_async()
@@ -0,0 +1,49 @@
+"""
+ASGI config for test_people_segmentation project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+The location changes are streamed as Server-Sent Events without holding a
+thread. Requests are served by the regular Django handler on a thread pool,
+and with INGEST_ON_REQUEST the upstream requests of an ingestion run
+concurrently on a separate pool of ASGI_UPSTREAM_THREADS threads (requests
+is a blocking client):
+
+    uvicorn test_people_segmentation.asgi:application
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_people_segmentation.settings')
+
+django.setup()
+
+from people.async_views import dispatch, gender_list, location_list  # noqa: E402
+from people.events import get_broadcaster, location_stream  # noqa: E402
+
+ROUTES = {
+    '/api/location/': location_list,
+    '/api/gender/': gender_list,
+    '/api/location/stream/': location_stream,
+}
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await get_broadcaster().stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    if scope['type'] != 'http':
+        return
+    handler = ROUTES.get(scope['path'], dispatch)
+    await handler(scope, receive, send)
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'people.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'test_people_segmentation.urls'
@@ -86,6 +87,9 @@ DATABASES = {
         'PORT': '5432',
     }
 }
+# A second connection to the primary, mirrored by the test database, so the
+# tests can tell replica reads from primary writes. A real replica goes here
+DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
 
 
 # Password validation
@@ -126,11 +130,110 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# people.renderers.FastJSON* are orjson based drop-in replacements of
+# rest_framework.renderers.JSONRenderer and rest_framework.parsers.JSONParser
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'people.renderers.FastJSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'people.renderers.FastJSONParser',
     ]
 }
+
+# Offline name -> gender dictionary consulted before the Genderize API
+GENDER_INDEX_PATH = os.path.join(BASE_DIR, 'people', 'gender_index_data',
+                                 'names.tsv')
+# Writable directory the names learned from Genderize are appended to until
+# "manage.py build_gender_index" merges them, keep it outside the package
+GENDER_INDEX_LEARNED_DIR = os.path.join(BASE_DIR, 'gender_index_learned')
+
+# people_person is partitioned by month (PostgreSQL), see
+# "manage.py person_partitions"
+PERSON_PARTITION_MONTHS_AHEAD = 3
+# Age in days after which whole partitions are dropped, None keeps everything
+PERSON_RETENTION_DAYS = None
+
+# Maximum number of names (and of ids) accepted by /api/location/lookup/
+LOCATION_LOOKUP_MAX_SIZE = 1000
+
+# Server-Sent Events stream served by asgi.py
+SSE_POLL_INTERVAL = 1.0
+SSE_HEARTBEAT = 15
+SSE_SEND_TIMEOUT = 10
+SSE_MAX_PENDING = 10000
+
+# Threads running the synchronous Django handler in the ASGI deployment
+ASGI_THREADS = 20
+# Threads sending the (blocking) upstream requests of the ASGI deployment,
+# the most upstream requests in flight at once
+ASGI_UPSTREAM_THREADS = 16
+
+# The aggregate endpoints and the SSE poller read from this alias, point
+# DATABASES['replica'] to a replica of the primary and put 'replica' here
+DATABASE_ROUTERS = ['people.routers.ReplicaRouter']
+READ_REPLICA_DATABASE = 'default'
+# Run the API workers inside GET /api/location/ before listing. Turn it off
+# when people are ingested by "manage.py ingest", the cached responses then
+# stay valid until something actually changes
+INGEST_ON_REQUEST = True
+
+# Seconds a client that triggered ingestion keeps reading from the primary,
+# 0 disables the read-your-writes window
+READ_YOUR_WRITES_SECONDS = 0
+
+# Cache of the rendered aggregate responses in every encoding, the entries
+# of a generation are obsolete as soon as locations change
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Profile a request with ?_profile=1 or the "X-Profile: 1" header (staff
+# users, or anybody in DEBUG), see people.profiling
+PROFILING_ENABLED = False
+PROFILING_TOP_FUNCTIONS = 30
+# Directory the .prof file of each profiled request is saved to, None to skip
+PROFILING_DIR = None
+
+# Admin changelists count exactly below this many estimated rows and show
+# the PostgreSQL planner estimate above it
+ADMIN_EXACT_COUNT_LIMIT = 100000
+
+# Request control per upstream host, "default" applies to every host and
+# can be overridden per host, e.g. 'api.genderize.io': {'rate': 1}.
+# rate and burst: token bucket (requests per second), max_concurrency:
+# upper bound of the adaptive concurrency limit, failure_threshold and
+# reset_timeout: circuit breaker, acquire_timeout: longest wait for a slot
+# before failing fast, latency_threshold: seconds after which an answer
+# counts as overload, timeout: HTTP timeout
+UPSTREAM_CONTROL = {
+    'default': {
+        'rate': 10,
+        'burst': 20,
+        'max_concurrency': 8,
+        'failure_threshold': 5,
+        'reset_timeout': 30,
+        'acquire_timeout': 5,
+        'latency_threshold': 5,
+        'timeout': 10,
+    },
+}
+
+# How the API workers reach the upstream APIs, see people.transport:
+# 'live', 'record' (live and store every response), 'replay' (stored
+# responses only, no network) or 'cache' (stored responses, recording the
+# missing ones)
+UPSTREAM_TRANSPORT = 'live'
+UPSTREAM_STORE_DIR = os.path.join(BASE_DIR, 'upstream_store')
+
+# API workers run by every ingestion, see people.workers. class: dotted
+# path, imported on first ingestion, params: request params (batch size),
+# interval: minimum seconds between two runs of the worker in a process
+INGESTION_WORKERS = [
+    {'class': 'people.service.RandomUserApiWorker', 'params': {'results': 5}},
+    {'class': 'people.service.UINamesApiWorker', 'params': {'amount': 10}},
+    {'class': 'people.service.JsonPlaceholderApiWorker'},
+]
+
+# Age in days after which IngestionRun rows are deleted by
+# "manage.py prune_ingestion_runs", None keeps everything
+INGESTION_RUN_RETENTION_DAYS = 90